@@ -29,10 +29,12 @@ import shutil
 import string
 import subprocess
 import sys
+import threading
 
 from builtins import range # pylint: disable=redefined-builtin
 from builtins import object # pylint: disable=redefined-builtin
 from future.moves.urllib.parse import parse_qs
+from future.utils import raise_
 from zc.buildout import UserError
 from zc.buildout.download import Download
 
@@ -103,6 +105,7 @@ class BaseRecipe(object): # pylint: disable=too-many-public-methods,too-many-ins
     def __init__(self, buildout, name, options):
         self.logger = logging.getLogger(__name__)
         self.cleanup_paths = set()
+        self.downloads = {}
         self.name = name
         self.options = OptionRepository(options, name=self.name)
         self.buildout = buildout
@@ -198,6 +201,11 @@ class BaseRecipe(object): # pylint: disable=too-many-public-methods,too-many-ins
         return self.buildout['buildout'].get(
             'parts-directory', os.path.join(self.buildout_directory, 'parts'))
 
+    @property
+    @reify
+    def state_directory(self):
+        return os.path.join(self.buildout_directory, '.dockeroo')
+
     @property
     @reify
     def default_location(self):
@@ -271,7 +279,22 @@ class BaseRecipe(object): # pylint: disable=too-many-public-methods,too-many-ins
             self.uninstall = self.uninstall_wrapper
 
     def download(self, url, params=None, force=False):
-        return self.filterset('download', [url.strip()], {'params': params or {}, 'force': force})
+        # Each url is fetched once per run, whether by prefetch or by the part itself.
+        url = url.strip()
+        if not force and url in self.downloads:
+            return self.downloads[url].copy()
+        result = self.filterset('download', [url], {'params': params or {}, 'force': force})
+        if result is not None:
+            self.downloads[url] = result.copy()
+        return result
+
+    def prefetch(self): # pylint: disable=no-self-use
+        """
+        Returns the (key, callable) pairs fetching what the part needs from the
+        network, as run by the :py:mod:`dockeroo.prefetch` extension. Callables
+        sharing a key run one after the other.
+        """
+        return []
 
     def extract_archive(self, src, dst, params=None):
         return self.filterset('extract.archive', [src.strip(), dst], {'params': params or {}})
@@ -593,6 +616,9 @@ class BaseSubRecipe(object):
     def completed(self):
         return os.path.join(self.location, '.completed')
 
+    def prefetch(self): # pylint: disable=no-self-use
+        return []
+
     def mark_completed(self, files=None):
         self.recipe.mkdir(self.location)
         with open(self.completed, 'a'):
@@ -600,6 +626,46 @@ class BaseSubRecipe(object):
         return (files or []) + [self.completed]
 
 
+class GroupLogFilter(logging.Filter):
+    """
+    Prefixes the records emitted by a thread with the name of the group it is running.
+    Added to handlers, it also sees the records propagated from child loggers, and
+    prefixes each record once however many of its handlers it is added to.
+
+    Example:
+
+        >>> class Collector(logging.Handler):
+        ...     messages = []
+        ...     def emit(self, record):
+        ...         self.messages.append(record.getMessage())
+        >>> log_filter = GroupLogFilter()
+        >>> logger = logging.getLogger('group_log_filter')
+        >>> logger.propagate = False
+        >>> for handler in (Collector(), Collector()):
+        ...     handler.addFilter(log_filter)
+        ...     logger.addHandler(handler)
+        >>> log_filter.local.group = 'a'
+        >>> logging.getLogger('group_log_filter.child').warning('hello %s', 'world')
+        >>> Collector.messages
+        ['[a] hello world', '[a] hello world']
+        >>> logger.handlers = []
+    """
+
+    def __init__(self):
+        super(GroupLogFilter, self).__init__()
+        self.local = threading.local()
+
+    def filter(self, record):
+        group = getattr(self.local, 'group', None)
+        if group is not None:
+            prefixed = record.__dict__.setdefault('group_filters', set())
+            if self not in prefixed:
+                prefixed.add(self)
+                record.msg = '[{}] {}'.format(group, record.getMessage())
+                record.args = ()
+        return True
+
+
 class BaseGroupRecipe(BaseRecipe):
     subrecipe_class = NotImplemented
 
@@ -628,13 +694,145 @@ class BaseGroupRecipe(BaseRecipe):
         self.update = self.update_wrapper
         self.subrecipes = dict()
 
+    @property
+    @reify
+    def parallel(self):
+        parallel = self.options.get('parallel', '1')
+        try:
+            return max(1, int(parallel))
+        except ValueError:
+            raise UserError('''Invalid parallel "{}"'''.format(parallel))
+
+    def group_dependencies(self, reverse=False):
+        """
+        Maps every group to the set of groups it must wait for, as listed in its
+        "depends-on" option. With **reverse**, dependents come first instead.
+        """
+        dependencies = dict([(x, set()) for x in self.subrecipes])
+        for group, subrecipe in self.subrecipes.items():
+            for dependency in subrecipe.options.get('depends-on', '').split():
+                if dependency not in self.subrecipes:
+                    raise UserError('''Group "{}" depends on unknown group "{}"'''.format(
+                        group, dependency))
+                if reverse:
+                    dependencies[dependency].add(group)
+                else:
+                    dependencies[group].add(dependency)
+        return dependencies
+
+    @staticmethod
+    def sorted_groups(dependencies):
+        """
+        Example:
+
+            >>> BaseGroupRecipe.sorted_groups({'a': {'b'}, 'b': set(), 'c': {'a', 'b'}})
+            ['b', 'a', 'c']
+            >>> BaseGroupRecipe.sorted_groups({'a': {'b'}, 'b': {'a'}}) # doctest: +IGNORE_EXCEPTION_DETAIL
+            Traceback (most recent call last):
+                ...
+            UserError: Circular dependency among groups: a, b
+        """
+        order = []
+        pending = sorted(dependencies, key=lambda x: (x is not None, x))
+        while pending:
+            ready = [x for x in pending if dependencies[x] <= set(order)]
+            if not ready:
+                raise UserError('''Circular dependency among groups: {}'''.format(
+                    ', '.join([str(x) for x in pending])))
+            order.extend(ready)
+            pending = [x for x in pending if x not in ready]
+        return order
+
+    def run_group(self, group, name, *args, **kwargs):
+        attr = getattr(self.subrecipes[group], name, None)
+        if callable(attr):
+            attr(*args, **kwargs)
+        elif attr is not None:
+            exec(attr) # pylint: disable=exec-used
+
+    def prefetch(self):
+        return list(chain(*[x.prefetch() for x in self.subrecipes.values()]))
+
     def run_target(self, name, *args, **kwargs):
-        for group in self.subrecipes:
-            attr = getattr(self.subrecipes[group], name, None)
-            if callable(attr):
-                attr(*args, **kwargs)
-            elif attr is not None:
-                exec(attr) # pylint: disable=exec-used
+        dependencies = self.group_dependencies(reverse=(name == 'uninstall'))
+        order = self.sorted_groups(dependencies)
+        if self.parallel < 2 or len(order) < 2:
+            for group in order:
+                self.run_group(group, name, *args, **kwargs)
+            return
+        self.run_parallel(order, dependencies, name, *args, **kwargs)
+
+    def run_parallel(self, order, dependencies, name, *args, **kwargs):
+        """
+        Runs groups in up to "parallel" threads, each group starting once its
+        dependencies are done. The first failure stops scheduling further groups
+        and is raised once the running ones complete.
+
+        Example:
+
+            >>> class Groups(BaseGroupRecipe):
+            ...     name = 'part'
+            ...     parallel = 2
+            ...     log_handler = logging.NullHandler()
+            ...     def __init__(self):
+            ...         self.ran = []
+            ...     def run_group(self, group, name):
+            ...         self.ran.append(group)
+            >>> recipe = Groups()
+            >>> recipe.run_parallel([None, 'a', 'b'], {None: set(), 'a': {None}, 'b': set()},
+            ...                     'install')
+            >>> sorted(recipe.ran, key=str)
+            [None, 'a', 'b']
+        """
+        log_filter = GroupLogFilter()
+        condition = threading.Condition()
+        state = {'pending': list(order), 'done': set(), 'failure': None}
+        finished = object()
+
+        def next_group():
+            with condition:
+                while state['failure'] is None and state['pending']:
+                    for group in state['pending']:
+                        if dependencies[group] <= state['done']:
+                            state['pending'].remove(group)
+                            return group
+                    condition.wait()
+            return finished
+
+        def worker():
+            group = next_group()
+            while group is not finished:
+                log_filter.local.group = self.name if group is None else group
+                try:
+                    self.run_group(group, name, *args, **kwargs)
+                except Exception: # pylint: disable=broad-except
+                    with condition:
+                        if state['failure'] is None:
+                            state['failure'] = sys.exc_info()
+                        condition.notify_all()
+                    return
+                finally:
+                    log_filter.local.group = None
+                with condition:
+                    state['done'].add(group)
+                    condition.notify_all()
+                group = next_group()
+
+        self.log_handler.addFilter(log_filter)
+        try:
+            threads = [threading.Thread(target=worker)
+                       for _ in range(min(self.parallel, len(order)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.log_handler.removeFilter(log_filter)
+        if state['failure'] is not None:
+            if state['pending']:
+                self.logger.error('Cancelled groups: %s', ', '.join(
+                    [self.name if x is None else x for x in state['pending']]))
+            raise_(*state['failure'])
 
     def install_target(self):
         return self.run_target('install')
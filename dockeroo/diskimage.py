@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Assembly of partitioned disk images on the host, without privileges: a root
+filesystem archive is extracted under **fakeroot** into a staging directory,
+then each partition is created at its offset in a sparse image file by
+**mke2fs -d**, **mkfs.vfat** and **mcopy** or **mkswap**, after **sfdisk**
+wrote the partition table.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from distutils.spawn import find_executable
+import logging
+import os
+import re
+from shutil import rmtree
+from subprocess import Popen, PIPE
+import tempfile
+
+from zc.buildout import UserError
+
+from dockeroo.utils import ExternalProcessError, copy_sparse, mkdir
+
+
+SECTOR_SIZE = 512
+
+ALIGNMENT = 1 << 20
+
+FILESYSTEMS = ('ext2', 'ext3', 'ext4', 'swap', 'vfat')
+
+PARTITION_TABLES = ('dos', 'gpt')
+
+# sfdisk partition types, by partition table and filesystem.
+PARTITION_TYPES = {
+    'dos': {'vfat': 'c', 'swap': 'S'},
+    'gpt': {'vfat': 'U', 'swap': 'S'},
+}
+
+SIZE_RE = re.compile(r'^(\d+)([KMGT]?)$', re.IGNORECASE)
+
+Partition = namedtuple('Partition', ['mountpoint', 'filesystem', 'size', 'label'])
+
+
+def parse_size(value):
+    """
+    Returns the number of bytes of **value**, with an optional K, M, G or T
+    binary suffix.
+
+    Example:
+
+        >>> parse_size('130M'), parse_size('2g'), parse_size('4096')
+        (136314880, 2147483648, 4096)
+    """
+    match = SIZE_RE.match(value.strip())
+    if match is None:
+        raise UserError('''Invalid size "{}"'''.format(value))
+    return int(match.group(1)) << (10 * ' KMGT'.index(match.group(2).upper() or ' '))
+
+
+def parse_partitions(value):
+    """
+    Parses **value**, one "<mountpoint> <filesystem> <size> [<label>]" line
+    per partition, in disk order. The mountpoint of swap partitions is "none"
+    and the size of at most one partition is "*", the space left.
+
+    Example:
+
+        >>> for x in parse_partitions('''
+        ...     /boot vfat 130M BOOT
+        ...     none swap 512M
+        ...     / ext4 *
+        ... '''):
+        ...     print(x)
+        Partition(mountpoint='/boot', filesystem='vfat', size=136314880, label='BOOT')
+        Partition(mountpoint=None, filesystem='swap', size=536870912, label=None)
+        Partition(mountpoint='/', filesystem='ext4', size=None, label=None)
+    """
+    partitions = []
+    for line in value.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) not in (3, 4):
+            raise UserError('''Invalid partition "{}"'''.format(line.strip()))
+        mountpoint, filesystem, size = fields[:3]
+        if filesystem not in FILESYSTEMS:
+            raise UserError('''Invalid filesystem "{}", must be one of: {}'''.format(
+                filesystem, ', '.join(FILESYSTEMS)))
+        if (mountpoint == 'none') != (filesystem == 'swap'):
+            raise UserError('''Invalid mountpoint "{}" for filesystem "{}"'''.format(
+                mountpoint, filesystem))
+        partitions.append(Partition(
+            None if mountpoint == 'none' else '/' + mountpoint.strip('/'),
+            filesystem, None if size == '*' else parse_size(size),
+            fields[3] if len(fields) == 4 else None))
+    if len([x for x in partitions if x.size is None]) > 1:
+        raise UserError('''Only one partition can take the space left''')
+    return partitions
+
+
+def layout_partitions(partitions, image_size, table='dos'):
+    """
+    Returns a (start, size) tuple in bytes for each of **partitions**, aligned
+    to 1 MiB within an image of **image_size** bytes, or of the size needed
+    when it is None.
+
+    Example:
+
+        >>> partitions = parse_partitions('/boot vfat 130M\\nnone swap 512M\\n/ ext4 *')
+        >>> [(x >> 20, y >> 20) for x, y in layout_partitions(partitions, 2 << 30)]
+        [(1, 130), (131, 512), (643, 1405)]
+        >>> [(x >> 20, y >> 20) for x, y in layout_partitions(partitions, 2 << 30, 'gpt')]
+        [(1, 130), (131, 512), (643, 1404)]
+        >>> layout_partitions(partitions[:2], None)[-1][0] >> 20
+        131
+    """
+    def align(value):
+        return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    # The backup GPT header takes the end of the disk.
+    end = image_size - (ALIGNMENT if table == 'gpt' else 0) \
+        if image_size is not None else None
+    fixed = sum([align(x.size) for x in partitions if x.size is not None])
+    if end is not None and ALIGNMENT + fixed > end:
+        raise UserError('''Partitions don't fit in {} bytes'''.format(image_size))
+    layout = []
+    start = ALIGNMENT
+    for partition in partitions:
+        if partition.size is not None:
+            size = align(partition.size)
+        elif end is None:
+            raise UserError('''A partition takes the space left but image-size is not set''')
+        else:
+            size = (end - ALIGNMENT - fixed) // ALIGNMENT * ALIGNMENT
+        layout.append((start, size))
+        start += size
+    return layout
+
+
+def image_size_of(layout, table='dos'):
+    """
+    Returns the size of an image holding **layout**.
+    """
+    return (layout[-1][0] + layout[-1][1] if layout else ALIGNMENT) + \
+        (ALIGNMENT if table == 'gpt' else 0)
+
+
+def partition_script(partitions, layout, table='dos'):
+    """
+    Returns the **sfdisk** script creating **partitions** at **layout**. On
+    a dos partition table, the partition holding "/boot" is made bootable.
+
+    Example:
+
+        >>> partitions = parse_partitions('/boot vfat 130M\\nnone swap 512M\\n/ ext4 *')
+        >>> print(partition_script(partitions, layout_partitions(partitions, 2 << 30)))
+        label: dos
+        start=2048, size=266240, type=c, bootable
+        start=268288, size=1048576, type=S
+        start=1316864, size=2877440, type=L
+        <BLANKLINE>
+    """
+    mountpoints = [x.mountpoint for x in partitions]
+    boot = '/boot' if '/boot' in mountpoints else '/'
+    lines = ['label: {}'.format(table)]
+    for partition, (start, size) in zip(partitions, layout):
+        line = 'start={}, size={}, type={}'.format(
+            start // SECTOR_SIZE, size // SECTOR_SIZE,
+            PARTITION_TYPES[table].get(partition.filesystem, 'L'))
+        if table == 'dos' and partition.mountpoint == boot:
+            line += ', bootable'
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+class DiskImage(object):
+    """
+    Partitioned disk image at **path**, assembled from a root filesystem
+    archive streamed into **writer()**.
+    """
+
+    def __init__(self, path, partitions, size=None, table='dos', logger=None): # pylint: disable=too-many-arguments
+        if table not in PARTITION_TABLES:
+            raise UserError('''Invalid partition table "{}", must be one of: {}'''.format(
+                table, ', '.join(PARTITION_TABLES)))
+        self.path = path
+        self.partitions = partitions
+        self.table = table
+        self.layout = layout_partitions(partitions, size, table)
+        self.size = size if size is not None else image_size_of(self.layout, table)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.staging = None
+        self.fakeroot_state = None
+
+    @contextmanager
+    def assembling(self):
+        """
+        Context manager providing a staging directory, removed on exit.
+        """
+        self.staging = tempfile.mkdtemp(prefix='dockeroo-diskimage-')
+        self.fakeroot_state = os.path.join(self.staging, 'fakeroot.state')
+        try:
+            yield self
+        finally:
+            rmtree(self.staging)
+            self.staging = self.fakeroot_state = None
+
+    def fakeroot(self, args):
+        if os.geteuid() == 0:
+            return args
+        if find_executable('fakeroot') is None:
+            raise UserError('''fakeroot is needed to build disk images as a regular user''')
+        if os.path.exists(self.fakeroot_state):
+            return ['fakeroot', '-i', self.fakeroot_state, '-s', self.fakeroot_state, '--'] + args
+        return ['fakeroot', '-s', self.fakeroot_state, '--'] + args
+
+    def run(self, args, msg, stdin=None, env=None):
+        self.logger.debug("Running command: %s", ' '.join(args))
+        custom_env = os.environ.copy()
+        custom_env.update(env or {})
+        with open(os.devnull, 'r+b') as devnull:
+            # Tools like mke2fs may prompt on a terminal.
+            proc = Popen(args, stdin=PIPE if stdin is not None else devnull, stdout=devnull,
+                         stderr=PIPE, close_fds=True, env=custom_env)
+            if stdin is not None:
+                proc.stdin.write(stdin)
+                proc.stdin.close()
+            if proc.wait() != 0:
+                raise ExternalProcessError(msg, proc)
+
+    def writer(self):
+        """
+        Returns a process whose **stdin** accepts the root filesystem archive.
+        """
+        root = os.path.join(self.staging, 'root')
+        mkdir(root)
+        return Popen(self.fakeroot(['tar', '-xpf', '-', '--numeric-owner', '-C', root]),
+                     stdin=PIPE, stderr=PIPE, close_fds=True)
+
+    def split(self):
+        # Moves the content of every mountpoint into its own tree, deepest first,
+        # leaving the mountpoint itself empty.
+        root = os.path.join(self.staging, 'root')
+        trees = {}
+        for index, partition in sorted(
+                enumerate(self.partitions),
+                key=lambda x: -len((x[1].mountpoint or '').strip('/').split('/'))):
+            if partition.mountpoint is None:
+                continue
+            if partition.mountpoint == '/':
+                trees[index] = root
+                continue
+            tree = os.path.join(self.staging, 'partition{}'.format(index))
+            source = os.path.join(root, partition.mountpoint.lstrip('/'))
+            if os.path.isdir(source):
+                os.rename(source, tree)
+            else:
+                mkdir(tree)
+            mkdir(source)
+            trees[index] = tree
+        return trees
+
+    def build(self):
+        """
+        Creates the sparse image file, its partition table and its filesystems.
+        """
+        trees = self.split()
+        self.logger.info("Creating disk image \"%s\", %d bytes", self.path, self.size)
+        with open(self.path, 'wb') as fileobj:
+            fileobj.truncate(self.size)
+        self.run(['sfdisk', '--no-reread', '--no-tell-kernel', '-q', self.path],
+                 "Error partitioning disk image \"{}\"".format(self.path),
+                 stdin=partition_script(self.partitions, self.layout, self.table).encode())
+        for index, (partition, (start, size)) in enumerate(zip(self.partitions, self.layout)):
+            msg = "Error creating partition {} of disk image \"{}\"".format(index + 1, self.path)
+            self.logger.info("Creating %s filesystem on partition %d%s", partition.filesystem,
+                             index + 1, " for \"{}\"".format(partition.mountpoint)
+                             if partition.mountpoint else "")
+            label = partition.label
+            if partition.filesystem == 'swap':
+                # mkswap can't write at an offset before util-linux 2.39.
+                swap = os.path.join(self.staging, 'partition{}.swap'.format(index))
+                with open(swap, 'wb') as fileobj:
+                    fileobj.truncate(size)
+                self.run(['mkswap'] + (['-L', label] if label else []) + [swap], msg)
+                with open(swap, 'rb') as fin, open(self.path, 'r+b') as fout:
+                    copy_sparse(fin, fout, size, offset=start)
+                os.remove(swap)
+            elif partition.filesystem == 'vfat':
+                self.run(['mkfs.vfat', '--offset', str(start // SECTOR_SIZE)] +
+                         (['-n', label] if label else []) +
+                         [self.path, str(size // 1024)], msg)
+                entries = sorted(os.listdir(trees[index]))
+                if entries:
+                    self.run(['mcopy', '-s', '-p', '-Q', '-i', '{}@@{}'.format(self.path, start)] +
+                             [os.path.join(trees[index], x) for x in entries] + ['::/'],
+                             msg, env={'MTOOLS_SKIP_CHECK': '1'})
+            else:
+                self.run(self.fakeroot(
+                    ['mke2fs', '-q', '-F', '-t', partition.filesystem,
+                     '-E', 'offset={}'.format(start), '-d', trees[index]] +
+                    (['-L', label] if label else []) +
+                    [self.path, '{}k'.format(size // 1024)]), msg)
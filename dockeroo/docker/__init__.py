@@ -17,16 +17,25 @@
 
 
 from __future__ import absolute_import
-from copy import deepcopy
+from contextlib import contextmanager
+from copy import copy, deepcopy
 from datetime import datetime
+from fnmatch import fnmatchcase
+from importlib import import_module
+import errno
+import hashlib
+from io import BytesIO
+import json
 import logging
 import os
 import platform
 import re
 from shutil import rmtree
+import sys
 from subprocess import Popen, PIPE, STDOUT
 import tarfile
 import tempfile
+import threading
 import time
 
 from builtins import map # pylint: disable=redefined-builtin
@@ -34,34 +43,115 @@ from builtins import str # pylint: disable=redefined-builtin
 from builtins import object # pylint: disable=redefined-builtin
 from distutils.dir_util import copy_tree
 from future import standard_library
-import tzlocal
+from shellescape import quote as shell_quote
 from zc.buildout import UserError
 from zc.buildout.download import Download
 
 from dockeroo import BaseRecipe, BaseSubRecipe
-from dockeroo.docker_machine import DockerMachine
-from dockeroo.utils import ExternalProcessError
-from dockeroo.utils import reify, parse_datetime, random_name, listify
-from dockeroo.utils import mkdir
+from dockeroo.docker.cache import ListingCache
+from dockeroo.docker.listing import parse_container, parse_image
+from dockeroo.docker_machine import DockerMachine, DockerMachineCache, DEFAULT_CACHE_TTL
+from dockeroo.utils import CompressingWriter, DigestSet, ExternalProcessError
+from dockeroo.utils import compression_of, copy_sparse, decompressing
+from dockeroo.utils import COMPRESSED_EXTENSIONS, TRANSFER_CODECS
+from dockeroo.utils import reify, random_name, listify
+from dockeroo.utils import diff_layout, mkdir, quote, relay, scan_layout
+from dockeroo.utils import stream_members, string_as_bool
+from dockeroo.utils import TeeWriter
 
 standard_library.install_aliases()
 
 DEFAULT_TIMEOUT = 180
 
+# Compressions every docker import accepts, zstd needs a recent daemon.
+DOCKER_IMPORT_COMPRESSIONS = (None, 'gz', 'bz2', 'xz')
+
 FNULL = open(os.devnull, 'w')
 
-SEPARATOR = '|'
+RUNNING_STATUSES = ('paused', 'restarting', 'running')
+
+SCRATCH_IMAGE = 'dockeroo/scratch:latest'
+
+INSPECT_KINDS = {
+    'container': 'containers',
+    'image': 'images',
+    'network': 'networks',
+    'volume': 'volumes',
+}
+
+ENGINE_BACKENDS = {
+    'api': 'dockeroo.docker.api:DockerAPIEngine',
+    'cli': 'dockeroo.docker:DockerEngine',
+}
+
+
+def match_image_reference(name, repository, tag):
+    """
+    Matches an image against a **docker images** reference argument:
+    a repository name selects all of its tags, "repository:tag" a single one.
+    Shell-style wildcards are accepted as with **docker images**.
+
+    Example:
+
+        >>> match_image_reference('ubuntu', 'ubuntu', '16.04')
+        True
+        >>> match_image_reference('ubuntu:14.04', 'ubuntu', '16.04')
+        False
+        >>> match_image_reference('dockeroo/*:latest', 'dockeroo/builder', 'latest')
+        True
+        >>> match_image_reference('ubuntu', None, None)
+        False
+    """
+    if repository is None:
+        return False
+    ref_repository, _, ref_tag = name.rpartition(':')
+    if not ref_repository or '/' in ref_tag:
+        ref_repository, ref_tag = name, None
+    if not fnmatchcase(repository, ref_repository):
+        return False
+    return ref_tag is None or (tag is not None and fnmatchcase(tag, ref_tag))
+
+
+def inspect_matches(kind, name, record):
+    """
+    Tells whether **record**, as returned by **docker inspect**, is the object
+    of **kind** referenced by **name**.
+
+    Example:
+
+        >>> inspect_matches('container', 'web', {'Id': 'f00ba4', 'Name': '/web'})
+        True
+        >>> inspect_matches('container', 'f00b', {'Id': 'f00ba4', 'Name': '/web'})
+        True
+        >>> inspect_matches('image', 'ubuntu', {'Id': 'sha256:0123', 'RepoTags': ['ubuntu:latest']})
+        True
+        >>> inspect_matches('image', '0123', {'Id': 'sha256:0123', 'RepoTags': []})
+        True
+        >>> inspect_matches('volume', 'data', {'Name': 'data2'})
+        False
+    """
+    if kind == 'image':
+        repo_tags = record.get('RepoTags') or []
+        if name in repo_tags or "{}:latest".format(name) in repo_tags:
+            return True
+        return record.get('Id', '').split(':', 1)[-1].startswith(name.split(':', 1)[-1])
+    if name == (record.get('Name') or '').lstrip('/'):
+        return True
+    return kind != 'volume' and record.get('Id', '').startswith(name)
 
 
 class Archive(object):
 
-    def __init__(self, url=None, path=None, prefix=None, md5sum=None):
+    def __init__(self, url=None, path=None, prefix=None, md5sum=None, decompressor='auto'): # pylint: disable=too-many-arguments
         self.url = url
         self.path = path
         self.prefix = prefix
         self.md5sum = md5sum
+        self.decompressor = decompressor
 
     def download(self, buildout):
+        if self.path is not None:
+            return
         download = Download(buildout['buildout'], hash_name=False)
         self.path, _ = download(self.url, md5sum=self.md5sum)
 
@@ -108,12 +198,21 @@ class DockerRegistryLogin(object): # pylint: disable=too-few-public-methods
 
 
 class DockerEngine(object): # pylint: disable=too-many-public-methods
+    probes = (('url',), ('tlsverify', 'tlscertpath'), ('platform',))
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+    _freeze_payloads = {}
+    _artifact_lock = threading.Lock()
 
     def __init__(self, logger=None, url=None, tlsverify=None, tlscertpath=None, machine_name=None,
-                 shell='/bin/sh', timeout=DEFAULT_TIMEOUT):
+                 shell='/bin/sh', timeout=DEFAULT_TIMEOUT, cache=True, machine_cache=None,
+                 transfer_compression=None):
         self.logger = logger or logging.getLogger(__name__)
         self.shell = shell
         self.timeout = timeout
+        self.transfer_compression = transfer_compression
+        self.transferred = {'raw': 0, 'compressed': 0}
         self._tlscertpath = tlscertpath
         self._tlsverify = tlsverify
         self._url = url
@@ -121,13 +220,70 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
         if machine_name is None:
             machine_name = os.environ.get('DOCKER_MACHINE_NAME', None)
         if machine_name is not None:
-            self.machine = DockerMachine(machine_name, logger=self.logger)
+            self.machine = DockerMachine(machine_name, logger=self.logger, cache=machine_cache)
         else:
-            if DockerMachine.machines(name='default'):
-                self.machine = DockerMachine('default', logger=self.logger)
+            if DockerMachine.machines(cache=machine_cache, name='default'):
+                self.machine = DockerMachine('default', logger=self.logger, cache=machine_cache)
             else:
                 self.machine = None
 
+        # Keyed on the endpoint only: the CLI and API backends share listings.
+        self.cache = ListingCache.shared(
+            (self.machine.name if self.machine is not None else None,
+             url, tlsverify, tlscertpath)) if cache else None
+
+    @classmethod
+    def shared(cls, logger=None, shell='/bin/sh', timeout=DEFAULT_TIMEOUT, # pylint: disable=too-many-arguments
+               transfer_compression=None, **kwargs):
+        """
+        Returns an engine bound to **logger**, **shell**, **timeout** and
+        **transfer_compression**, sharing machine lookup, endpoint and platform
+        with every other engine of the same class created with the same **kwargs**
+        in this process. The first engine for a given key is probed once, see
+        :py:meth:`probe`.
+        """
+        key = (cls,) + tuple(sorted(kwargs.items()))
+        with cls._registry_lock:
+            engine = cls._registry.get(key)
+            if engine is None:
+                engine = cls(logger=logger, shell=shell, timeout=timeout, **kwargs)
+                engine.probe()
+                cls._registry[key] = engine
+        return engine.bind(logger=logger, shell=shell, timeout=timeout,
+                           transfer_compression=transfer_compression)
+
+    def bind(self, logger=None, shell=None, timeout=None, transfer_compression=None):
+        """
+        Returns a copy of this engine with its own **logger**, **shell**,
+        **timeout**, **transfer_compression** and byte counts, sharing everything
+        resolved so far.
+        """
+        engine = copy(self)
+        engine.logger = logger or self.logger
+        engine.shell = shell or self.shell
+        engine.timeout = timeout or self.timeout
+        engine.transfer_compression = transfer_compression or self.transfer_compression
+        engine.transferred = {'raw': 0, 'compressed': 0}
+        return engine
+
+    def probe(self):
+        """
+        Resolves the attributes listed in **probes** concurrently, one thread
+        per tuple. Failures are left to surface when the attribute is used.
+        """
+        def resolve(attributes):
+            for attribute in attributes:
+                try:
+                    getattr(self, attribute)
+                except Exception as error: # pylint: disable=broad-except
+                    self.logger.debug("Probing %s failed: %s", attribute, error)
+                    return
+        threads = [threading.Thread(target=resolve, args=(x,)) for x in self.probes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
     @property
     @reify
     def client_environment(self):
@@ -236,16 +392,90 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
         else:
             return None
 
+    def archive_reader(self, container, path):
+        """
+        Returns a process-like object whose **stdout** streams a tar archive of
+        **path** on **container**.
+        """
+        return DockerProcess(self, ['cp', "{}:{}".format(container, path), "-"], stdout=PIPE)
+
+    def archive_writer(self, container, path):
+        """
+        Returns a process-like object whose **stdin** accepts a tar archive
+        to be extracted into **path** on **container**.
+        """
+        return DockerProcess(self, ['cp', "-", "{}:{}".format(container, path)], stdin=PIPE)
+
+    def export_reader(self, container):
+        """
+        Returns a process-like object whose **stdout** streams a tar archive of
+        the whole filesystem of **container**.
+        """
+        return DockerProcess(self, ['export', container], stdout=PIPE)
+
+    @staticmethod
+    def archive_top(path):
+        """
+        Returns the name **archive_reader()** gives to **path** in its archive.
+
+        Example:
+
+            >>> DockerEngine.archive_top('/usr/lib/'), DockerEngine.archive_top('/bin/sh')
+            ('lib', 'sh')
+        """
+        return os.path.basename(path.rstrip('/')) or '.'
+
+    def paths_reader(self, container, paths):
+        """
+        Returns a process-like object whose **stdout** streams a single tar archive
+        of all **paths** on running **container**, in order, members being named
+        as **archive_reader()** names them.
+        """
+        args = ['exec', container, 'tar', '-cf', '-']
+        for path in paths:
+            path = path.rstrip('/') or '/'
+            args += ['-C', os.path.dirname(path), self.archive_top(path)]
+        return DockerProcess(self, args, stdout=PIPE)
+
+    @staticmethod
+    def split_members(members, tops):
+        """
+        Yields each of **members** of a **paths_reader()** archive along with the
+        index of the path it belongs to, given the archive names **tops** of the
+        paths. A path copied twice is told apart by its name repeating.
+
+        Example:
+
+            >>> names = ['lib', 'lib/a', 'sh', 'sh', 'lib', 'lib/a']
+            >>> members = [tarfile.TarInfo(x) for x in names]
+            >>> [x for x, _ in DockerEngine.split_members(members, ['lib', 'sh', 'sh', 'lib'])]
+            [0, 0, 1, 2, 3, 3]
+        """
+        index = 0
+        seen = False
+        for tarinfo in members:
+            name = tarinfo.name.rstrip('/')
+            while index < len(tops) - 1 and tops[index] is not None:
+                top = tops[index]
+                if (name == top and not seen) or \
+                        (name != top and name.startswith(top + '/')):
+                    break
+                index += 1
+                seen = False
+            seen = seen or name == tops[index]
+            yield index, tarinfo
+
     def build_dockerfile(self, tag, path, **kwargs):
         self.logger.info("Building Dockerfile from context \"%s\"", path)
         args = ['build', '-t', tag]
         for key, value in kwargs.items():
             args += ['--build-arg', '{}={}'.format(key, value)]
         args.append(path)
-        proc = DockerProcess(self, args)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error building Dockerfile from context \"{}\"".format(path), proc)
+        with self.mutating('images'):
+            proc = DockerProcess(self, args)
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error building Dockerfile from context \"{}\"".format(path), proc)
 
     def clean_stale_images(self):
         for image in self.images(dangling='true'):
@@ -271,72 +501,173 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
         for volume in volumes or []:
             args.append("--change='VOLUME {}'".format(volume))
         args += [container, image]
-        proc = DockerProcess(self, args, stdout=FNULL)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error committing container \"{}\"".format(container), proc)
+        with self.mutating('images'):
+            proc = DockerProcess(self, args, stdout=FNULL)
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error committing container \"{}\"".format(container), proc)
+
+    def compressing(self, proc):
+        """
+        Makes the **stdin** of **proc**, an archive or import writer, compress
+        what is written to it as set by **transfer_compression**, a (codec, level)
+        tuple, and returns **proc**. Byte counts are added to **transferred**.
+        """
+        if self.transfer_compression is None:
+            return proc
+        codec, level = self.transfer_compression
+
+        def record(writer):
+            self.transferred['raw'] += writer.raw_bytes
+            self.transferred['compressed'] += writer.compressed_bytes
+            self.logger.info("Sent %d bytes as %d %s compressed bytes (%.1f%%)",
+                             writer.raw_bytes, writer.compressed_bytes, codec,
+                             100. * writer.compressed_bytes / (writer.raw_bytes or 1))
+        proc.stdin = CompressingWriter(proc.stdin, codec, level, on_close=record)
+        return proc
 
-    @listify
     def containers(self, include_stopped=False, **filters):
-        params = ['ID', 'Image', 'Command', 'CreatedAt', 'RunningFor',
-                  'Ports', 'Status', 'Size', 'Names', 'Labels', 'Mounts']
-        args = ['ps', '--format',
-                SEPARATOR.join(['{{{{.{}}}}}'.format(x) for x in params])]
+        if self.cache is None or set(filters) - {'name', 'status'}:
+            if self.cache is not None:
+                self.cache.bypass()
+            return self._query_containers(include_stopped=include_stopped, **filters)
+        ret = []
+        for container in self.cache.get('containers', lambda: self._query_containers(
+                include_stopped=True)):
+            if not include_stopped and container['status'] not in RUNNING_STATUSES:
+                continue
+            if 'name' in filters and \
+                not any([re.search(filters['name'], x) for x in container['names']]):
+                continue
+            if 'status' in filters and container['status'] != filters['status']:
+                continue
+            ret.append(container)
+        return ret
+
+    @listify
+    def _query_containers(self, include_stopped=False, **filters):
+        args = ['ps', '--format', '{{json .}}']
         if include_stopped:
             args.append('-a')
         for key, value in filters.items():
             args += ['-f', '{}={}'.format(key, value)]
         proc = DockerProcess(self, args, stdout=PIPE)
+        for line in proc.stdout:
+            if line.strip():
+                yield parse_container(line)
         for line in proc.stderr.read().splitlines():
             self.logger.error(line)
         proc.wait()
-        params_map = dict([(x, re.sub(
-            '((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))', r'_\1', x).lower()) for x in params])
-        for line in proc.stdout.read().splitlines():
-            container = {}
-            values = line.split(SEPARATOR)
-            for num, param in enumerate(params):
-                if param in ['Labels', 'Mounts', 'Names', 'Ports']:
-                    container[params_map[param]] = values[num].split(',') if values[num] else []
-                    if param == 'Labels':
-                        container[params_map[param]] = [tuple(
-                            x.split('=')) for x in container[params_map[param]]]
-                    elif param == 'Ports':
-                        container[params_map[param]] = [tuple(
-                            x.split('->')) for x in container[params_map[param]]]
-                elif param == 'Status':
-                    container[params_map[param]] = {
-                        'created': 'created',
-                        'dead': 'dead',
-                        'exited': 'exited',
-                        'paused': 'paused',
-                        'restarting': 'restarting',
-                        'up': 'running',
-                    }[values[num].split(' ')[0].lower()]
-                elif param == 'CreatedAt':
-                    container[params_map[param]] = parse_datetime(values[num]).astimezone(
-                        tzlocal.get_localzone()).replace(tzinfo=None)
-                else:
-                    container[params_map[param]] = values[num] if values[num] else None
-            yield container
 
-    def copy_image_to_container(self, image, container, src, dst):
+    def copy_image_to_container(self, image, container, src, dst, cache=None): # pylint: disable=too-many-arguments
+        """
+        Extracts **src** of **image** into **dst** on the running **container**,
+        laying it out as **copy_path()** does. The archive of **export_image()**
+        is piped verbatim into **tar** executed on **container**, which selects
+        and renames members itself, creating **dst** first if needed.
+        """
+        dst = self._copy_destination(src, dst)
+        self.logger.info("Copying files from image \"%s:%s\" to container \"%s:%s\"",
+                         image, src, container, dst)
+        path = src.strip('/')
+        strip = len(path.split('/')) if path else 0
+        if path and not src.endswith('/'):
+            strip -= 1
+        p_out = self._copy_writer(container, dst_exec=True, root=os.path.join('/', dst),
+                                  members=[path] if path else [], strip=strip)
+        self.export_image(image, p_out, "Error processing path on container \"{}\"".format(
+            container), cache=cache)
+
+    def export_image(self, image, proc, msg, cache=None):
+        """
+        Streams the **docker export** archive of a temporary container of
+        **image** into the **stdin** of the process-like **proc**, raising an
+        error with **msg** if **proc** fails. With a **cache** directory, the
+        archive is also saved there by image ID and read back from it by later
+        calls instead of exporting the image again.
+        """
+        cached = None
+        if cache is not None:
+            record = self.inspect_many('image', [image])[image]
+            if record is None:
+                raise UserError("Image \"{}\" not found".format(image))
+            cached = os.path.join(cache, "{}.tar".format(record['Id'].split(':', 1)[-1]))
+        if cached is not None and os.path.exists(cached):
+            self.logger.info("Reading cached archive \"%s\"", cached)
+            with open(cached, 'rb') as fileobj:
+                self._relay_archive(fileobj, proc.stdin)
+            if proc.wait() != 0:
+                raise ExternalProcessError(msg, proc)
+            return
         tmp = random_name()
         self.create_container(tmp, image)
-        self.copy_path(tmp, container, src, dst=dst, dst_exec=True)
-        self.remove_container(tmp)
+        try:
+            p_in = self.export_reader(tmp)
+            if cached is None:
+                self._relay_archive(p_in.stdout, proc.stdin)
+            else:
+                mkdir(cache)
+                with open(cached + '.tmp', 'wb') as fileobj:
+                    self._relay_archive(p_in.stdout, proc.stdin, copy=fileobj)
+            p_in.stdout.close()
+            if p_in.wait() != 0:
+                raise ExternalProcessError(
+                    "Error exporting container \"{}\"".format(tmp), p_in)
+            if proc.wait() != 0:
+                raise ExternalProcessError(msg, proc)
+            if cached is not None:
+                os.rename(cached + '.tmp', cached)
+        finally:
+            if cached is not None and os.path.exists(cached + '.tmp'):
+                os.remove(cached + '.tmp')
+            self.remove_container(tmp)
+
+    @staticmethod
+    def _relay_archive(src, dst, copy=None):
+        # tar exits once it meets the end-of-archive marker, leaving the padding
+        # after it unread: its exit status tells whether extraction succeeded.
+        try:
+            relay(src, dst if copy is None else TeeWriter(dst, copy))
+            dst.close()
+        except IOError as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+            if copy is not None:
+                relay(src, copy)
 
     def copy_layout(self, src, dst):
         self.logger.info("Copying layout \"%s\" on \"%s\"", src, dst)
         return copy_tree(src, dst)
 
-    def copy_path(self, container_src, container_dst, src, dst=None, dst_exec=False, processor=None):
+    @staticmethod
+    def passthrough_path(src, dst):
+        """
+        Returns the path whose archive, read from the source container, extracts
+        under "/" exactly as **copy_path()** would lay out **src** at **dst**, or
+        None when members must be renamed.
+
+        Example:
+
+            >>> DockerEngine.passthrough_path('/usr/x86_64-dockeroo-linux-gnu/dockeroo-root/', '/')
+            '/usr/x86_64-dockeroo-linux-gnu/dockeroo-root/.'
+            >>> DockerEngine.passthrough_path('/etc', '')
+            '/etc'
+            >>> DockerEngine.passthrough_path('/usr/lib/', 'opt') is None
+            True
+        """
+        if dst.strip('/'):
+            return None
+        # Members of a "dir/." archive are named "./...", relative to the destination.
+        return src + '.' if src.endswith('/') else src
+
+    @staticmethod
+    def _copy_destination(src, dst):
         if dst is None:
             dst = os.path.join(*os.path.dirname(src).split(os.sep))
-        if processor is None:
-            processor = lambda x: x
-        self.logger.info("Copying files from container \"%s:%s\" to container \"%s:%s\"",
-                         container_src, src, container_dst, dst)
+        return dst
+
+    @staticmethod
+    def _copy_filter(src, dst):
         if src.endswith('/'):
             src_prefix = os.path.dirname(src).split(os.sep)[-1] + '/'
         else:
@@ -355,25 +686,58 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
                     else:
                         obj.linkname = dst
             return obj
-        p_in = DockerProcess(self, ['cp', "{}:{}".format(
-            container_src, src), "-"], stdout=PIPE)
-        if dst_exec:
-            p_out = DockerProcess(self, ['exec', '-i', container_dst, "tar", "-xpf",
-                                         "-", "-C", "/"], stdin=PIPE)
+        return layout_filter
+
+    def _copy_writer(self, container, dst_exec=False, root="/", members=(), strip=0): # pylint: disable=too-many-arguments
+        if not dst_exec:
+            return self.compressing(self.archive_writer(container, root))
+        codec = self.transfer_compression[0] if self.transfer_compression else None
+        options = ["-C", root]
+        if strip:
+            options.append("--strip-components={}".format(strip))
+        options.extend(members)
+        if codec == 'gzip':
+            args = ["tar", "-xzpf", "-"] + options
+        elif codec == 'zstd':
+            args = ["sh", "-c", "zstd -q -d -c | tar -xpf - {}".format(
+                ' '.join([quote(x) for x in options]))]
         else:
-            p_out = DockerProcess(self, ['cp', "-", "{}:/".format(container_dst)], stdin=PIPE)
-        tar_in = tarfile.open(fileobj=p_in.stdout, mode='r|')
-        tar_out = tarfile.open(fileobj=p_out.stdin, mode='w|')
-        for tarinfo in tar_in:
-            tarinfo = processor(layout_filter(tarinfo))
-            if tarinfo is None:
-                continue
-            if tarinfo.isreg():
-                tar_out.addfile(tarinfo, fileobj=tar_in.extractfile(tarinfo))
+            args = ["tar", "-xpf", "-"] + options
+        if root != "/":
+            # tar -C needs an existing directory.
+            if args[0] == "sh":
+                args = args[:2] + ["mkdir -p {} && {}".format(quote(root), args[2])]
             else:
-                tar_out.addfile(tarinfo)
-        tar_in.close()
-        tar_out.close()
+                args = ["sh", "-c", "mkdir -p {} && {}".format(
+                    quote(root), ' '.join([quote(x) for x in args]))]
+        return self.compressing(DockerProcess(self, ['exec', '-i', container] + args, stdin=PIPE))
+
+    def copy_path(self, container_src, container_dst, src, dst=None, dst_exec=False, processor=None):
+        dst = self._copy_destination(src, dst)
+        passthrough = self.passthrough_path(src, dst) if processor is None else None
+        if processor is None:
+            processor = lambda x: x
+        self.logger.info("Copying files from container \"%s:%s\" to container \"%s:%s\"",
+                         container_src, src, container_dst, dst)
+        p_in = self.archive_reader(container_src, passthrough or src)
+        p_out = self._copy_writer(container_dst, dst_exec=dst_exec)
+        if passthrough is not None:
+            self.logger.debug("Forwarding archive of \"%s\" verbatim", passthrough)
+            relay(p_in.stdout, p_out.stdin)
+        else:
+            tar_in = tarfile.open(fileobj=p_in.stdout, mode='r|')
+            tar_out = tarfile.open(fileobj=p_out.stdin, mode='w|')
+            layout_filter = self._copy_filter(src, dst)
+            for tarinfo in tar_in:
+                tarinfo = processor(layout_filter(tarinfo))
+                if tarinfo is None:
+                    continue
+                if tarinfo.isreg():
+                    tar_out.addfile(tarinfo, fileobj=tar_in.extractfile(tarinfo))
+                else:
+                    tar_out.addfile(tarinfo)
+            tar_in.close()
+            tar_out.close()
         p_in.stdout.close()
         p_out.stdin.close()
         if p_in.wait() != 0:
@@ -383,42 +747,117 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
             raise ExternalProcessError(
                 "Error processing path on container \"{}\"".format(container_dst), p_out)
 
-    def create_container(self, container, image, command=None, privileged=False, run=False, # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    def copy_paths(self, container_src, container_dst, paths, dst_exec=False, processor=None): # pylint: disable=too-many-arguments
+        """
+        Copies each **(src, dst)** pair of **paths** from **container_src** to
+        **container_dst** as **copy_path()** does, writing them all with a single
+        writer. While **container_src** is running, they are also read by a
+        single **tar** process executed in it, otherwise with one reader each.
+        In the former case, files read more than once end up hard linked.
+        """
+        paths = [(src, self._copy_destination(src, dst)) for src, dst in paths]
+        if len(paths) < 2:
+            for src, dst in paths:
+                self.copy_path(container_src, container_dst, src, dst=dst,
+                               dst_exec=dst_exec, processor=processor)
+            return
+        if processor is None:
+            processor = lambda x: x
+        for src, dst in paths:
+            self.logger.info("Copying files from container \"%s:%s\" to container \"%s:%s\"",
+                             container_src, src, container_dst, dst)
+        filters = [self._copy_filter(src, dst) for src, dst in paths]
+        record = self.inspect_many('container', [container_src])[container_src]
+        if record is not None and (record.get('State') or {}).get('Running'):
+            readers = [([src for src, _ in paths], filters)]
+        else:
+            readers = [([src], [layout_filter]) for (src, _), layout_filter in zip(paths, filters)]
+        p_out = self._copy_writer(container_dst, dst_exec=dst_exec)
+        tar_out = tarfile.open(fileobj=p_out.stdin, mode='w|')
+        for reader_paths, reader_filters in readers:
+            if len(reader_paths) > 1:
+                p_in = self.paths_reader(container_src, reader_paths)
+            else:
+                p_in = self.archive_reader(container_src, reader_paths[0])
+            tar_in = tarfile.open(fileobj=p_in.stdout, mode='r|')
+            tops = [self.archive_top(x) for x in reader_paths] \
+                if len(reader_paths) > 1 else [None]
+            renamed = {}
+            for index, tarinfo in self.split_members(tar_in, tops):
+                name, linkname = tarinfo.name, tarinfo.linkname
+                tarinfo = processor(reader_filters[index](tarinfo))
+                if tarinfo is None:
+                    continue
+                # tar stores files met again under another path as hard links.
+                if tarinfo.type == tarfile.LNKTYPE and linkname in renamed:
+                    tarinfo.linkname = renamed[linkname]
+                renamed[name] = tarinfo.name
+                if tarinfo.isreg():
+                    tar_out.addfile(tarinfo, fileobj=tar_in.extractfile(tarinfo))
+                else:
+                    tar_out.addfile(tarinfo)
+            tar_in.close()
+            p_in.stdout.close()
+            if p_in.wait() != 0:
+                tar_out.close()
+                p_out.stdin.close()
+                p_out.wait()
+                raise ExternalProcessError(
+                    "Error processing path on container \"{}\"".format(container_src), p_in)
+        tar_out.close()
+        p_out.stdin.close()
+        if p_out.wait() != 0:
+            raise ExternalProcessError(
+                "Error processing path on container \"{}\"".format(container_dst), p_out)
+
+    def create_container(self, container, image, command=None, privileged=False, run=False, # pylint: disable=too-many-arguments
                          tty=False, volumes=None, volumes_from=None, user=None, networks=None,
                          links=None, network_aliases=None, env=None, ports=None):
-        if not any([x for x in self.containers(include_stopped=True) if container in x['names']]):
+        if not self.exists('container', container):
             self.logger.info("Creating container \"%s\"", container)
-            args = ['create', '--name="{}"'.format(container)]
-            for key, value in (env or {}).items():
-                args += ['-e', "{}={}".format(key, value)]
-            for key, value in (ports or {}).items():
-                args += ['-p', "{}:{}".format(key, value)]
-            for key, value in (links or {}).items():
-                args += ['--link', "{}:{}".format(key, value)]
-            for network in networks or []:
-                args += ['--network', network]
-            for network_alias in network_aliases or []:
-                args += ['--network-alias', network_alias]
-            if privileged:
-                args.append('--privileged')
-            if tty:
-                args.append('--tty')
-            if user:
-                args += ['-u', user]
-            if volumes:
-                args += ["--volume={}:{}".format(key, value) for key, value in volumes]
-            if volumes_from:
-                args.append("--volumes-from={}".format(volumes_from))
-            args.append(image)
-            if command:
-                args += command.split(" ")
-            proc = DockerProcess(self, args, stdout=FNULL)
-            if proc.wait() != 0:
-                raise ExternalProcessError(
-                    "Error creating container \"{}\"".format(container), proc)
+            args = self._create_container_args(
+                container, image, command=command, privileged=privileged, tty=tty,
+                volumes=volumes, volumes_from=volumes_from, user=user, networks=networks,
+                links=links, network_aliases=network_aliases, env=env, ports=ports)
+            with self.mutating('containers'):
+                proc = DockerProcess(self, args, stdout=FNULL)
+                if proc.wait() != 0:
+                    raise ExternalProcessError(
+                        "Error creating container \"{}\"".format(container), proc)
         if run:
             self.start_container(container)
 
+    @staticmethod
+    def _create_container_args(container, image, command=None, privileged=False, # pylint: disable=too-many-arguments,too-many-branches
+                               tty=False, volumes=None, volumes_from=None, user=None,
+                               networks=None, links=None, network_aliases=None, env=None,
+                               ports=None):
+        args = ['create', '--name="{}"'.format(container)]
+        for key, value in (env or {}).items():
+            args += ['-e', "{}={}".format(key, value)]
+        for key, value in (ports or {}).items():
+            args += ['-p', "{}:{}".format(key, value)]
+        for key, value in (links or {}).items():
+            args += ['--link', "{}:{}".format(key, value)]
+        for network in networks or []:
+            args += ['--network', network]
+        for network_alias in network_aliases or []:
+            args += ['--network-alias', network_alias]
+        if privileged:
+            args.append('--privileged')
+        if tty:
+            args.append('--tty')
+        if user:
+            args += ['-u', user]
+        if volumes:
+            args += ["--volume={}:{}".format(key, value) for key, value in volumes]
+        if volumes_from:
+            args.append("--volumes-from={}".format(volumes_from))
+        args.append(image)
+        if command:
+            args += command.split(" ")
+        return args
+
     def create_network(self, network, driver='bridge', gateway=None, subnet=None,
                        ip_range=None, ipv6=False, internal=False):
         self.logger.info("Creating network \"%s\"", network)
@@ -434,79 +873,161 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
         if internal:
             args.append('--internal')
         args.append(network)
-        proc = DockerProcess(self, args)
-        if proc.wait() != 0:
-            raise ExternalProcessError("Error creating network \"{}\"".format(network), proc)
+        with self.mutating('networks'):
+            proc = DockerProcess(self, args)
+            if proc.wait() != 0:
+                raise ExternalProcessError("Error creating network \"{}\"".format(network), proc)
 
     def create_volume(self, volume):
-        if self.volumes(name=volume):
+        if self.exists('volume', volume):
             return
         self.logger.info("Creating volume \"%s\"", volume)
         args = ['volume', 'create', '--name="{}"'.format(volume)]
-        proc = DockerProcess(self, args, stdout=FNULL)
-        if proc.wait() != 0:
-            raise ExternalProcessError("Error creating volume \"{}\"".format(volume), proc)
+        with self.mutating('volumes'):
+            proc = DockerProcess(self, args, stdout=FNULL)
+            if proc.wait() != 0:
+                raise ExternalProcessError("Error creating volume \"{}\"".format(volume), proc)
+
+    def exists(self, kind, name):
+        """
+        Tells whether an object of **kind** (container, image, network or volume)
+        named **name** exists on the engine.
+        """
+        return self.inspect_many(kind, [name])[name] is not None
 
-    def export_files(self, container, src, dst):
+    def export_files(self, container, src, dst, compression=None):
+        """
+        Saves the regular files under **src** on **container** into the **dst**
+        directory, streaming them. Blocks of zeros and holes of GNU sparse members
+        become holes in the saved files. With **compression**, a (codec, level)
+        tuple as for **transfer_compression**, files are compressed instead and
+        get a ".gz" or ".zst" extension.
+        """
         self.logger.info(
             "Export files from \"%s:%s\" to path \"%s\"", container, src, dst)
-        args = ['cp', "{}:{}".format(container, src), "-"]
-        proc = DockerProcess(self, args, stdout=PIPE)
+        proc = self.archive_reader(container, src)
         tar = tarfile.open(fileobj=proc.stdout, mode='r|')
-        for fin in tar:
+        for fin in stream_members(tar):
             if not fin.isreg():
                 continue
-            fout = open(os.path.join(dst, os.path.basename(fin.name)), 'w')
-            fout.write(tar.extractfile(fin).read())
-            fout.close()
+            path = os.path.join(dst, os.path.basename(fin.name))
+            if compression is not None:
+                codec, level = compression
+                fout = CompressingWriter(open(path + COMPRESSED_EXTENSIONS[codec], 'wb'),
+                                         codec, level)
+                relay(tar.extractfile(fin), fout)
+                fout.close()
+                self.logger.info("Saved \"%s\", %d bytes compressed to %d",
+                                 fin.name, fout.raw_bytes, fout.compressed_bytes)
+                continue
+            with open(path, 'wb') as fout:
+                written = copy_sparse(tar.extractfile(fin), fout, fin.size)
+            self.logger.info("Saved \"%s\", %d of %d bytes allocated",
+                             fin.name, written, fin.size)
         tar.close()
         if proc.wait() != 0:
             raise ExternalProcessError(
                 "Error exporting files from container \"{}\"".format(container), proc)
 
+    def file_importer(self, path, image):
+        """
+        Returns a process-like object importing the archive at **path** as
+        **image**.
+        """
+        return DockerProcess(self, ['import', path, image], stdout=FNULL)
+
     def get_container_ip_address(self, container):
-        args = ['inspect', '--format="{{.NetworkSettings.IPAddress}}"', container]
-        proc = DockerProcess(self, args, stdout=PIPE)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error requesting \"docker inspect {}\"".format(container), proc)
-        return proc.stdout.read().rstrip(os.linesep)
+        record = self.inspect_many('container', [container])[container]
+        if record is None:
+            raise UserError('''No such container: "{}"'''.format(container))
+        return record['NetworkSettings']['IPAddress']
 
     def images(self, name=None, **filters):
-        params = ['ID', 'Repository', 'Tag', 'Digest',
-                  'CreatedSince', 'CreatedAt', 'Size']
-        args = ['images', '--format',
-                SEPARATOR.join(['{{{{.{}}}}}'.format(x) for x in params])]
+        if self.cache is None or set(filters) - {'dangling'}:
+            if self.cache is not None:
+                self.cache.bypass()
+            return self._query_images(name=name, **filters)
+        ret = []
+        for image in self.cache.get('images', self._query_images):
+            if name is not None and \
+                not match_image_reference(name, image['repository'], image['tag']):
+                continue
+            if 'dangling' in filters and string_as_bool(filters['dangling']) != \
+                (image['repository'] is None and image['tag'] is None):
+                continue
+            ret.append(image)
+        return iter(ret)
+
+    def _query_images(self, name=None, **filters):
+        args = ['images', '--format', '{{json .}}']
         for key, value in filters.items():
             args += ['-f', '{}={}'.format(key, value)]
         if name is not None:
             args.append(name)
         proc = DockerProcess(self, args, stdout=PIPE)
+        for line in proc.stdout:
+            if line.strip():
+                yield parse_image(line)
         for line in proc.stderr.read().splitlines():
             self.logger.error(line)
         proc.wait()
-        params_map = dict([(x, re.sub(
-            '((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))', r'_\1', x).lower()) for x in params])
-        for line in proc.stdout.read().splitlines():
-            image = {}
-            values = line.split(SEPARATOR)
-            for num, param in enumerate(params):
-                if param == 'CreatedAt':
-                    image[params_map[param]] = parse_datetime(values[num]).astimezone(
-                        tzlocal.get_localzone()).replace(tzinfo=None)
-                else:
-                    image[params_map[param]] = values[num] \
-                        if values[num] and values[num] != '<none>' else None
-            if image['repository'] and image['tag']:
-                image['image'] = "{}:{}".format(image['repository'], image['tag'])
-            else:
-                image['image'] = image['id']
-            yield image
 
     def import_archives(self, image, *archives):
-        paths = set()
-        args = ['import', '-', image]
-        proc = DockerProcess(self, args, stdin=PIPE)
+        """
+        Imports **archives** into **image**, as if extracted in turn, each below
+        its prefix. A path met again in a later archive is skipped.
+
+        Archives are streamed one member at a time, so memory doesn't grow with
+        their size: besides one member and the copy buffers, it only holds the
+        digests of the paths seen so far, at most 32 bytes per path (48 while
+        the table grows), that is 16 MiB for half a million paths.
+
+        Compressed archives are decompressed by a parallel decompressor found
+        on PATH, unless their **decompressor** says otherwise, see
+        :py:func:`dockeroo.utils.decompressing`.
+
+        A single archive without prefix, left to the "auto" decompressor and
+        either uncompressed or compressed as in **DOCKER_IMPORT_COMPRESSIONS**,
+        is handed to :py:meth:`import_file` as is: **docker import** normalizes
+        member names the same way, stripping "./" and leading "/" alike, so
+        archives with absolute names need no rewriting either. It keeps the
+        last of duplicate members rather than the first, though. Any other
+        archive is streamed.
+
+        Example:
+
+            >>> class Engine(DockerEngine):
+            ...     def __init__(self):
+            ...         self.logger = logging.getLogger(__name__)
+            ...         self.cache = None
+            ...         self.transfer_compression = None
+            ...         self.imported = []
+            ...     def import_file(self, path, image):
+            ...         self.imported.append('file')
+            ...     def import_writer(self, image):
+            ...         self.imported.append('stream')
+            ...         return Popen(['sh', '-c', 'cat >/dev/null'], stdin=PIPE)
+            >>> root = tempfile.mkdtemp()
+            >>> path = os.path.join(root, 'archive.tar.gz')
+            >>> with tarfile.open(path, 'w:gz') as tar:
+            ...     tar.addfile(tarfile.TarInfo('/etc/hostname'))
+            >>> engine = Engine()
+            >>> engine.import_archives('image', Archive(path=path))
+            >>> engine.import_archives('image', Archive(path=path, decompressor='python'))
+            >>> engine.import_archives('image', Archive(path=path, prefix='/opt'))
+            >>> engine.imported
+            ['file', 'stream', 'stream']
+            >>> rmtree(root)
+        """
+        if len(archives) == 1 and not archives[0].prefix and archives[0].decompressor == 'auto':
+            with open(archives[0].path, 'rb') as fileobj:
+                compression = compression_of(fileobj.read(8))
+            if compression in DOCKER_IMPORT_COMPRESSIONS:
+                self.logger.info("Importing archive \"%s\" into image \"%s:/\"",
+                                 archives[0], image)
+                return self.import_file(archives[0].path, image)
+        paths = DigestSet()
+        proc = self.compressing(self.import_writer(image))
         tar_out = tarfile.open(fileobj=proc.stdin, mode='w|')
         def layout_filter(obj, arc):
             if not obj.name.startswith(os.sep):
@@ -530,7 +1051,6 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
             self.logger.info("Importing archive \"%s\" into image \"%s:%s\"",
                              archive, image, archive.prefix or '/')
 
-            tar_in = tarfile.open(name=archive.path, mode='r')
             if archive.prefix:
                 segments = [os.sep]
                 for segment in os.path.dirname(archive.prefix).split(os.sep):
@@ -545,20 +1065,47 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
                     tarinfo.type = tarfile.DIRTYPE
                     tar_out.addfile(tarinfo)
                     paths.add(tarinfo.name)
-            for tarinfo in [layout_filter(obj, archive) for obj in tar_in]: # pylint: disable=cell-var-from-loop
-                if tarinfo.name in paths:
-                    continue
-                paths.add(tarinfo.name)
-                if tarinfo.isreg():
-                    tar_out.addfile(
-                        tarinfo, fileobj=tar_in.extractfile(tarinfo))
-                else:
-                    tar_out.addfile(tarinfo)
+            with open(archive.path, 'rb') as fileobj, \
+                    decompressing(fileobj, archive.decompressor, logger=self.logger) as stream:
+                tar_in = tarfile.open(fileobj=stream, mode='r|*')
+                for tarinfo in stream_members(tar_in):
+                    tarinfo = layout_filter(tarinfo, archive)
+                    if not paths.add(tarinfo.name):
+                        continue
+                    if tarinfo.isreg():
+                        tar_out.addfile(
+                            tarinfo, fileobj=tar_in.extractfile(tarinfo))
+                    else:
+                        tar_out.addfile(tarinfo)
+                    # Written members are kept by tarfile as well.
+                    tar_out.members = []
+                tar_in.close()
         tar_out.close()
         proc.stdin.close()
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error importing archives \"{}\" in image \"{}\"".format(archives, image), proc)
+        with self.mutating('images'):
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error importing archives \"{}\" in image \"{}\"".format(archives, image), proc)
+
+    def import_file(self, path, image):
+        """
+        Imports the archive at **path**, compressed or not, into **image**
+        verbatim. Uncompressed archives are compressed on the way if
+        **transfer_compression** is set.
+        """
+        with open(path, 'rb') as fileobj:
+            compressed = compression_of(fileobj.read(8)) is not None
+        if self.transfer_compression is not None and not compressed:
+            proc = self.compressing(self.import_writer(image))
+            with open(path, 'rb') as fileobj:
+                relay(fileobj, proc.stdin)
+            proc.stdin.close()
+        else:
+            proc = self.file_importer(path, image)
+        with self.mutating('images'):
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error importing archive \"{}\" in image \"{}\"".format(path, image), proc)
 
     def import_path(self, path, image):
         """
@@ -581,43 +1128,129 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
             obj.uid = 0
             obj.gid = 0
             return obj
-        args = ['import', '-', image]
-        proc = DockerProcess(self, args, stdin=PIPE, stdout=FNULL)
+        proc = self.compressing(self.import_writer(image))
         tar = tarfile.open(fileobj=proc.stdin, mode='w|')
         tar.add(path, arcname=".", filter=layout_filter)
         tar.close()
         proc.stdin.close()
-        if proc.wait() != 0:
+        with self.mutating('images'):
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error importing archive \"{}\" in image \"{}\"".format(path, image), proc)
+
+    def import_writer(self, image):
+        """
+        Returns a process-like object whose **stdin** accepts a tar archive
+        to be imported as **image**.
+        """
+        return DockerProcess(self, ['import', '-', image], stdin=PIPE, stdout=FNULL)
+
+    def scratch_image(self):
+        """
+        Returns the ID of an empty image, imported as **SCRATCH_IMAGE** the
+        first time it is needed on this engine and reused afterwards.
+        """
+        with self._artifact_lock:
+            record = self.inspect_many('image', [SCRATCH_IMAGE])[SCRATCH_IMAGE]
+            if record is None:
+                self.logger.info("Importing scratch image \"%s\"", SCRATCH_IMAGE)
+                proc = self.compressing(self.import_writer(SCRATCH_IMAGE))
+                tar = tarfile.open(fileobj=proc.stdin, mode='w|')
+                root = tarfile.TarInfo(name=".")
+                root.mode = 0o0755
+                root.type = tarfile.DIRTYPE
+                tar.addfile(root)
+                tar.close()
+                proc.stdin.close()
+                with self.mutating('images'):
+                    if proc.wait() != 0:
+                        raise ExternalProcessError(
+                            "Error importing image \"{}\"".format(SCRATCH_IMAGE), proc)
+                record = self.inspect_many('image', [SCRATCH_IMAGE])[SCRATCH_IMAGE]
+            return record['Id']
+
+    def inspect_many(self, kind, names):
+        """
+        Returns a dictionary mapping each of **names** to the **docker inspect**
+        record of the object of **kind** (container, image, network or volume)
+        it refers to, or None if it doesn't exist. Names not yet known to the
+        shared snapshot are resolved with a single engine call.
+        """
+        if kind not in INSPECT_KINDS:
+            raise ValueError('''Invalid object kind "{}"'''.format(kind))
+        names = list(names)
+        if self.cache is None:
+            found, missing = {}, names
+        else:
+            found, missing = self.cache.inspected(INSPECT_KINDS[kind], names)
+        if missing:
+            records = self._query_inspect(kind, missing)
+            resolved = dict([(name, next(
+                (x for x in records if inspect_matches(kind, name, x)), None))
+                             for name in missing])
+            if self.cache is not None:
+                self.cache.store(INSPECT_KINDS[kind], resolved)
+            found.update(resolved)
+        return found
+
+    def _query_inspect(self, kind, names):
+        if kind in ('network', 'volume'):
+            args = [kind, 'inspect'] + names
+        else:
+            args = ['inspect', '--type', kind] + names
+        proc = DockerProcess(self, args, stdout=PIPE)
+        stdout, stderr = proc.communicate()
+        errors = [x for x in stderr.splitlines() if x.strip() and b'no such' not in x.lower()]
+        if proc.returncode != 0 and errors:
+            proc.stderr = BytesIO(b'\n'.join(errors))
             raise ExternalProcessError(
-                "Error importing archive \"{}\" in image \"{}\"".format(path, image), proc)
+                "Error requesting \"docker {}\"".format(' '.join(args)), proc)
+        return json.loads(stdout.decode('utf-8')) if stdout.strip() else []
+
+    @classmethod
+    def freeze_payload(cls, arch):
+        """
+        Returns the tar archive installing the **freeze** binary of **arch**
+        as /bin/freeze, built once per process.
+        """
+        with cls._artifact_lock:
+            if arch not in cls._freeze_payloads:
+                def layout_filter(obj):
+                    obj.uid = 0
+                    obj.gid = 0
+                    return obj
+                payload = BytesIO()
+                tar = tarfile.open(fileobj=payload, mode='w')
+                bindir = tarfile.TarInfo(name="bin")
+                bindir.uid = 0
+                bindir.gid = 0
+                bindir.mode = 0o0755
+                bindir.type = tarfile.DIRTYPE
+                tar.addfile(bindir)
+                tar.add(os.path.join(os.path.dirname(__file__), 'freeze', 'freeze_{}'.format(
+                    arch)), arcname="bin/freeze", filter=layout_filter)
+                tar.close()
+                cls._freeze_payloads[arch] = payload.getvalue()
+            return cls._freeze_payloads[arch]
 
     def install_freeze(self, container, arch=None):
         self.logger.info("Installing freeze on container \"%s\"", container)
-
-        def layout_filter(obj):
-            obj.uid = 0
-            obj.gid = 0
-            return obj
         if arch is None:
             arch = self.platform
-        args = ['cp', '-', "{}:/".format(container)]
-        proc = DockerProcess(self, args, stdin=PIPE)
-        tar = tarfile.open(fileobj=proc.stdin, mode='w|')
-        bindir = tarfile.TarInfo(name="bin")
-        bindir.uid = 0
-        bindir.gid = 0
-        bindir.mode = 0o0755
-        bindir.type = tarfile.DIRTYPE
-        tar.addfile(bindir)
-        tar.add(os.path.join(os.path.dirname(__file__), 'freeze', 'freeze_{}'.format(
-            arch)), arcname="bin/freeze", filter=layout_filter)
-        tar.close()
+        payload = self.freeze_payload(arch)
+        proc = self.compressing(self.archive_writer(container, "/"))
+        proc.stdin.write(payload)
         proc.stdin.close()
         if proc.wait() != 0:
             raise ExternalProcessError(
                 "Error installing freeze on container \"{}\"".format(container), proc)
 
-    def load_archive(self, container, name, fileobj, root="/", uid=None, gid=None):
+    def load_archive(self, container, name, fileobj, root="/", uid=None, gid=None, # pylint: disable=too-many-arguments
+                     decompressor='auto'):
+        """
+        Extracts the archive read from **fileobj** under **root** on **container**,
+        decompressed as :py:func:`dockeroo.utils.decompressing` does with **decompressor**.
+        """
         self.logger.info(
             "Loading archive \"%s\" on container \"%s\"", name, container)
 
@@ -627,22 +1260,22 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
             if gid is not None:
                 obj.gid = gid
             return obj
-        args = ['cp', '-', "{}:{}".format(container, root)]
-        proc = DockerProcess(self, args, stdin=PIPE)
-        tar_in = tarfile.open(fileobj=fileobj, mode='r|*')
+        proc = self.compressing(self.archive_writer(container, root))
         tar_out = tarfile.open(fileobj=proc.stdin, mode='w|')
-        for tarinfo in tar_in:
-            tarinfo = layout_filter(tarinfo)
-            if tarinfo.name in ['./lib', './usr/lib'] and tarinfo.isdir():
-                lib64_tarinfo = deepcopy(tarinfo)
-                lib64_tarinfo.name = "{}64".format(lib64_tarinfo.name)
-                tar_out.addfile(lib64_tarinfo)
-                tarinfo.type = tarfile.SYMTYPE
-                tarinfo.linkname = os.path.basename(lib64_tarinfo.name)
-            if tarinfo.isreg():
-                tar_out.addfile(tarinfo, fileobj=tar_in.extractfile(tarinfo))
-            else:
-                tar_out.addfile(tarinfo)
+        with decompressing(fileobj, decompressor, logger=self.logger) as stream:
+            tar_in = tarfile.open(fileobj=stream, mode='r|*')
+            for tarinfo in tar_in:
+                tarinfo = layout_filter(tarinfo)
+                if tarinfo.name in ['./lib', './usr/lib'] and tarinfo.isdir():
+                    lib64_tarinfo = deepcopy(tarinfo)
+                    lib64_tarinfo.name = "{}64".format(lib64_tarinfo.name)
+                    tar_out.addfile(lib64_tarinfo)
+                    tarinfo.type = tarfile.SYMTYPE
+                    tarinfo.linkname = os.path.basename(lib64_tarinfo.name)
+                if tarinfo.isreg():
+                    tar_out.addfile(tarinfo, fileobj=tar_in.extractfile(tarinfo))
+                else:
+                    tar_out.addfile(tarinfo)
         tar_out.close()
         proc.stdin.close()
         if proc.wait() != 0:
@@ -651,31 +1284,97 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
 
     def load_image(self, image, path):
         args = ['load', '-i', path, image]
-        proc = DockerProcess(self, args, stdout=FNULL)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error loading image \"{}\"".format(image), proc)
+        with self.mutating('images'):
+            proc = DockerProcess(self, args, stdout=FNULL)
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error loading image \"{}\"".format(image), proc)
 
-    def load_layout(self, container, path, root="/", uid=0, gid=0):
+    def load_layout(self, container, path, root="/", uid=0, gid=0, manifest=None, files=None): # pylint: disable=too-many-arguments,too-many-locals
+        """
+        Copies the content of the **path** directory into **root** on
+        **container**, owned by **uid** and **gid**. With a **manifest** file,
+        the files loaded are recorded in it, and later calls loading **path**
+        again on the same container only send the files added or changed
+        since, after removing those deleted with a single command, provided
+        **container** is running. **files** may hold a fresh
+        **scan_layout()** of **path**, saving another scan.
+        """
         self.logger.info(
             "Loading layout \"%s\" on container \"%s\"", path, container)
+        previous = current = settings = None
+        if manifest is not None:
+            record = self.inspect_many('container', [container])[container]
+            settings = {'container': record['Id'] if record is not None else None,
+                        'root': root, 'uid': uid, 'gid': gid}
+            if os.path.exists(manifest):
+                with open(manifest) as fileobj:
+                    data = json.load(fileobj)
+                if data.get('settings') == settings:
+                    previous = data['files']
+            current = files if files is not None else scan_layout(path, previous)
 
         def layout_filter(obj):
             obj.uid = uid
             obj.gid = gid
             return obj
-        args = ['cp', '-', "{}:{}".format(container, root)]
-        proc = DockerProcess(self, args, stdin=PIPE)
-        tar = tarfile.open(fileobj=proc.stdin, mode='w|')
-        tar.add(path, arcname=".", filter=layout_filter)
-        tar.close()
-        proc.stdin.close()
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error loading layout on container \"{}\"".format(container), proc)
+        if previous is None:
+            members = None
+        else:
+            members, removed = diff_layout(previous, current)
+            self.logger.info("Layout \"%s\" has %d changed and %d removed paths",
+                             path, len(members), len(removed))
+            if removed:
+                running = (record.get('State') or {}).get('Running')
+                if running:
+                    self.run_cmd(container, "rm -rf -- {}".format(' '.join(
+                        [shell_quote(os.path.join(root, x)) for x in removed])), quiet=True)
+                else:
+                    self.logger.warning("Container \"%s\" is not running, "
+                                        "keeping removed paths", container)
+        if members is None or members:
+            proc = self.compressing(self.archive_writer(container, root))
+            tar = tarfile.open(fileobj=proc.stdin, mode='w|')
+            if members is None:
+                tar.add(path, arcname=".", filter=layout_filter)
+            else:
+                for member in members:
+                    tar.add(os.path.join(path, member), arcname=member,
+                            recursive=False, filter=layout_filter)
+            tar.close()
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error loading layout on container \"{}\"".format(container), proc)
+        if manifest is not None:
+            mkdir(os.path.dirname(manifest))
+            with open(manifest + '.tmp', 'w') as fileobj:
+                json.dump({'settings': settings, 'files': current}, fileobj)
+            os.rename(manifest + '.tmp', manifest)
+
+    @contextmanager
+    def mutating(self, *kinds):
+        """
+        Wraps an engine command altering the listings of **kinds**: the shared
+        listing snapshot is invalidated once the command has terminated,
+        whether it succeeded or not.
+        """
+        try:
+            yield
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(*kinds)
 
-    @listify
     def networks(self, **filters):
+        if self.cache is None or set(filters) - {'name'}:
+            if self.cache is not None:
+                self.cache.bypass()
+            return self._query_networks(**filters)
+        return [x for x in self.cache.get('networks', self._query_networks)
+                if 'name' not in filters or re.search(filters['name'], x['name'])]
+
+    @listify
+    def _query_networks(self, **filters):
         params = ['id', 'name', 'driver']
         args = ['network', 'ls']
         for key, value in filters.items():
@@ -694,8 +1393,7 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
     def process_path(self, container, path, func):
         self.logger.info(
             "Processing path \"%s\" on container \"%s\"", path, container)
-        args = ['cp', "{}:{}".format(container, path), "-"]
-        proc = DockerProcess(self, args, stdout=PIPE)
+        proc = self.archive_reader(container, path)
         tar = tarfile.open(fileobj=proc.stdout, mode='r|')
         for tarinfo in tar:
             func(tar, tarinfo)
@@ -721,15 +1419,17 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
         args = ['pull', full_image_name]
         if username and password:
             with DockerRegistryLogin(self, registry, username, password) as login:
-                proc = DockerProcess(self, args, stdout=FNULL, config=login.config_path)
+                with self.mutating('images'):
+                    proc = DockerProcess(self, args, stdout=FNULL, config=login.config_path)
+                    if proc.wait() != 0:
+                        raise ExternalProcessError(
+                            "Error pulling image \"{}\"".format(full_image_name), proc)
+        else:
+            with self.mutating('images'):
+                proc = DockerProcess(self, args, stdout=FNULL)
                 if proc.wait() != 0:
                     raise ExternalProcessError(
                         "Error pulling image \"{}\"".format(full_image_name), proc)
-        else:
-            proc = DockerProcess(self, args, stdout=FNULL)
-            if proc.wait() != 0:
-                raise ExternalProcessError(
-                    "Error pulling image \"{}\"".format(full_image_name), proc)
 
     def remove_container(self, container):
         try:
@@ -738,42 +1438,47 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
             status = None
         if status in ['running', 'paused']:
             self.logger.info("Stopping container \"%s\"", container)
-            proc = DockerProcess(self, ['stop', container], stdout=FNULL)
-            if proc.wait() != 0:
-                raise ExternalProcessError(
-                    "Error stopping container \"{}\"".format(container), proc)
+            with self.mutating('containers'):
+                proc = DockerProcess(self, ['stop', container], stdout=FNULL)
+                if proc.wait() != 0:
+                    raise ExternalProcessError(
+                        "Error stopping container \"{}\"".format(container), proc)
         if status is not None:
             self.logger.info("Removing container \"%s\"", container)
-            proc = DockerProcess(self, ['rm', container], stdout=FNULL)
-            if proc.wait() != 0:
-                raise ExternalProcessError(
-                    "Error removing container \"{}\"".format(container), proc)
+            with self.mutating('containers'):
+                proc = DockerProcess(self, ['rm', container], stdout=FNULL)
+                if proc.wait() != 0:
+                    raise ExternalProcessError(
+                        "Error removing container \"{}\"".format(container), proc)
 
     def remove_image(self, name):
         for container in self.containers(include_stopped=True, ancestor=name):
             self.remove_container(container['names'][0])
         for image in self.images(name=name):
             self.logger.info("Removing image \"%s\"", image['image'])
-            proc = DockerProcess(self, ['rmi', image['image']], stdout=FNULL)
-            if proc.wait() != 0:
-                raise ExternalProcessError(
-                    "Error removing image \"{}\"".format(image['image']), proc)
+            with self.mutating('images'):
+                proc = DockerProcess(self, ['rmi', image['image']], stdout=FNULL)
+                if proc.wait() != 0:
+                    raise ExternalProcessError(
+                        "Error removing image \"{}\"".format(image['image']), proc)
 
     def remove_network(self, network):
         for container in self.containers(include_stopped=True, network=network):
             self.remove_container(container)
         self.logger.info("Removing network \"%s\"", network)
-        proc = DockerProcess(self, ['network', 'rm', network], stdout=FNULL)
-        if proc.wait() != 0:
-            raise ExternalProcessError("Error removing network \"{}\"".format(network), proc)
+        with self.mutating('networks'):
+            proc = DockerProcess(self, ['network', 'rm', network], stdout=FNULL)
+            if proc.wait() != 0:
+                raise ExternalProcessError("Error removing network \"{}\"".format(network), proc)
 
     def remove_volume(self, volume):
         for container in self.containers(include_stopped=True, volume=volume):
             self.remove_container(container)
         self.logger.info("Removing volume \"%s\"", volume)
-        proc = DockerProcess(self, ['volume', 'rm', volume], stdout=FNULL)
-        if proc.wait() != 0:
-            raise ExternalProcessError("Error removing volume \"{}\"".format(volume), proc)
+        with self.mutating('volumes'):
+            proc = DockerProcess(self, ['volume', 'rm', volume], stdout=FNULL)
+            if proc.wait() != 0:
+                raise ExternalProcessError("Error removing volume \"{}\"".format(volume), proc)
 
     def run_cmd(self, container, cmd, privileged=False,
                 quiet=False, return_output=False, user=None):
@@ -791,7 +1496,7 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
             raise ExternalProcessError(
                 "Error running command \"{}\" on container \"{}\"".format(cmd, container), proc)
         if return_output:
-            return proc.stdout.read().strip()
+            return proc.stdout.read().decode('utf-8').strip()
 
     def run_script(self, container, script, privileged=False, shell=None, user=None):
         self.logger.info("Running script on \"%s\"", container)
@@ -821,8 +1526,7 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
     def save_layout(self, container, src, dst):
         self.logger.info(
             "Saving layout \"%s:%s\" on path \"%s\"", container, src, dst)
-        args = ['cp', "{}:{}".format(container, src), "-"]
-        proc = DockerProcess(self, args, stdout=PIPE)
+        proc = self.archive_reader(container, src)
         tar = tarfile.open(fileobj=proc.stdout, mode='r|')
         for member in tar:
             member.name = os.path.normpath(member.name.lstrip('/'))
@@ -834,13 +1538,22 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
 
     def start_container(self, container):
         self.logger.info("Starting container \"%s\"", container)
-        proc = DockerProcess(self, ['start', container], stdout=FNULL)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error creating container \"{}\"".format(container), proc)
+        with self.mutating('containers'):
+            proc = DockerProcess(self, ['start', container], stdout=FNULL)
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error creating container \"{}\"".format(container), proc)
 
-    @listify
     def volumes(self, **filters):
+        if self.cache is None or set(filters) - {'name'}:
+            if self.cache is not None:
+                self.cache.bypass()
+            return self._query_volumes(**filters)
+        return [x for x in self.cache.get('volumes', self._query_volumes)
+                if 'name' not in filters or re.search(filters['name'], x['name'])]
+
+    @listify
+    def _query_volumes(self, **filters):
         params = ['driver', 'name']
         args = ['volume', 'ls']
         for key, value in filters.items():
@@ -856,19 +1569,85 @@ class DockerEngine(object): # pylint: disable=too-many-public-methods
                 volume[param] = values[num] if values[num] else None
             yield volume
 
+def prefetch_inspections(kind, subrecipes, attribute='name'):
+    """
+    Inspects the objects of **kind** named by **attribute** of every subrecipe
+    with one engine call per engine, so that the subrecipes' own existence
+    checks are answered from the shared snapshot.
+    """
+    batches = {}
+    for subrecipe in subrecipes:
+        engine = subrecipe.engine
+        if engine.cache is None:
+            continue
+        name = getattr(subrecipe, attribute)
+        if name:
+            batches.setdefault(id(engine.cache), (engine, []))[1].append(name)
+    for engine, names in batches.values():
+        engine.inspect_many(kind, names)
+
+
 class BaseDockerSubRecipe(BaseSubRecipe):
 
     def initialize(self):
         super(BaseDockerSubRecipe, self).initialize()
-        self.engine = DockerEngine(
+        backend = self.options.get('engine-backend', 'cli').strip()
+        if backend not in ENGINE_BACKENDS:
+            raise UserError('''Invalid engine backend "{}", must be one of: {}'''.format(
+                backend, ', '.join(sorted(ENGINE_BACKENDS))))
+        module_name, class_name = ENGINE_BACKENDS[backend].split(':')
+        machine_cache_ttl = int(self.options.get('machine-cache-ttl', DEFAULT_CACHE_TTL))
+        self.engine = getattr(import_module(module_name), class_name).shared(
             logger=self.logger,
             machine_name=self.options.get('machine-name', None),
             url=self.options.get('engine-url', None),
             tlsverify=self.options.get('engine-tls-verify', None),
             tlscertpath=self.options.get('engine-tls-cert-path', None),
+            cache=string_as_bool(self.options.get('engine-cache', True)),
+            machine_cache=DockerMachineCache.shared(
+                os.path.join(self.recipe.state_directory, 'machines.json'),
+                machine_cache_ttl) if machine_cache_ttl > 0 else None,
             shell=self.shell,
             timeout=int(self.options.get(
-                'timeout', DEFAULT_TIMEOUT)))
+                'timeout', DEFAULT_TIMEOUT)),
+            transfer_compression=self.transfer_compression)
+
+    def compression_option(self, name):
+        codec = self.options.get(name, 'none').strip()
+        if codec == 'none':
+            return None
+        if codec not in TRANSFER_CODECS:
+            raise UserError('''Invalid {} "{}", must be one of: {}'''.format(
+                name, codec, ', '.join(['none'] + sorted(TRANSFER_CODECS))))
+        level = self.options.get('{}-level'.format(name), None)
+        return (codec, int(level) if level is not None else None)
+
+    @property
+    @reify
+    def transfer_compression(self):
+        return self.compression_option('transfer-compression')
+
+    @property
+    @reify
+    def async_engine(self):
+        # Python 3.5+ only, imported on first use.
+        from dockeroo.docker.aio import AsyncDockerEngine, DEFAULT_CONCURRENCY
+        return AsyncDockerEngine(self.engine, concurrency=int(
+            self.options.get('engine-concurrency', DEFAULT_CONCURRENCY)))
+
+    def concurrently(self, *calls):
+        """
+        Runs the engine **calls**, (method name, args, kwargs) tuples, as
+        concurrent coroutines of **async_engine** and returns their results.
+        They run one after the other where asyncio can't be used.
+        """
+        calls = [(x[0], x[1], x[2] if len(x) > 2 else {}) for x in calls]
+        # Subprocesses can only be awaited outside the main thread since Python 3.8.
+        if sys.version_info >= (3, 8) or (sys.version_info >= (3, 5) and \
+            threading.current_thread() is threading.main_thread()): # pylint: disable=no-member
+            return self.async_engine.gather(*[
+                getattr(self.async_engine, name)(*args, **kwargs) for name, args, kwargs in calls])
+        return [getattr(self.engine, name)(*args, **kwargs) for name, args, kwargs in calls]
 
     def is_image_updated(self, name):
         if not os.path.exists(self.completed):
@@ -880,9 +1659,63 @@ class BaseDockerSubRecipe(BaseSubRecipe):
                 return True
         return False
 
+    def layout_manifest(self, container, layout):
+        """
+        Returns the path of the **load_layout()** manifest of **layout** on
+        **container**, next to the completion marker.
+        """
+        key = hashlib.md5('{}\0{}'.format(container, os.path.abspath(layout)).encode('utf-8'))
+        return os.path.join(self.location, '.layout-{}.json'.format(key.hexdigest()[:12]))
+
+    def layout_index(self, layout):
+        """
+        Returns the path of the fingerprint index of **layout**, next to the
+        completion marker.
+        """
+        key = hashlib.md5(os.path.abspath(layout).encode('utf-8'))
+        return os.path.join(self.location, '.layout-index-{}.json'.format(key.hexdigest()[:12]))
+
+    @property
+    @reify
+    def layout_scans(self):
+        return {}
+
+    def stored_layout_scan(self, layout):
+        if not os.path.exists(self.completed) or \
+            not os.path.exists(self.layout_index(layout)):
+            return None
+        with open(self.layout_index(layout)) as fileobj:
+            return json.load(fileobj)
+
+    def layout_scan(self, layout):
+        """
+        Returns the **scan_layout()** of **layout**, reusing the digests of
+        the stored fingerprint index. The scan is made once per run and
+        stored by **mark_completed()**.
+        """
+        key = os.path.abspath(layout)
+        if key not in self.layout_scans:
+            self.layout_scans[key] = scan_layout(layout, self.stored_layout_scan(layout))
+        return self.layout_scans[key]
+
+    def layout_changes(self, layout):
+        """
+        Returns the paths of **layout** changed and removed since the last
+        completed run, as returned by **diff_layout()**, or None if no
+        fingerprint index was stored.
+        """
+        previous = self.stored_layout_scan(layout)
+        if previous is None:
+            return None
+        return diff_layout(previous, self.layout_scan(layout))
+
     def is_layout_updated(self, layout):
         if not os.path.exists(self.completed):
             return True
+        changes = self.layout_changes(layout)
+        if changes is not None:
+            return any(changes)
+        self.layout_scan(layout)
         completed_mtime = os.stat(self.completed).st_mtime
         for dirname, _, files in os.walk(layout):
             if os.stat(dirname).st_mtime > completed_mtime:
@@ -891,3 +1724,12 @@ class BaseDockerSubRecipe(BaseSubRecipe):
                 if os.lstat(os.path.join(dirname, filename)).st_mtime > completed_mtime:
                     return True
         return False
+
+    def mark_completed(self, files=None):
+        files = super(BaseDockerSubRecipe, self).mark_completed(files)
+        for layout, scan in self.layout_scans.items():
+            index = self.layout_index(layout)
+            with open(index + '.tmp', 'w') as fileobj:
+                json.dump(scan, fileobj)
+            os.rename(index + '.tmp', index)
+        return files
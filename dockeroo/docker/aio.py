@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asyncio front-end to :py:class:`dockeroo.docker.DockerEngine`. Requires Python 3.5+.
+"""
+
+import asyncio
+from functools import partial
+from io import BytesIO, StringIO
+import os
+
+from dockeroo.docker import DockerEngine
+from dockeroo.utils import ExternalProcessError
+
+
+DEFAULT_CONCURRENCY = 4
+
+
+class CompletedDockerProcess(object): # pylint: disable=too-few-public-methods
+    """
+    Outcome of an asyncio **docker** subprocess, shaped like the Popen objects
+    :py:class:`ExternalProcessError` expects.
+    """
+
+    def __init__(self, returncode, stdout, stderr):
+        self.returncode = returncode
+        self.stdout = BytesIO(stdout or b'')
+        self.stderr = StringIO((stderr or b'').decode('utf-8', 'replace'))
+
+
+class AsyncDockerEngine(object):
+    """
+    Exposes the methods of a :py:class:`DockerEngine` as coroutines, running at
+    most **concurrency** of them at once against the engine.
+
+    Plain **docker** commands (pulls, container creation, start, removal and
+    **exec**) run as asyncio subprocesses of the event loop's thread; any other
+    method, as well as methods overridden by an engine backend, runs the
+    synchronous implementation in the loop's default executor.
+
+    :py:meth:`gather` is the synchronous facade: it runs coroutines to
+    completion on a private event loop and returns their results.
+
+    Example:
+
+        >>> from tests.api_server import StandInDockerServer
+        >>> server = StandInDockerServer({
+        ...     ('POST', '/containers/a/start'): (204, None),
+        ...     ('POST', '/containers/b/start'): (204, None),
+        ... })
+        >>> from dockeroo.docker.api import DockerAPIEngine
+        >>> engine = AsyncDockerEngine(
+        ...     DockerAPIEngine(url=server.url, machine_name='default'), concurrency=2)
+        >>> engine.gather(engine.start_container('a'), engine.start_container('b'))
+        [None, None]
+        >>> sorted(x[1] for x in server.requests)
+        ['/containers/a/start', '/containers/b/start']
+        >>> server.shutdown()
+    """
+
+    def __init__(self, engine, concurrency=DEFAULT_CONCURRENCY):
+        self.engine = engine
+        self.concurrency = concurrency
+        self._semaphores = {}
+
+    @property
+    def logger(self):
+        return self.engine.logger
+
+    def _limit(self):
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    def _native(self, name):
+        # Subprocess coroutines only mirror the command line implementation.
+        return getattr(type(self.engine), name) is getattr(DockerEngine, name)
+
+    def __getattr__(self, name):
+        method = getattr(self.engine, name)
+        if not callable(method):
+            return method
+
+        async def coroutine(*args, **kwargs):
+            async with self._limit():
+                return await asyncio.get_event_loop().run_in_executor(
+                    None, partial(method, *args, **kwargs))
+        coroutine.__name__ = name
+        return coroutine
+
+    async def docker(self, args, msg, stdin=None, capture=False, echo=False): # pylint: disable=too-many-arguments
+        """
+        Runs **docker** with **args**, feeding it **stdin** bytes, and returns
+        its output if **capture** is set. Otherwise the output is discarded,
+        unless **echo** is set to pass it through to ours. Raises
+        :py:class:`ExternalProcessError` with **msg** on failure.
+        """
+        env = os.environ.copy()
+        env.update(self.engine.client_environment)
+        self.logger.debug("Running command: %s", ' '.join(['docker'] + args))
+        if capture:
+            stdout = asyncio.subprocess.PIPE
+        else:
+            stdout = None if echo else asyncio.subprocess.DEVNULL
+        async with self._limit():
+            proc = await asyncio.create_subprocess_exec(
+                'docker', *args, env=env,
+                stdin=asyncio.subprocess.PIPE if stdin is not None else None,
+                stdout=stdout, stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await proc.communicate(stdin)
+        if proc.returncode != 0:
+            raise ExternalProcessError(
+                msg, CompletedDockerProcess(proc.returncode, stdout, stderr))
+        return stdout
+
+    def gather(self, *coroutines):
+        """
+        Runs **coroutines** concurrently and returns their results. The first
+        failure cancels the remaining ones and is raised.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            futures = [loop.create_task(x) for x in coroutines]
+            try:
+                return loop.run_until_complete(asyncio.gather(*futures))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                loop.run_until_complete(asyncio.gather(*futures, return_exceptions=True))
+                raise
+        finally:
+            self._semaphores.pop(loop, None)
+            loop.close()
+
+    async def create_container(self, container, image, run=False, **kwargs):
+        if not self._native('create_container'):
+            return await self.__getattr__('create_container')(
+                container, image, run=run, **kwargs)
+        exists = await self.__getattr__('exists')('container', container)
+        if not exists:
+            self.logger.info("Creating container \"%s\"", container)
+            with self.engine.mutating('containers'):
+                await self.docker(
+                    DockerEngine._create_container_args(container, image, **kwargs), # pylint: disable=protected-access
+                    "Error creating container \"{}\"".format(container))
+        if run:
+            await self.start_container(container)
+
+    async def pull_image(self, image, username=None, password=None, registry='index.docker.io'):
+        if not self._native('pull_image') or (username and password):
+            return await self.__getattr__('pull_image')(
+                image, username=username, password=password, registry=registry)
+        self.logger.info(
+            "Pulling image \"%s\" from registry \"%s\"", image, registry)
+        full_image_name = '{}/{}'.format(registry, image)
+        with self.engine.mutating('images'):
+            await self.docker(['pull', full_image_name],
+                              "Error pulling image \"{}\"".format(full_image_name))
+
+    async def remove_container(self, container):
+        if not self._native('remove_container'):
+            return await self.__getattr__('remove_container')(container)
+        containers = await self.__getattr__('containers')(include_stopped=True, name=container)
+        status = containers[0]['status'] if containers else None
+        if status in ['running', 'paused']:
+            self.logger.info("Stopping container \"%s\"", container)
+            with self.engine.mutating('containers'):
+                await self.docker(['stop', container],
+                                  "Error stopping container \"{}\"".format(container))
+        if status is not None:
+            self.logger.info("Removing container \"%s\"", container)
+            with self.engine.mutating('containers'):
+                await self.docker(['rm', container],
+                                  "Error removing container \"{}\"".format(container))
+
+    async def run_cmd(self, container, cmd, privileged=False, # pylint: disable=too-many-arguments
+                      quiet=False, return_output=False, user=None):
+        if not self._native('run_cmd'):
+            return await self.__getattr__('run_cmd')(
+                container, cmd, privileged=privileged, quiet=quiet,
+                return_output=return_output, user=user)
+        if not quiet:
+            self.logger.info(
+                "Running command \"%s\" on \"%s\"", cmd, container)
+        args = ['exec']
+        if privileged:
+            args.append('--privileged')
+        if user:
+            args += ['-u', user]
+        args += [container] + self.engine.shell.split(' ') + ['-c', cmd]
+        output = await self.docker(
+            args, "Error running command \"{}\" on container \"{}\"".format(cmd, container),
+            capture=return_output, echo=True)
+        if return_output:
+            return output.decode('utf-8').strip()
+
+    async def start_container(self, container):
+        if not self._native('start_container'):
+            return await self.__getattr__('start_container')(container)
+        self.logger.info("Starting container \"%s\"", container)
+        with self.engine.mutating('containers'):
+            await self.docker(['start', container],
+                              "Error starting container \"{}\"".format(container))
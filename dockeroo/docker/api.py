@@ -0,0 +1,740 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import base64
+from datetime import datetime
+from io import StringIO
+import json
+import os
+import socket
+import ssl
+import struct
+import sys
+import threading
+
+from builtins import object # pylint: disable=redefined-builtin
+from builtins import str # pylint: disable=redefined-builtin
+from future import standard_library
+from future.moves.http.client import HTTPConnection, HTTPSConnection, HTTPException
+from future.moves.urllib.parse import quote, urlencode, urlparse
+from zc.buildout import UserError
+
+from dockeroo.docker import DockerEngine, DEFAULT_TIMEOUT, match_image_reference
+from dockeroo.docker.listing import CONTAINER_STATUS, ContainerRecord, ImageRecord
+from dockeroo.utils import ExternalProcessError
+from dockeroo.utils import reify, listify, relay
+
+standard_library.install_aliases()
+
+DEFAULT_API_VERSION = '1.24'
+
+DEFAULT_POOL_SIZE = 4
+
+DEFAULT_SOCKET = 'unix:///var/run/docker.sock'
+
+INSPECT_PATHS = {
+    'container': '/containers/{}/json',
+    'image': '/images/{}/json',
+    'network': '/networks/{}',
+    'volume': '/volumes/{}',
+}
+
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+
+
+class DockerAPIError(ExternalProcessError):
+
+    def __init__(self, msg, status, detail=None): # pylint: disable=super-init-not-called
+        full_msg = "{} ({})".format(msg, status)
+        if detail:
+            full_msg = "{}: {}".format(full_msg, detail)
+        self.status = status
+        self.detail = detail or ''
+        RuntimeError.__init__(self, full_msg) # pylint: disable=non-parent-init-called
+
+
+class UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.unix_path)
+        self.sock = sock
+
+
+class DockerAPIResponse(object):
+    """
+    Streaming response bound to a pooled connection. The connection goes
+    back to the pool once the body has been fully consumed.
+    """
+
+    def __init__(self, client, conn, response):
+        self.client = client
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+
+    def read(self, size=-1):
+        if self.conn is None:
+            return b''
+        if size is None or size < 0:
+            data = self.response.read()
+            self.close()
+            return data
+        data = self.response.read(size)
+        if not data:
+            self.close()
+        return data
+
+    def read_exactly(self, size):
+        chunks = []
+        while size > 0:
+            data = self.read(size)
+            if not data:
+                break
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def json(self):
+        body = self.read()
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def json_stream(self):
+        buf = b''
+        while True:
+            data = self.read(65536)
+            if not data:
+                break
+            buf += data
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+        if buf.strip():
+            yield json.loads(buf.decode('utf-8'))
+
+    def frames(self):
+        """
+        Demultiplexes an attached exec/attach stream into
+        (stream, payload) tuples.
+        """
+        while True:
+            header = self.read_exactly(8)
+            if len(header) < 8:
+                return
+            stream, size = struct.unpack('>BxxxL', header)
+            yield stream, self.read_exactly(size)
+
+    def close(self):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        self.client.release(conn, reusable=self.response.isclosed() and \
+            not self.response.will_close)
+
+
+class DockerAPIRequestWriter(object):
+    """
+    File-like object streaming a request body with chunked transfer encoding.
+    """
+
+    def __init__(self, client, conn):
+        self.client = client
+        self.conn = conn
+        self.closed = False
+
+    def write(self, data):
+        if data:
+            self.conn.send(('%x\r\n' % len(data)).encode('ascii') + bytes(data) + b'\r\n')
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.conn.send(b'0\r\n\r\n')
+
+    def response(self):
+        self.close()
+        return DockerAPIResponse(self.client, self.conn, self.conn.getresponse())
+
+
+class DockerAPIClient(object):
+    """
+    Minimal Docker Engine API client speaking HTTP/1.1 over a unix socket or
+    TCP (optionally TLS), with a pool of keep-alive connections.
+
+    Example:
+
+        >>> from tests.api_server import StandInDockerServer
+        >>> server = StandInDockerServer({
+        ...     ('GET', '/version'): (200, {'Version': '1.12.3'}),
+        ... })
+        >>> client = DockerAPIClient(server.url)
+        >>> [client.get('/version')['Version'] == '1.12.3' for _ in range(3)]
+        [True, True, True]
+        >>> server.connections
+        1
+        >>> server.shutdown()
+    """
+
+    def __init__(self, url, tlsverify=False, tlscertpath=None, timeout=DEFAULT_TIMEOUT,
+                 api_version=DEFAULT_API_VERSION, pool_size=DEFAULT_POOL_SIZE):
+        self.url = urlparse(url)
+        self.tlsverify = tlsverify
+        if isinstance(tlscertpath, bytes):
+            tlscertpath = tlscertpath.decode('utf-8')
+        self.tlscertpath = tlscertpath
+        self.timeout = timeout
+        self.api_version = api_version
+        self.pool_size = pool_size
+        self._pool = []
+        self._lock = threading.Lock()
+
+    @property
+    @reify
+    def ssl_context(self):
+        tlscertpath = self.tlscertpath
+        if tlscertpath is None and self.tlsverify:
+            # As the docker client does when DOCKER_CERT_PATH is unset.
+            tlscertpath = os.path.join(os.path.expanduser('~'), '.docker')
+        has_cert = tlscertpath is not None and \
+            os.path.isfile(os.path.join(tlscertpath, 'cert.pem'))
+        if not self.tlsverify:
+            if not has_cert:
+                return None
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            cafile = os.path.join(tlscertpath, 'ca.pem')
+            if not os.path.isfile(cafile):
+                raise UserError('''TLS verification of the docker engine requires "{}"'''.format(
+                    cafile))
+            context = ssl.create_default_context(cafile=cafile)
+        if has_cert:
+            context.load_cert_chain(os.path.join(tlscertpath, 'cert.pem'),
+                                    os.path.join(tlscertpath, 'key.pem'))
+        return context
+
+    def connect(self):
+        if self.url.scheme == 'unix':
+            return UnixHTTPConnection(self.url.path, timeout=self.timeout)
+        if self.ssl_context is not None:
+            return HTTPSConnection(self.url.hostname, self.url.port or 2376,
+                                   timeout=self.timeout, context=self.ssl_context)
+        return HTTPConnection(self.url.hostname, self.url.port or 2375, timeout=self.timeout)
+
+    def acquire(self):
+        with self._lock:
+            if self._pool:
+                return self._pool.pop(), True
+        return self.connect(), False
+
+    def release(self, conn, reusable=True):
+        with self._lock:
+            if reusable and len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+
+    def path(self, path, params=None):
+        path = '/v{}{}'.format(self.api_version, path)
+        if params:
+            path = '{}?{}'.format(path, urlencode(
+                [(k, v) for k, v in sorted(params.items()) if v is not None], doseq=True))
+        return path
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        url = self.path(path, params)
+        while True:
+            conn, reused = self.acquire()
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                response = conn.getresponse()
+            except (HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    # Stale keep-alive connection: retry on a fresh one.
+                    continue
+                raise
+            return DockerAPIResponse(self, conn, response)
+
+    def check(self, response, msg):
+        if response.status >= 400:
+            detail = response.read()
+            try:
+                detail = json.loads(detail.decode('utf-8')).get('message', '')
+            except ValueError:
+                detail = detail.decode('utf-8', 'replace').strip()
+            raise DockerAPIError(msg, response.status, detail)
+        return response
+
+    def get(self, path, params=None, msg=None):
+        response = self.check(self.request('GET', path, params=params),
+                              msg or "Error requesting \"GET {}\"".format(path))
+        return response.json()
+
+    def post(self, path, params=None, body=None, headers=None, msg=None):
+        response = self.check(self.request('POST', path, params=params, body=body,
+                                           headers=headers),
+                              msg or "Error requesting \"POST {}\"".format(path))
+        return response.json()
+
+    def delete(self, path, params=None, msg=None):
+        response = self.check(self.request('DELETE', path, params=params),
+                              msg or "Error requesting \"DELETE {}\"".format(path))
+        return response.json()
+
+    def stream_request(self, method, path, params=None, headers=None):
+        # A stale pooled connection cannot be retried once the body is
+        # streaming, so uploads always start on a fresh connection.
+        conn = self.connect()
+        conn.putrequest(method, self.path(path, params), skip_accept_encoding=True)
+        for key, value in (headers or {}).items():
+            conn.putheader(key, value)
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        return DockerAPIRequestWriter(self, conn)
+
+
+class DockerAPITransfer(object):
+    """
+    Process-like adapter exposing an API archive transfer through the
+    **stdin**/**stdout**/**wait()** interface used by :py:class:`DockerEngine`.
+    """
+
+    def __init__(self, client, msg, response=None, writer=None):
+        self.client = client
+        self.msg = msg
+        self.stdout = response
+        self.stdin = writer
+        self.stderr = StringIO()
+        self.returncode = None
+
+    def wait(self):
+        if self.returncode is not None:
+            return self.returncode
+        response = self.stdout if self.stdin is None else self.stdin.response()
+        try:
+            self.client.check(response, self.msg)
+            for message in (response.json_stream() if self.stdin is not None else []):
+                if isinstance(message, dict) and message.get('error'):
+                    raise DockerAPIError(self.msg, response.status, message['error'])
+            while response.read(65536):
+                pass
+        except DockerAPIError as exc:
+            self.stderr = StringIO(str(exc.detail))
+            self.returncode = exc.status
+        else:
+            self.returncode = 0
+        finally:
+            response.close()
+        return self.returncode
+
+
+class DockerAPIEngine(DockerEngine): # pylint: disable=too-many-public-methods
+    """
+    :py:class:`DockerEngine` backend talking to the Docker Engine API directly
+    instead of forking a **docker** process for each operation. Operations
+    without an API counterpart here (**build**, **load**, **save**,
+    **exec -i**) fall back to the command line client.
+
+    Example:
+
+        >>> from tests.api_server import StandInDockerServer
+        >>> server = StandInDockerServer({
+        ...     ('GET', '/containers/json'): (200, [
+        ...         {'Id': 'f' * 64, 'Names': ['/web'], 'Image': 'nginx:latest',
+        ...          'Command': 'nginx', 'Created': 1479110400, 'Ports': [],
+        ...          'Labels': {}, 'State': 'running', 'Status': 'Up 2 hours',
+        ...          'Mounts': []}]),
+        ...     ('POST', '/containers/web/start'): (204, None),
+        ... })
+        >>> engine = DockerAPIEngine(url=server.url, machine_name='default')
+        >>> [(c['names'], c['status']) for c in engine.containers(
+        ...     include_stopped=True)] == [(['web'], 'running')]
+        True
+        >>> engine.start_container('web')
+        >>> server.connections
+        1
+        >>> server.shutdown()
+    """
+
+    probes = (('url', 'tlsverify', 'tlscertpath', 'client'), ('platform',))
+
+    def __init__(self, api_version=DEFAULT_API_VERSION, pool_size=DEFAULT_POOL_SIZE, **kwargs):
+        super(DockerAPIEngine, self).__init__(**kwargs)
+        self.api_version = api_version
+        self.pool_size = pool_size
+
+    @property
+    @reify
+    def client(self):
+        url = self.url or os.environ.get('DOCKER_HOST', DEFAULT_SOCKET)
+        if url.startswith('unix://'):
+            tlsverify, tlscertpath = False, None
+        else:
+            tlsverify, tlscertpath = bool(self.tlsverify), self.tlscertpath
+        return DockerAPIClient(url, tlsverify=tlsverify, tlscertpath=tlscertpath,
+                               timeout=self.timeout, api_version=self.api_version,
+                               pool_size=self.pool_size)
+
+    @property
+    @reify
+    def platform(self):
+        if self.machine is not None:
+            return self.machine.platform
+        return self.client.get('/info', msg="Error requesting info")['Architecture']
+
+    @staticmethod
+    def _filters(filters):
+        return json.dumps(dict([(k, [v]) for k, v in filters.items()])) if filters else None
+
+    @staticmethod
+    def _registry_auth(registry, username, password):
+        return base64.urlsafe_b64encode(json.dumps({
+            'username': username,
+            'password': password,
+            'serveraddress': registry,
+        }).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _split_image(image):
+        repository, _, tag = image.rpartition(':')
+        if not repository or '/' in tag:
+            return image, None
+        return repository, tag
+
+    def archive_reader(self, container, path):
+        msg = "Error processing path on container \"{}\"".format(container)
+        response = self.client.check(self.client.request(
+            'GET', '/containers/{}/archive'.format(quote(container)), params={'path': path}), msg)
+        return DockerAPITransfer(self.client, msg, response=response)
+
+    def archive_writer(self, container, path):
+        return DockerAPITransfer(
+            self.client, "Error processing path on container \"{}\"".format(container),
+            writer=self.client.stream_request(
+                'PUT', '/containers/{}/archive'.format(quote(container)),
+                params={'path': path}, headers={'Content-Type': 'application/x-tar'}))
+
+    def export_reader(self, container):
+        msg = "Error exporting container \"{}\"".format(container)
+        response = self.client.check(self.client.request(
+            'GET', '/containers/{}/export'.format(quote(container))), msg)
+        return DockerAPITransfer(self.client, msg, response=response)
+
+    def file_importer(self, path, image):
+        proc = self.import_writer(image)
+        with open(path, 'rb') as fileobj:
+            relay(fileobj, proc.stdin)
+        proc.stdin.close()
+        return proc
+
+    def import_writer(self, image):
+        repository, tag = self._split_image(image)
+        return DockerAPITransfer(
+            self.client, "Error importing image \"{}\"".format(image),
+            writer=self.client.stream_request(
+                'POST', '/images/create',
+                params={'fromSrc': '-', 'repo': repository, 'tag': tag},
+                headers={'Content-Type': 'application/x-tar'}))
+
+    def commit_container(self, container, image, command=None, user=None,
+                         labels=None, expose=None, volumes=None):
+        self.logger.info(
+            "Committing container \"%s\" to image \"%s\"", container, image)
+        changes = []
+        if command:
+            changes.append("CMD [{}]".format(', '.join(
+                ['"{}"'.format(x) for x in command.split()])))
+        if user:
+            changes.append("USER \"{}\"".format(user))
+        for key, value in (labels or {}).items():
+            changes.append("LABEL \"{}\"=\"{}\"".format(key, value))
+        for port in expose or []:
+            changes.append("EXPOSE {}".format(port))
+        for volume in volumes or []:
+            changes.append("VOLUME {}".format(volume))
+        repository, tag = self._split_image(image)
+        with self.mutating('images'):
+            self.client.post('/commit', params={
+                'container': container, 'repo': repository, 'tag': tag, 'changes': changes},
+                             msg="Error committing container \"{}\"".format(container))
+
+    @listify
+    def _query_containers(self, include_stopped=False, **filters):
+        params = {'filters': self._filters(filters)}
+        if include_stopped:
+            params['all'] = 1
+        for record in self.client.get('/containers/json', params=params) or []:
+            ports = []
+            for port in record.get('Ports') or []:
+                private = "{}/{}".format(port.get('PrivatePort'), port.get('Type'))
+                if port.get('PublicPort'):
+                    ports.append(("{}:{}".format(port.get('IP'), port['PublicPort']), private))
+                else:
+                    ports.append((private,))
+            yield ContainerRecord(
+                id=record['Id'][:12],
+                image=record.get('Image'),
+                command=record.get('Command'),
+                created_at=datetime.fromtimestamp(record['Created']),
+                running_for=None,
+                ports=ports,
+                status=record.get('State') or CONTAINER_STATUS.get(
+                    record.get('Status', '').split(' ')[0].lower()),
+                size=None,
+                names=[x.lstrip('/') for x in record.get('Names') or []],
+                labels=list((record.get('Labels') or {}).items()),
+                mounts=[x.get('Name') or x.get('Source') for x in record.get('Mounts') or []])
+
+    def create_container(self, container, image, command=None, privileged=False, run=False, # pylint: disable=too-many-arguments,too-many-locals
+                         tty=False, volumes=None, volumes_from=None, user=None, networks=None,
+                         links=None, network_aliases=None, env=None, ports=None):
+        if not self.exists('container', container):
+            self.logger.info("Creating container \"%s\"", container)
+            port_bindings = {}
+            for key, value in (ports or {}).items():
+                port = value if '/' in value else "{}/tcp".format(value)
+                host_ip, _, host_port = key.rpartition(':')
+                port_bindings.setdefault(port, []).append(
+                    {'HostIp': host_ip, 'HostPort': host_port})
+            host_config = {
+                'Privileged': privileged,
+                'Binds': ["{}:{}".format(key, value) for key, value in volumes or []],
+                'VolumesFrom': [volumes_from] if volumes_from else [],
+                'PortBindings': port_bindings,
+                'Links': ["{}:{}".format(key, value) for key, value in (links or {}).items()],
+            }
+            config = {
+                'Image': image,
+                'Tty': tty,
+                'Env': ["{}={}".format(key, value) for key, value in (env or {}).items()],
+                'ExposedPorts': dict([(port, {}) for port in port_bindings]),
+                'HostConfig': host_config,
+            }
+            if user:
+                config['User'] = user
+            if command:
+                config['Cmd'] = command.split(" ")
+            networks = list(networks or [])
+            if networks:
+                host_config['NetworkMode'] = networks[0]
+                config['NetworkingConfig'] = {'EndpointsConfig': dict([
+                    (network, {'Aliases': list(network_aliases or [])}) for network in networks])}
+            with self.mutating('containers'):
+                self.client.post('/containers/create', params={'name': container}, body=config,
+                                 msg="Error creating container \"{}\"".format(container))
+        if run:
+            self.start_container(container)
+
+    def create_network(self, network, driver='bridge', gateway=None, subnet=None,
+                       ip_range=None, ipv6=False, internal=False):
+        self.logger.info("Creating network \"%s\"", network)
+        ipam_config = dict([(k, v) for k, v in (('Gateway', gateway), ('Subnet', subnet),
+                                                 ('IPRange', ip_range)) if v is not None])
+        with self.mutating('networks'):
+            self.client.post('/networks/create', body={
+                'Name': network,
+                'Driver': driver,
+                'EnableIPv6': ipv6,
+                'Internal': internal,
+                'IPAM': {'Config': [ipam_config] if ipam_config else []},
+            }, msg="Error creating network \"{}\"".format(network))
+
+    def create_volume(self, volume):
+        if self.exists('volume', volume):
+            return
+        self.logger.info("Creating volume \"%s\"", volume)
+        with self.mutating('volumes'):
+            self.client.post('/volumes/create', body={'Name': volume},
+                             msg="Error creating volume \"{}\"".format(volume))
+
+    def _query_inspect(self, kind, names):
+        # The API has no batch inspect: names are requested one after the
+        # other over the same keep-alive connection.
+        records = []
+        for name in names:
+            try:
+                records.append(self.client.get(
+                    INSPECT_PATHS[kind].format(quote(name)),
+                    msg="Error requesting \"docker inspect {}\"".format(name)))
+            except DockerAPIError as error:
+                if error.status != 404:
+                    raise
+        return records
+
+    def _query_images(self, name=None, **filters):
+        for record in self.client.get('/images/json',
+                                      params={'filters': self._filters(filters)}) or []:
+            image_id = record['Id'].split(':', 1)[-1][:12]
+            repo_tags = [x for x in record.get('RepoTags') or [] if x != '<none>:<none>'] \
+                or [None]
+            for repo_tag in repo_tags:
+                repository, tag = self._split_image(repo_tag) if repo_tag else (None, None)
+                if name is not None and not match_image_reference(name, repository, tag):
+                    continue
+                digests = [x.split('@', 1)[1] for x in record.get('RepoDigests') or []
+                           if x.split('@', 1)[0] == repository]
+                yield ImageRecord(
+                    id=image_id,
+                    repository=repository,
+                    tag=tag,
+                    digest=digests[0] if digests else None,
+                    created_since=None,
+                    created_at=datetime.fromtimestamp(record['Created']),
+                    size=record.get('Size'),
+                    image=repo_tag or image_id)
+
+    @listify
+    def _query_networks(self, **filters):
+        for record in self.client.get('/networks',
+                                      params={'filters': self._filters(filters)}) or []:
+            yield {
+                'id': record['Id'][:12],
+                'name': record['Name'],
+                'driver': record['Driver'],
+            }
+
+    def pull_image(self, image, username=None, password=None, registry='index.docker.io'):
+        self.logger.info(
+            "Pulling image \"%s\" from registry \"%s\"", image, registry)
+        full_image_name = '{}/{}'.format(registry, image)
+        headers = {}
+        if username and password:
+            headers['X-Registry-Auth'] = self._registry_auth(registry, username, password)
+        repository, tag = self._split_image(full_image_name)
+        msg = "Error pulling image \"{}\"".format(full_image_name)
+        with self.mutating('images'):
+            response = self.client.check(self.client.request(
+                'POST', '/images/create', params={'fromImage': repository, 'tag': tag or 'latest'},
+                headers=headers), msg)
+            for message in response.json_stream():
+                if message.get('error'):
+                    response.close()
+                    raise DockerAPIError(msg, response.status, message['error'])
+
+    def remove_container(self, container):
+        try:
+            status = list(self.containers(include_stopped=True, name=container))[0]['status']
+        except IndexError:
+            status = None
+        if status in ['running', 'paused']:
+            self.logger.info("Stopping container \"%s\"", container)
+            with self.mutating('containers'):
+                self.client.post('/containers/{}/stop'.format(quote(container)),
+                                 msg="Error stopping container \"{}\"".format(container))
+        if status is not None:
+            self.logger.info("Removing container \"%s\"", container)
+            with self.mutating('containers'):
+                self.client.delete('/containers/{}'.format(quote(container)),
+                                   msg="Error removing container \"{}\"".format(container))
+
+    def remove_image(self, name):
+        for container in self.containers(include_stopped=True, ancestor=name):
+            self.remove_container(container['names'][0])
+        for image in list(self.images(name=name)):
+            self.logger.info("Removing image \"%s\"", image['image'])
+            with self.mutating('images'):
+                self.client.delete('/images/{}'.format(quote(image['image'])),
+                                   msg="Error removing image \"{}\"".format(image['image']))
+
+    def remove_network(self, network):
+        for container in self.containers(include_stopped=True, network=network):
+            self.remove_container(container['names'][0])
+        self.logger.info("Removing network \"%s\"", network)
+        with self.mutating('networks'):
+            self.client.delete('/networks/{}'.format(quote(network)),
+                               msg="Error removing network \"{}\"".format(network))
+
+    def remove_volume(self, volume):
+        for container in self.containers(include_stopped=True, volume=volume):
+            self.remove_container(container['names'][0])
+        self.logger.info("Removing volume \"%s\"", volume)
+        with self.mutating('volumes'):
+            self.client.delete('/volumes/{}'.format(quote(volume)),
+                               msg="Error removing volume \"{}\"".format(volume))
+
+    def run_cmd(self, container, cmd, privileged=False,
+                quiet=False, return_output=False, user=None):
+        if not quiet:
+            self.logger.info(
+                "Running command \"%s\" on \"%s\"", cmd, container)
+        msg = "Error running command \"{}\" on container \"{}\"".format(cmd, container)
+        config = {
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Privileged': privileged,
+            'Cmd': self.shell.split(' ') + ['-c', cmd],
+        }
+        if user:
+            config['User'] = user
+        exec_id = self.client.post('/containers/{}/exec'.format(quote(container)),
+                                   body=config, msg=msg)['Id']
+        response = self.client.check(self.client.request(
+            'POST', '/exec/{}/start'.format(exec_id), body={'Detach': False, 'Tty': False}), msg)
+        output, errors = [], []
+        for stream, payload in response.frames():
+            if stream == STREAM_STDERR:
+                errors.append(payload)
+            elif return_output:
+                output.append(payload)
+            else:
+                getattr(sys.stdout, 'buffer', sys.stdout).write(payload)
+        response.close()
+        exit_code = self.client.get('/exec/{}/json'.format(exec_id), msg=msg)['ExitCode']
+        if exit_code != 0:
+            raise DockerAPIError(msg, exit_code,
+                                 ' '.join(b''.join(errors).decode('utf-8', 'replace').splitlines()))
+        if return_output:
+            return b''.join(output).decode('utf-8').strip()
+
+    def start_container(self, container):
+        self.logger.info("Starting container \"%s\"", container)
+        with self.mutating('containers'):
+            self.client.post('/containers/{}/start'.format(quote(container)),
+                             msg="Error starting container \"{}\"".format(container))
+
+    @listify
+    def _query_volumes(self, **filters):
+        result = self.client.get('/volumes', params={'filters': self._filters(filters)}) or {}
+        for record in result.get('Volumes') or []:
+            yield {
+                'driver': record['Driver'],
+                'name': record['Name'],
+            }
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+
+from builtins import object # pylint: disable=redefined-builtin
+
+
+LISTING_KINDS = ('containers', 'images', 'networks', 'volumes')
+
+
+class ListingCache(object):
+    """
+    In-memory snapshot of engine listings, shared by every :py:class:`DockerEngine`
+    pointing to the same engine during a buildout run. Listings are fetched
+    unfiltered once and kept until a mutating engine method invalidates them.
+
+    Example:
+
+        >>> cache = ListingCache()
+        >>> calls = []
+        >>> def loader():
+        ...     calls.append(1)
+        ...     return [{'name': 'a'}, {'name': 'b'}]
+        >>> len(cache.get('volumes', loader)), len(cache.get('volumes', loader))
+        (2, 2)
+        >>> cache.invalidate('volumes')
+        >>> len(cache.get('volumes', loader))
+        2
+        >>> len(calls)
+        2
+        >>> sorted(cache.stats().items())
+        [('bypasses', 0), ('hits', 1), ('invalidations', 1), ('misses', 2)]
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.listings = {}
+        self.inspections = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def shared(cls, key):
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls()
+            return cls._shared[key]
+
+    def get(self, kind, loader):
+        with self.lock:
+            if kind in self.listings:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.listings[kind] = list(loader())
+            return self.listings[kind]
+
+    def inspected(self, kind, names):
+        """
+        Returns the known inspect results of **names** and the names still to be
+        inspected. A None result records that the object doesn't exist.
+
+        Example:
+
+            >>> cache = ListingCache()
+            >>> cache.store('volumes', {'a': {'Name': 'a'}, 'b': None})
+            >>> cache.inspected('volumes', ['a', 'b', 'c'])
+            ({'a': {'Name': 'a'}, 'b': None}, ['c'])
+            >>> cache.invalidate('volumes')
+            >>> cache.inspected('volumes', ['a'])
+            ({}, ['a'])
+        """
+        with self.lock:
+            known = self.inspections.get(kind, {})
+            found = dict([(x, known[x]) for x in names if x in known])
+            missing = [x for x in names if x not in known]
+            if missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return found, missing
+
+    def store(self, kind, results):
+        with self.lock:
+            self.inspections.setdefault(kind, {}).update(results)
+
+    def bypass(self):
+        with self.lock:
+            self.bypasses += 1
+
+    def invalidate(self, *kinds):
+        with self.lock:
+            for kind in kinds or LISTING_KINDS:
+                listing = self.listings.pop(kind, None)
+                inspections = self.inspections.pop(kind, None)
+                if listing is not None or inspections:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'invalidations': self.invalidations,
+            }
+
@@ -33,9 +33,7 @@ class DockerCopySubRecipe(BaseDockerSubRecipe):
                                             self.options.get('paths', '').splitlines()] if f]]
 
     def install(self):
-        for src, dst in self.paths:
-            self.engine.copy_path(self.container_from,
-                                  self.container_to, src, dst=dst)
+        self.engine.copy_paths(self.container_from, self.container_to, self.paths)
 
     def update(self):
         pass
@@ -16,6 +16,8 @@
 # limitations under the License.
 
 
+from functools import partial
+
 from zc.buildout import UserError
 
 from dockeroo import BaseGroupRecipe
@@ -57,11 +59,18 @@ class DockerGentooBootstrapSubRecipe(BaseDockerSubRecipe): # pylint: disable=too
             if prefix == '/':
                 prefix = None
             self.archives.append(
-                Archive(url=url, prefix=prefix, md5sum=md5sum))
+                Archive(url=url, prefix=prefix, md5sum=md5sum, decompressor=self.options.get(
+                    'archive-decompressor', 'auto')))
         self.volumes = [y for y in [x.strip().split(
             ':', 1) for x in self.options.get('volumes', '').splitlines()] if y[0]]
         self.volumes_from = self.options.get('volumes-from', None)
 
+    def prefetch(self):
+        if any([x for x in self.engine.images() if self.name == x['image']]):
+            return []
+        return [(('archive', x.url), partial(x.download, self.recipe.buildout))
+                for x in self.archives]
+
     def install(self):
         if not any([x for x in self.engine.images() if self.name == x['image']]):
             if not self.archives:
@@ -82,7 +91,9 @@ class DockerGentooBootstrapSubRecipe(BaseDockerSubRecipe): # pylint: disable=too
         self.engine.install_freeze(self.container)
 
         if self.layout:
-            self.engine.load_layout(self.container, self.layout)
+            self.engine.load_layout(self.container, self.layout,
+                                    manifest=self.layout_manifest(self.container, self.layout),
+                                    files=self.layout_scan(self.layout))
 
         self.engine.start_container(self.container)
 
@@ -233,6 +244,13 @@ class DockerGentooBootstrapRecipe(BaseGroupRecipe):
 
     .. describe:: Configuration options
 
+       archive-decompressor
+           How compressed **archives** are decompressed: "auto" (default) pipes them
+           through the first parallel decompressor found on PATH (pixz, pbzip2,
+           lbzip2, pigz, "xz -T0" or "zstd -T0", depending on the format), falling
+           back to Python, "python" always decompresses them in Python. Any other
+           value is a command decompressing stdin to stdout.
+
        archives
            List of URLs of operating system initial filesystem contents (Gentoo stageX).
 
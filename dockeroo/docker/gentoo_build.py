@@ -16,17 +16,24 @@
 # limitations under the License.
 
 
+from functools import partial
+import json
+import os
 import re
-import shutil
-import tempfile
 
 from shellescape import quote
+from zc.buildout import UserError
 
 from dockeroo import BaseGroupRecipe
 from dockeroo.docker import Archive, BaseDockerSubRecipe
+from dockeroo.docker.portage import package_atoms_command, package_modifiers_script
+from dockeroo.docker.portage import parse_emerge_pretend, parse_package_atoms
 from dockeroo.utils import merge, string_as_bool
 
 
+BINPKG_PKGDIR = '/var/cache/dockeroo-binpkgs'
+
+
 class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-instance-attributes
 
     def initialize(self):
@@ -47,7 +54,8 @@ class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-man
             if prefix == '/':
                 prefix = None
             self.archives.append(
-                Archive(url=url, prefix=prefix, md5sum=md5sum))
+                Archive(url=url, prefix=prefix, md5sum=md5sum, decompressor=self.options.get(
+                    'archive-decompressor', 'auto')))
 
         self.accept_keywords = [f for f in [x.strip() for x in \
             self.options.get('accept-keywords', '').splitlines()] if f]
@@ -101,6 +109,9 @@ class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-man
         self.processor = self.options.get('processor', self.platform)
         self.variant = self.options.get('variant', 'dockeroo')
         self.abi = self.options.get('abi', 'gnu')
+        self.chost = "{}-{}-linux-{}".format(self.processor, self.variant, self.abi)
+        self.binpkg_cache = self.options.get('binpkg-cache', None)
+        self.binpkg_report = {'binary': [], 'source': []}
 
         self.assemble_script_user = self.options.get('assemble-script-user', None)
         self.assemble_script_shell = self.options.get('assemble-script-shell', self.shell)
@@ -133,27 +144,88 @@ class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-man
                         if y]
         self.volumes_from = self.options.get('volumes-from', None)
 
-    def add_package_modifier(self, name, modifiers):
-        for modifier in modifiers:
-            slug = re.sub(r'\W+', '_', modifier.split(None, 1)[0])
-            self.engine.run_cmd(
-                self.build_container,
-                "chroot-{arch}-docker -c \"test -f /etc/portage/package.{name} && "
-                "echo {modifier} >>/etc/portage/package.{name} || "
-                "mkdir -p /etc/portage/package.{name} && "
-                "echo {modifier} >>/etc/portage/package.{name}/{slug}\"".format(
-                    arch=self.arch, modifier=quote(modifier), slug=slug, name=name))
+    def add_package_modifiers(self, modifiers):
+        if not any(modifiers.values()):
+            return
+        self.logger.info("Writing %d package modifiers on \"%s\"",
+                         sum([len(x) for x in modifiers.values()]), self.build_container)
+        self.engine.run_cmd(
+            self.build_container,
+            "chroot-{arch}-docker -c {script}".format(
+                arch=self.arch, script=quote(package_modifiers_script(modifiers))),
+            quiet=True)
+
+    @property
+    def binpkg_volume(self):
+        """
+        Returns the volume or engine host directory holding the binary
+        packages shared by every part building for the same CHOST, or None.
+        """
+        if not self.binpkg_cache:
+            return None
+        if self.binpkg_cache == 'volume':
+            return "dockeroo-binpkgs-{}".format(re.sub(r'\W+', '_', self.chost))
+        return os.path.join(self.binpkg_cache, self.chost)
+
+    @property
+    def portage_env(self):
+        return "PKGDIR={} ".format(BINPKG_PKGDIR) if self.binpkg_cache else ""
+
+    def emerge(self, packages):
+        def command(options=""):
+            return "env {env} chroot-{arch}-docker -c \"{portage_env}emerge -kb " \
+                "--binpkg-respect-use=y {options}{packages}\"".format(
+                    arch=self.arch, packages=' '.join(packages), portage_env=self.portage_env,
+                    options=options, env=' '.join(['='.join(x) for x in self.build_env.items()]))
+        if self.binpkg_cache:
+            binaries, builds = parse_emerge_pretend(self.engine.run_cmd(
+                self.build_container, command("--pretend --nospinner "),
+                quiet=True, return_output=True))
+            self.logger.info("Binary package cache \"%s\": %d hits, %d source builds",
+                             self.binpkg_volume, len(binaries), len(builds))
+            self.binpkg_report['binary'].extend(binaries)
+            self.binpkg_report['source'].extend(builds)
+        self.engine.run_cmd(self.build_container, command())
+
+    def write_binpkg_report(self):
+        self.recipe.mkdir(self.location)
+        report = os.path.join(self.location, 'binpkg-report.json')
+        with open(report + '.tmp', 'w') as fileobj:
+            json.dump(dict(self.binpkg_report, chost=self.chost, cache=self.binpkg_volume),
+                      fileobj, indent=2, sort_keys=True)
+        os.rename(report + '.tmp', report)
+
+    def resolve_package_atoms(self, packages):
+        """
+        Returns a dictionary mapping each of **packages** to its installed
+        version on the build container, resolved with a single exec.
+        """
+        if not packages:
+            return {}
+        atoms = parse_package_atoms(self.engine.run_cmd(
+            self.build_container,
+            "chroot-{arch}-docker -c {command}".format(
+                arch=self.arch, command=quote(package_atoms_command(packages))),
+            quiet=True, return_output=True))
+        missing = [x for x in packages if atoms.get(x) is None]
+        if missing:
+            raise UserError("Packages not installed on \"{}\": {}".format(
+                self.build_container, ' '.join(missing)))
+        return atoms
+
+    def prefetch(self):
+        if self.base_image:
+            return []
+        return [(('archive', x.url), partial(x.download, self.recipe.buildout))
+                for x in self.archives]
 
     def create_base_image(self, name):
         if self.archives:
             for archive in self.archives:
                 archive.download(self.recipe.buildout)
             self.engine.import_archives(name, *self.archives)
-        else:
-            root = tempfile.mkdtemp()
-            self.engine.import_path(root, name)
-            shutil.rmtree(root)
-        return name
+            return name
+        return self.engine.scratch_image()
 
     def install(self):
         if self.platform != self.engine.platform:
@@ -165,59 +237,65 @@ class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-man
             base_image = self.base_image
         else:
             base_image = self.create_base_image(self.name)
-        self.engine.remove_container(self.assemble_container)
-        self.engine.create_container(self.assemble_container, base_image, command="/bin/freeze",
-                                     privileged=True, tty=self.tty, volumes_from=self.volumes_from)
+        containers = [self.assemble_container]
+        creations = [('create_container', (self.assemble_container, base_image), {
+            'command': "/bin/freeze", 'privileged': True, 'tty': self.tty,
+            'volumes_from': self.volumes_from})]
+        if self.build_image:
+            containers.append(self.build_container)
+            volumes = None
+            if self.binpkg_cache:
+                if self.binpkg_cache == 'volume':
+                    self.engine.create_volume(self.binpkg_volume)
+                volumes = [(self.binpkg_volume, "/usr/{}{}".format(self.chost, BINPKG_PKGDIR))]
+            creations.append(('create_container', (self.build_container, self.build_image), {
+                'command': self.build_command, 'privileged': True, 'tty': self.tty,
+                'volumes': volumes, 'volumes_from': self.build_volumes_from}))
+        self.concurrently(*[('remove_container', (x,)) for x in containers])
+        self.concurrently(*creations)
         self.engine.install_freeze(self.assemble_container)
-        self.engine.start_container(self.assemble_container)
+        self.concurrently(*[('start_container', (x,)) for x in containers])
 
         if self.build_image:
-            self.engine.remove_container(self.build_container)
-            self.engine.create_container(self.build_container, self.build_image,
-                                         command=self.build_command,
-                                         privileged=True, tty=self.tty,
-                                         volumes_from=self.build_volumes_from)
-            self.engine.start_container(self.build_container)
             if self.build_layout:
                 self.engine.load_layout(self.build_container, self.build_layout)
-            self.add_package_modifier('accept_keywords', self.accept_keywords)
-            self.add_package_modifier('mask', self.masks)
-            self.add_package_modifier('unmask', self.unmasks)
-            self.add_package_modifier('use', self.uses)
-            self.engine.run_cmd(
-                self.build_container,
-                "chroot-{arch}-docker -c \"eclean packages && emaint binhost --fix\""
-                .format(arch=self.arch))
+            self.add_package_modifiers({
+                'accept_keywords': self.accept_keywords,
+                'mask': self.masks,
+                'unmask': self.unmasks,
+                'use': self.uses,
+            })
+            if self.binpkg_cache:
+                # A shared cache holds packages of other parts, don't clean it.
+                self.engine.run_cmd(
+                    self.build_container,
+                    "chroot-{arch}-docker -c \"{portage_env}emaint binhost --fix\""
+                    .format(arch=self.arch, portage_env=self.portage_env))
+            else:
+                self.engine.run_cmd(
+                    self.build_container,
+                    "chroot-{arch}-docker -c \"eclean packages && emaint binhost --fix\""
+                    .format(arch=self.arch))
             if self.pre_build_script:
                 self.engine.run_script(self.build_container, self.pre_build_script,
                                        shell=self.pre_build_script_shell, user=self.pre_build_script_user)
             if self.build_dependencies:
-                self.engine.run_cmd(
-                    self.build_container,
-                    "env {env} chroot-{arch}-docker -c \"emerge -kb --binpkg-respect-use=y {packages}\""
-                    .format(arch=self.arch, packages=' '.join(self.build_dependencies),
-                            env=' '.join(['='.join(x) for x in self.build_env.items()])))
+                self.emerge(self.build_dependencies)
             if self.build_script:
                 self.engine.run_script(self.build_container, self.build_script,
                                        shell=self.build_script_shell, user=self.build_script_user)
             if self.packages:
-                self.engine.run_cmd(
-                    self.build_container,
-                    "env {env} chroot-{arch}-docker -c \"emerge -kb --binpkg-respect-use=y {packages}\""
-                    .format(arch=self.arch, packages=' '.join(self.packages),
-                            env=' '.join(['='.join(x) for x in self.build_env.items()])))
-            package_atoms = ["={}".format(
-                self.engine.run_cmd(
-                    self.build_container,
-                    "chroot-{arch}-docker -c \"equery list --format=\"\\$cpv\" {package}\" | "
-                    "head -1"
-                    .format(arch=self.arch, package=package),
-                    quiet=True, return_output=True)) for package in self.packages]
+                self.emerge(self.packages)
+            atoms = self.resolve_package_atoms(self.packages)
+            package_atoms = ["={}".format(atoms[x]) for x in self.packages]
             if package_atoms:
                 self.engine.run_cmd(
                     self.build_container,
-                    "chroot-{arch}-docker -c \"ROOT=/dockeroo-root emerge -OK {packages}\"".format(
-                        arch=self.arch, packages=' '.join(package_atoms)))
+                    "chroot-{arch}-docker -c \"{portage_env}ROOT=/dockeroo-root emerge -OK {packages}\""
+                    .format(arch=self.arch, packages=' '.join(package_atoms),
+                            portage_env=self.portage_env))
+            if self.binpkg_cache:
+                self.write_binpkg_report()
             if self.post_build_script:
                 self.engine.run_script(self.build_container, self.post_build_script,
                                        shell=self.post_build_script_shell, user=self.post_build_script_user)
@@ -225,9 +303,7 @@ class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-man
                                   "/usr/{processor}-{variant}-linux-{abi}/dockeroo-root/".format(
                                       processor=self.processor, variant=self.variant, abi=self.abi),
                                   dst="/")
-            for src, dst in self.copy:
-                self.engine.copy_path(self.build_container,
-                                      self.assemble_container, src, dst=dst)
+            self.engine.copy_paths(self.build_container, self.assemble_container, self.copy)
             self.engine.remove_container(self.build_container)
         if self.layout:
             self.engine.load_layout(self.assemble_container, self.layout,
@@ -253,8 +329,8 @@ class DockerGentooBuildSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-man
         return self.mark_completed()
 
     def uninstall(self):
-        self.engine.remove_container(self.build_container)
-        self.engine.remove_container(self.assemble_container)
+        self.concurrently(('remove_container', (self.build_container,)),
+                          ('remove_container', (self.assemble_container,)))
         if not self.keep:
             self.engine.remove_image(self.name)
 
@@ -322,6 +398,13 @@ class DockerGentooBuildRecipe(BaseGroupRecipe):
        arch
            Target architecture. Defaults to machine architecture.
 
+       archive-decompressor
+           How compressed **archives** are decompressed: "auto" (default) pipes them
+           through the first parallel decompressor found on PATH (pixz, pbzip2,
+           lbzip2, pigz, "xz -T0" or "zstd -T0", depending on the format), falling
+           back to Python, "python" always decompresses them in Python. Any other
+           value is a command decompressing stdin to stdout.
+
        archives
            List of URLs of operating system initial filesystem contents for **assemble-image**.
 
@@ -332,6 +415,16 @@ class DockerGentooBuildRecipe(BaseGroupRecipe):
            Name of image to use for instantiation of **assemble-container**.
            If unset, **archives** will be used to populate if available, otherwise an empty image will be created.
 
+       binpkg-cache
+           Shares the binary packages built by **build-container** with every
+           other part building for the same CHOST. If set to "volume", they are
+           kept in a "dockeroo-binpkgs-<CHOST>" volume, otherwise in the <CHOST>
+           subdirectory of this directory on the engine host. The cache is
+           mounted as PKGDIR of the chrooted environment and is never cleaned
+           with **eclean**. The packages merged from the cache and those built
+           from source are logged and listed in binpkg-report.json in the part
+           directory.
+
        build-command
           Command to launch on builder container upon creation. Defaults to "/bin/freeze".
 
@@ -18,9 +18,16 @@
 
 import os
 
+from zc.buildout import UserError
+
 from dockeroo import BaseGroupRecipe
+from dockeroo.diskimage import DiskImage, parse_partitions, parse_size
 from dockeroo.docker import BaseDockerSubRecipe
-from dockeroo.utils import string_as_bool
+from dockeroo.utils import COMPRESSED_EXTENSIONS, CompressingWriter
+from dockeroo.utils import relay, string_as_bool
+
+
+ASSEMBLY_MODES = ('container', 'host')
 
 
 class GentooDiskImageSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-instance-attributes
@@ -28,9 +35,14 @@ class GentooDiskImageSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-
     def initialize(self):
         super(GentooDiskImageSubRecipe, self).initialize()
 
+        self.assembly = self.options.get('assembly', 'container').strip()
+        if self.assembly not in ASSEMBLY_MODES:
+            raise UserError('''Invalid assembly "{}", must be one of: {}'''.format(
+                self.assembly, ', '.join(ASSEMBLY_MODES)))
         self.build_command = self.options.get('build-command', "/bin/freeze")
         self.build_container = "{}_build".format(self.name)
-        self.build_image = self.options['build-image']
+        self.build_image = self.options['build-image'] \
+            if self.assembly == 'container' else None
         self.build_volumes_from = self.options.get('build-volumes-from', None)
         self.build_script_user = self.options.get('build-script-user', None)
         self.build_script_shell = self.options.get(
@@ -47,15 +59,26 @@ class GentooDiskImageSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-
                  [x.strip() for x in
                   self.options.get('build-script').replace('$$', '$').splitlines()]
                  if _f])) if self.options.get('build-script', None) is not None else None
-        self.build_root = self.options['build-root']
+        self.build_root = self.options['build-root'] \
+            if self.assembly == 'container' else None
         self.base_image = self.options['base-image']
         self.image_file = self.options['image-file']
+        self.image_compression = self.compression_option('image-compression')
+        self.rootfs_cache = os.path.join(self.recipe.state_directory, 'rootfs') \
+            if string_as_bool(self.options.get('rootfs-cache', False)) else None
+        if self.assembly == 'host':
+            self.partitions = parse_partitions(self.options['partitions'])
+            self.image_size = parse_size(self.options['image-size']) \
+                if 'image-size' in self.options else None
+            self.partition_table = self.options.get('partition-table', 'dos').strip()
 
         self.platform = self.options.get('platform', self.engine.platform)
         self.arch = self.options.get('arch', self.platform)
         self.tty = string_as_bool(self.options.get('tty', False))
 
     def install(self):
+        if self.assembly == 'host':
+            return self.install_on_host()
         if self.platform != self.engine.platform:
             if self.engine.machine is not None:
                 self.engine.machine.config_binfmt(self.platform)
@@ -72,26 +95,48 @@ class GentooDiskImageSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-
                                    shell=self.build_script_shell,
                                    user=self.build_script_user)
         self.engine.copy_image_to_container(
-            self.base_image, self.build_container, "/", dst=self.build_root)
+            self.base_image, self.build_container, "/", dst=self.build_root,
+            cache=self.rootfs_cache)
         if self.build_script:
             self.engine.run_script(self.build_container, self.build_script,
                                    shell=self.build_script_shell,
                                    user=self.build_script_user)
         self.recipe.mkdir(self.location)
-        self.engine.export_files(self.build_container, self.image_file, self.location)
+        self.engine.export_files(self.build_container, self.image_file, self.location,
+                                 compression=self.image_compression)
         self.engine.remove_container(self.build_container)
         self.engine.clean_stale_images()
         return self.mark_completed()
 
+    def install_on_host(self):
+        self.recipe.mkdir(self.location)
+        path = os.path.join(self.location, os.path.basename(self.image_file))
+        image = DiskImage(path, self.partitions, size=self.image_size,
+                          table=self.partition_table, logger=self.logger)
+        with image.assembling():
+            self.engine.export_image(
+                self.base_image, image.writer(),
+                "Error extracting image \"{}\"".format(self.base_image), cache=self.rootfs_cache)
+            image.build()
+        if self.image_compression is not None:
+            codec, level = self.image_compression
+            fout = CompressingWriter(open(path + COMPRESSED_EXTENSIONS[codec], 'wb'), codec, level)
+            with open(path, 'rb') as fin:
+                relay(fin, fout)
+            fout.close()
+            os.remove(path)
+        return self.mark_completed()
+
     def update(self):
-        if self.is_image_updated(self.build_image) or \
+        if (self.build_image is not None and self.is_image_updated(self.build_image)) or \
                 self.is_image_updated(self.base_image):
             return self.install()
         else:
             return (self.completed, )
 
     def uninstall(self):
-        self.engine.remove_container(self.build_container)
+        if self.assembly == 'container':
+            self.engine.remove_container(self.build_container)
 
 
 class DockerGentooDiskImageRecipe(BaseGroupRecipe):
@@ -143,10 +188,36 @@ class DockerGentooDiskImageRecipe(BaseGroupRecipe):
             umount /dev/loop0p3
             losetup -d /dev/loop0 >/dev/null 2>&1
 
+       With **assembly = host**, no builder container is used: the filesystem of
+       **base-image** is streamed from **docker export** into a staging directory
+       on the host, extracted under **fakeroot** when not running as root, and
+       the partitions are created at their offsets in a sparse image file.
+       This needs **sfdisk**, **mkswap**, **mke2fs** 1.43 or later, **mkfs.vfat**
+       from dosfstools 4.0 or later and **mcopy** from mtools on the host, but no
+       privileges nor loop devices.
+
+    .. code-block:: ini
+
+        [disk-image]
+        recipe = dockeroo:docker.gentoo-diskimage
+        assembly = host
+        base-image = base:latest
+        image-file = disk.img
+        image-size = 2G
+        partitions =
+            /boot vfat 130M BOOT
+            none swap 512M
+            / ext4 *
+
     .. describe:: Configuration options
 
        This recipe accepts the following options:
 
+       assembly
+          Where the disk image is assembled: "container" (default), in the builder
+          container by **prepare-script** and **build-script**, or "host", from
+          **partitions**.
+
        base-image
           Docker image to use as base for disk creation.
 
@@ -171,8 +242,22 @@ class DockerGentooDiskImageRecipe(BaseGroupRecipe):
        build-volumes-from
           Volumes to be mounted on build container upon creation.
 
+       image-compression
+          Compress the saved disk image: "none" (default), "gzip" or "zstd", which
+          adds a ".gz" or ".zst" extension. Uncompressed images are saved as sparse
+          files, with runs of zeros left as holes.
+
+       image-compression-level
+          Compression level of **image-compression**. Defaults to 6 for "gzip" and 3 for "zstd".
+
        image-file
-          Disk image file which is extracted from build container.
+          Disk image file which is extracted from build container. With **assembly = host**,
+          only its file name is used.
+
+       image-size
+          Size of the disk image with **assembly = host**, with an optional K, M, G or T
+          suffix. Defaults to the size of **partitions**, which is required if one of
+          them takes the space left.
 
        location 
           Path where disk image will be saved. Defaults to ${buildout:parts-directory}/${:name}.
@@ -181,9 +266,25 @@ class DockerGentooDiskImageRecipe(BaseGroupRecipe):
           Docker machine where **build-image** and **base-image** reside.
           Defaults to DOCKER_MACHINE_NAME environment variable or "default" if unset.
 
+       partition-table
+          Partition table with **assembly = host**: "dos" (default) or "gpt".
+
+       partitions
+          Partitions created with **assembly = host**, one "<mountpoint> <filesystem>
+          <size> [<label>]" line each, in disk order. Filesystems are "ext2", "ext3",
+          "ext4", "vfat" and "swap", whose mountpoint is "none". Each partition holds
+          the files of **base-image** under its mountpoint, except those of the partitions
+          mounted below it. The size of one partition can be "*", the space left.
+
        prepare-script
           This shell script is executed before **base-image** extraction.
 
+       rootfs-cache
+          If set to true, the exported filesystem of **base-image** is kept as a tar
+          archive in "${buildout:directory}/.dockeroo/rootfs", named by image ID,
+          and extracted from there by later builds of the same image. Archives of
+          images no longer in use are not removed. Defaults to false.
+
        timeout
           **docker** command timeout.
     """
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime, timedelta
+import json
+
+from builtins import object # pylint: disable=redefined-builtin
+import pytz
+import tzlocal
+
+from dockeroo.utils import parse_datetime
+
+
+CONTAINER_STATUS = {
+    'created': 'created',
+    'dead': 'dead',
+    'exited': 'exited',
+    'paused': 'paused',
+    'restarting': 'restarting',
+    'up': 'running',
+}
+
+_LOCAL_TIMEZONE = []
+
+
+def local_timezone():
+    """
+    Returns the local timezone, looked up once per process.
+    """
+    if not _LOCAL_TIMEZONE:
+        _LOCAL_TIMEZONE.append(tzlocal.get_localzone())
+    return _LOCAL_TIMEZONE[0]
+
+
+def parse_created_at(value):
+    """
+    Converts a **docker** CLI timestamp such as "2016-11-14 10:00:00 +0100 CET"
+    into a naive datetime in the local timezone.
+
+    Example:
+
+        >>> import pytz
+        >>> _LOCAL_TIMEZONE[:] = [pytz.utc]
+        >>> parse_created_at('2016-11-14 10:00:00 +0100 CET')
+        datetime.datetime(2016, 11, 14, 9, 0)
+        >>> parse_created_at('2016-11-14T10:00:00.5Z')
+        datetime.datetime(2016, 11, 14, 10, 0, 0, 500000)
+        >>> del _LOCAL_TIMEZONE[:]
+    """
+    if not value:
+        return None
+    # Fast path for the fixed layout the client prints.
+    if len(value) >= 25 and value[4] == '-' and value[10] == ' ' and value[19] == ' ' and \
+        value[20] in '+-':
+        offset = int(value[21:23]) * 60 + int(value[23:25])
+        stamp = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                         int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        stamp -= timedelta(minutes=offset if value[20] == '+' else -offset)
+        stamp = stamp.replace(tzinfo=pytz.utc)
+    else:
+        stamp = parse_datetime(value)
+        if stamp is None:
+            return None
+        if stamp.tzinfo is None:
+            return stamp
+    return stamp.astimezone(local_timezone()).replace(tzinfo=None)
+
+
+class Record(object):
+    """
+    Lightweight listing entry. Fields are stored in slots, while item access,
+    **get()**, **keys()**, **items()** and **dict(record)** keep records
+    interchangeable with the dictionaries previously returned by listings.
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs.get(field))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items()) \
+            if hasattr(other, 'items') else NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            ['{}={!r}'.format(k, v) for k, v in self.items()]))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, x) for x in self.__slots__]
+
+    def items(self):
+        return [(x, getattr(self, x)) for x in self.__slots__]
+
+
+class ContainerRecord(Record):
+    """
+    Example:
+
+        >>> record = ContainerRecord(id='f00ba4', names=['web'], status='running')
+        >>> record['names'], record.status, record.get('size')
+        (['web'], 'running', None)
+        >>> 'ports' in record, 'color' in record
+        (True, False)
+        >>> record['color']
+        Traceback (most recent call last):
+            ...
+        KeyError: 'color'
+        >>> dict(record)['id']
+        'f00ba4'
+    """
+    __slots__ = ('id', 'image', 'command', 'created_at', 'running_for', 'ports',
+                 'status', 'size', 'names', 'labels', 'mounts')
+
+
+class ImageRecord(Record):
+    __slots__ = ('id', 'repository', 'tag', 'digest', 'created_since',
+                 'created_at', 'size', 'image')
+
+
+def _split_list(value):
+    return [x.strip() for x in value.split(',')] if value else []
+
+
+def parse_container(line):
+    r"""
+    Parses a line of **docker ps --format "{{json .}}"** output.
+
+    Example:
+
+        >>> import pytz
+        >>> _LOCAL_TIMEZONE[:] = [pytz.utc]
+        >>> container = parse_container(
+        ...     '{"Command":"\\"nginx -g daemon|off\\"","CreatedAt":"2016-11-14 10:00:00 +0000 UTC",'
+        ...     '"ID":"f00ba4","Image":"nginx","Labels":"a=b,c=d=e","Mounts":"data",'
+        ...     '"Names":"web","Ports":"0.0.0.0:80->80/tcp","RunningFor":"2 hours ago",'
+        ...     '"Size":"0 B","Status":"Up 2 hours"}')
+        >>> container['command'] == '"nginx -g daemon|off"'
+        True
+        >>> container['labels'] == [('a', 'b'), ('c', 'd=e')]
+        True
+        >>> container['ports'] == [('0.0.0.0:80', '80/tcp')]
+        True
+        >>> container['status'] == 'running'
+        True
+        >>> container['created_at']
+        datetime.datetime(2016, 11, 14, 10, 0)
+        >>> del _LOCAL_TIMEZONE[:]
+    """
+    record = json.loads(line)
+    status = record.get('State') or CONTAINER_STATUS.get(
+        (record.get('Status') or '').split(' ', 1)[0].lower())
+    return ContainerRecord(
+        id=record.get('ID') or None,
+        image=record.get('Image') or None,
+        command=record.get('Command') or None,
+        created_at=parse_created_at(record.get('CreatedAt')),
+        running_for=record.get('RunningFor') or None,
+        ports=[tuple(x.split('->')) for x in _split_list(record.get('Ports'))],
+        status=status,
+        size=record.get('Size') or None,
+        names=_split_list(record.get('Names')),
+        labels=[tuple(x.split('=', 1)) for x in _split_list(record.get('Labels'))],
+        mounts=_split_list(record.get('Mounts')))
+
+
+def parse_image(line):
+    r"""
+    Parses a line of **docker images --format "{{json .}}"** output.
+
+    Example:
+
+        >>> image = parse_image(
+        ...     '{"CreatedAt":"","CreatedSince":"2 days ago","Digest":"\\u003cnone\\u003e",'
+        ...     '"ID":"0123456789ab","Repository":"ubuntu","Size":"120 MB","Tag":"16.04"}')
+        >>> image['image'] == 'ubuntu:16.04', image['digest']
+        (True, None)
+        >>> parse_image('{"ID":"0123456789ab","Repository":"\\u003cnone\\u003e",'
+        ...             '"Tag":"\\u003cnone\\u003e"}')['image'] == '0123456789ab'
+        True
+    """
+    record = json.loads(line)
+    values = dict([(k, v if v and v != '<none>' else None) for k, v in record.items()])
+    image = ImageRecord(
+        id=values.get('ID'),
+        repository=values.get('Repository'),
+        tag=values.get('Tag'),
+        digest=values.get('Digest'),
+        created_since=values.get('CreatedSince'),
+        created_at=parse_created_at(values.get('CreatedAt')),
+        size=values.get('Size'))
+    if image.repository and image.tag:
+        image.image = "{}:{}".format(image.repository, image.tag)
+    else:
+        image.image = image.id
+    return image
@@ -17,7 +17,7 @@
 
 
 from dockeroo import BaseGroupRecipe
-from dockeroo.docker import BaseDockerSubRecipe
+from dockeroo.docker import BaseDockerSubRecipe, prefetch_inspections
 from dockeroo.utils import string_as_bool
 
 
@@ -46,7 +46,7 @@ class DockerNetworkSubRecipe(BaseDockerSubRecipe):
         return self.mark_completed()
 
     def update(self):
-        if not self.engine.networks(name=self.name):
+        if not self.engine.exists('network', self.name):
             return self.install()
         return self.mark_completed()
 
@@ -104,3 +104,7 @@ class DockerNetworkRecipe(BaseGroupRecipe):
           **docker** command timeout.
     """
     subrecipe_class = DockerNetworkSubRecipe
+
+    def update_target(self):
+        prefetch_inspections('network', self.subrecipes.values())
+        return super(DockerNetworkRecipe, self).update_target()
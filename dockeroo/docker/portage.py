@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import re
+
+from shellescape import quote
+
+
+PACKAGE_MODIFIERS = ('accept_keywords', 'mask', 'unmask', 'use')
+
+PACKAGE_MODIFIERS_DIGEST = '/etc/portage/.dockeroo-package-modifiers'
+
+_PRETEND_RE = re.compile(r'^\[(binary|ebuild)\s[^\]]*\]\s+([^\s:]+)')
+
+_MODIFY_FUNCTION = """modify() {
+    file=/etc/portage/package.$1
+    if [ -f "$file" ]; then
+        sed -i '/^# BEGIN dockeroo$/,/^# END dockeroo$/d' "$file"
+        [ -z "$2" ] || printf '# BEGIN dockeroo\\n%s\\n# END dockeroo\\n' "$2" >>"$file"
+    elif [ -n "$2" ]; then
+        mkdir -p "$file" && printf '%s\\n' "$2" >"$file/dockeroo"
+    else
+        rm -f "$file/dockeroo"
+    fi
+}"""
+
+
+def package_modifiers_script(modifiers):
+    """
+    Returns a shell script writing the Portage **modifiers**, a dictionary
+    mapping each of **PACKAGE_MODIFIERS** to a list of lines, in one go.
+    Lines go to a "dockeroo" file below /etc/portage/package.<name> when it is
+    a directory or doesn't exist, or replace a marked block at the end of it
+    when it is a file, so the script can be run again. The digest of the
+    modifiers is recorded and the script does nothing if it didn't change.
+
+    Example:
+
+        >>> script = package_modifiers_script({'use': ['dev-lang/perl -doc', 'sys-libs/zlib minizip']})
+        >>> print(script.splitlines()[0])
+        test "$(cat /etc/portage/.dockeroo-package-modifiers 2>/dev/null)" = 9e88c1183538ea287fa3696282b2a759 && exit 0
+        >>> print('\\n'.join(script.splitlines()[-6:]))
+        modify accept_keywords ''
+        modify mask ''
+        modify unmask ''
+        modify use 'dev-lang/perl -doc
+        sys-libs/zlib minizip'
+        echo 9e88c1183538ea287fa3696282b2a759 >/etc/portage/.dockeroo-package-modifiers
+    """
+    calls = ["modify {} {}".format(name, quote('\n'.join(modifiers.get(name, []))))
+             for name in PACKAGE_MODIFIERS]
+    digest = hashlib.md5('\n'.join(calls).encode('utf-8')).hexdigest()
+    return '\n'.join([
+        'test "$(cat {path} 2>/dev/null)" = {digest} && exit 0'.format(
+            path=PACKAGE_MODIFIERS_DIGEST, digest=digest),
+        'set -e',
+        _MODIFY_FUNCTION,
+    ] + calls + [
+        'echo {digest} >{path}'.format(path=PACKAGE_MODIFIERS_DIGEST, digest=digest),
+    ])
+
+_MATCH_SCRIPT = """import sys
+import portage
+from portage.versions import cpv_sort_key
+vardb = portage.db[portage.root]['vartree'].dbapi
+for atom in sys.argv[1:]:
+    matches = sorted(vardb.match(atom), key=cpv_sort_key())
+    print('{}\\t{}'.format(atom, matches[0] if matches else ''))"""
+
+
+def package_atoms_command(packages):
+    """
+    Returns a shell command printing, for each of **packages**, a line with
+    the package and the first installed version matching it, as
+    **equery list** would list it, with a single Portage invocation.
+    **parse_package_atoms()** reads its output.
+
+    Example:
+
+        >>> command = package_atoms_command(['app-shells/bash', 'dev-lang/python:3.4'])
+        >>> command.startswith('python -c '), command.endswith(' app-shells/bash dev-lang/python:3.4')
+        (True, True)
+    """
+    return "python -c {} {}".format(quote(_MATCH_SCRIPT), ' '.join([quote(x) for x in packages]))
+
+
+def parse_package_atoms(output):
+    """
+    Parses the output of **package_atoms_command()** into a dictionary mapping
+    each package to its installed version, or None if nothing matched.
+
+    Example:
+
+        >>> atoms = parse_package_atoms("app-shells/bash\\tapp-shells/bash-4.3_p48-r1\\nfoo\\t\\n")
+        >>> print(atoms['app-shells/bash'])
+        app-shells/bash-4.3_p48-r1
+        >>> atoms['foo'] is None
+        True
+        >>> parse_package_atoms(b"sys-apps/foo\\tsys-apps/foo-1\\n") == {'sys-apps/foo': 'sys-apps/foo-1'}
+        True
+    """
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    atoms = {}
+    for line in output.splitlines():
+        if '\t' in line:
+            package, cpv = line.split('\t', 1)
+            atoms[package] = cpv.strip() or None
+    return atoms
+
+
+def parse_emerge_pretend(output):
+    """
+    Parses the output of **emerge --pretend** into the lists of packages to be
+    merged from binary packages and of those to be built from source.
+
+    Example:
+
+        >>> parse_emerge_pretend('''
+        ... These are the packages that would be merged, in order:
+        ...
+        ... [binary   R    ] sys-libs/zlib-1.2.8-r1::gentoo  USE="-minizip"
+        ... [ebuild  N     ] app-shells/bash-4.3_p48-r1::gentoo  USE="net"
+        ... [nomerge       ] sys-apps/baselayout-2.2
+        ... ''')
+        (['sys-libs/zlib-1.2.8-r1'], ['app-shells/bash-4.3_p48-r1'])
+    """
+    binaries, builds = [], []
+    for line in output.splitlines():
+        match = _PRETEND_RE.match(line)
+        if match is not None:
+            (binaries if match.group(1) == 'binary' else builds).append(match.group(2))
+    return binaries, builds
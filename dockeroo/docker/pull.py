@@ -30,12 +30,23 @@ class DockerPullSubRecipe(BaseDockerSubRecipe):
         self.password = self.options.get('password', None)
         self.registry = self.options.get('registry', 'index.docker.io')
         self.keep = string_as_bool(self.options.get('keep', False))
+        self.pulled = False
 
-    def install(self):
+    def pull(self):
         self.engine.pull_image(self.name,
                                username=self.username,
                                password=self.password,
                                registry=self.registry)
+        self.pulled = True
+
+    def prefetch(self):
+        if next(self.engine.images(name=self.name), None):
+            return []
+        return [(('image', id(self.engine.cache), self.registry, self.name), self.pull)]
+
+    def install(self):
+        if not self.pulled:
+            self.pull()
         return self.mark_completed()
 
     def update(self):
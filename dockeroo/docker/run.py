@@ -19,7 +19,7 @@
 import os
 
 from dockeroo import BaseGroupRecipe
-from dockeroo.docker import BaseDockerSubRecipe
+from dockeroo.docker import BaseDockerSubRecipe, prefetch_inspections
 from dockeroo.utils import string_as_bool
 
 
@@ -71,7 +71,9 @@ class DockerRunSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-instan
                                      networks=self.networks, links=self.links,
                                      network_aliases=self.network_aliases)
         if self.layout:
-            self.engine.load_layout(self.name, self.layout)
+            self.engine.load_layout(self.name, self.layout,
+                                    manifest=self.layout_manifest(self.name, self.layout),
+                                    files=self.layout_scan(self.layout))
         if not self.start:
             self.options.pop('ip-address', None)
             return self.mark_completed()
@@ -83,11 +85,14 @@ class DockerRunSubRecipe(BaseDockerSubRecipe): # pylint: disable=too-many-instan
         return self.mark_completed()
 
     def update(self):
+        container = self.engine.inspect_many('container', [self.name])[self.name]
         if self.is_image_updated(self.image) or \
-            not self.engine.containers(name=self.name):
+            container is None or not container['State']['Running']:
             return self.install()
         if self.layout and self.is_layout_updated(self.layout):
-            self.engine.load_layout(self.name, self.layout)
+            self.engine.load_layout(self.name, self.layout,
+                                    manifest=self.layout_manifest(self.name, self.layout),
+                                    files=self.layout_scan(self.layout))
             if self.script:
                 self.engine.run_script(self.name, self.script,
                                        shell=self.script_shell, user=self.script_user)
@@ -128,7 +133,9 @@ class DockerRunRecipe(BaseGroupRecipe):
            Image to run.
 
        layout
-           Copies a local folder to container's root with **docker cp**.
+           Copies a local folder to container's root with **docker cp**. On update,
+           only the files added or changed since the last copy are sent again, and
+           the files removed from the folder are removed from the container.
 
        links
            Links the container to the declared container. One per line, format is <container>:<alias>.
@@ -174,3 +181,7 @@ class DockerRunRecipe(BaseGroupRecipe):
            Mount volumes from specified container.
     """
     subrecipe_class = DockerRunSubRecipe
+
+    def update_target(self):
+        prefetch_inspections('container', self.subrecipes.values())
+        return super(DockerRunRecipe, self).update_target()
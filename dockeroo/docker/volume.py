@@ -17,7 +17,7 @@
 
 
 from dockeroo import BaseGroupRecipe
-from dockeroo.docker import BaseDockerSubRecipe
+from dockeroo.docker import BaseDockerSubRecipe, prefetch_inspections
 from dockeroo.utils import string_as_bool
 
 
@@ -70,3 +70,7 @@ class DockerVolumeRecipe(BaseGroupRecipe):
           **docker** command timeout.
     """
     subrecipe_class = DockerVolumeSubRecipe
+
+    def update_target(self):
+        prefetch_inspections('volume', self.subrecipes.values())
+        return super(DockerVolumeRecipe, self).update_target()
@@ -18,21 +18,26 @@
 
 from __future__ import absolute_import
 import json
+import logging
 import os
 import platform
 import re
 from subprocess import Popen, PIPE, STDOUT
+import tempfile
+import threading
+import time
 
 from builtins import object # pylint: disable=redefined-builtin
 from future import standard_library
 
 from dockeroo import BaseRecipe, BaseSubRecipe
 from dockeroo.utils import ExternalProcessError
-from dockeroo.utils import reify
+from dockeroo.utils import mkdir, reify
 
 standard_library.install_aliases()
 
 DEFAULT_TIMEOUT = 180
+DEFAULT_CACHE_TTL = 3600
 SEPARATOR = '|'
 
 FNULL = open(os.devnull, 'w')
@@ -46,36 +51,170 @@ class DockerMachineProcess(Popen):
             args, stdin=stdin, stdout=stdout, stderr=PIPE, close_fds=True)
 
 
+class DockerMachineCache(object):
+    """
+    Persistent store of docker-machine metadata, shared by the buildout processes
+    using the same **path**. Entries expire after **ttl** seconds, or as soon as
+    the configuration file of the machine they describe changes.
+
+    Example:
+
+        >>> import shutil
+        >>> storage = tempfile.mkdtemp()
+        >>> os.environ['MACHINE_STORAGE_PATH'] = storage
+        >>> os.makedirs(os.path.join(storage, 'machines', 'default'))
+        >>> config = os.path.join(storage, 'machines', 'default', 'config.json')
+        >>> with open(config, 'w') as fileobj:
+        ...     _ = fileobj.write('{}')
+        >>> cache = DockerMachineCache(os.path.join(storage, 'cache.json'))
+        >>> cache.get('default', 'platform', lambda: 'x86_64') == 'x86_64'
+        True
+        >>> DockerMachineCache(cache.path).get('default', 'platform', lambda: 'changed') == 'x86_64'
+        True
+        >>> os.utime(config, (0, 0))
+        >>> DockerMachineCache(cache.path).get('default', 'platform', lambda: 'changed') == 'changed'
+        True
+        >>> class Machine(DockerMachine):
+        ...     def run_cmd(self, cmd, quiet=False, return_output=False):
+        ...         return b'aarch64'
+        >>> machine = Machine('remote', logger=None, cache=DockerMachineCache(cache.path))
+        >>> machine.platform == 'aarch64'
+        True
+        >>> DockerMachineCache(cache.path).get('remote', 'platform', lambda: 'changed') == 'aarch64'
+        True
+
+    Entries that can't be stored are only logged, leaving no temporary file behind:
+
+        >>> logging.getLogger(__name__).disabled = True
+        >>> cache.get('default', 'unserializable', object) is not None
+        True
+        >>> logging.getLogger(__name__).disabled = False
+        >>> sorted(os.listdir(storage))
+        ['cache.json', 'machines']
+        >>> del os.environ['MACHINE_STORAGE_PATH']
+        >>> shutil.rmtree(storage)
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._entries = None
+
+    @classmethod
+    def shared(cls, path, ttl=DEFAULT_CACHE_TTL):
+        with cls._shared_lock:
+            if (path, ttl) not in cls._shared:
+                cls._shared[(path, ttl)] = cls(path, ttl)
+            return cls._shared[(path, ttl)]
+
+    @staticmethod
+    def storage_path():
+        return os.environ.get('MACHINE_STORAGE_PATH',
+                              os.path.join(os.path.expanduser('~'), '.docker', 'machine'))
+
+    def stamp(self, name):
+        if name is None:
+            path = os.path.join(self.storage_path(), 'machines')
+        else:
+            path = os.path.join(self.storage_path(), 'machines', name, 'config.json')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def read(self):
+        try:
+            with open(self.path) as fileobj:
+                return json.load(fileobj)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write(self, key, entry):
+        # Best effort: failing to store an entry must never fail a build.
+        entries = self.read()
+        entries[key] = entry
+        tmp = None
+        try:
+            mkdir(os.path.dirname(self.path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            with os.fdopen(fd, 'w') as fileobj:
+                json.dump(entries, fileobj)
+            os.rename(tmp, self.path)
+        except (IOError, OSError, TypeError, ValueError) as error:
+            logging.getLogger(__name__).warning(
+                "Error writing docker-machine cache \"%s\": %s", self.path, error)
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+        self._entries = entries
+
+    def get(self, name, key, loader):
+        """
+        Returns the value cached for **key** of machine **name** (None for values
+        depending on the list of machines), calling **loader** to refresh it.
+        """
+        key = "{}:{}".format(name or '', key)
+        stamp = self.stamp(name)
+        with self.lock:
+            if self._entries is None:
+                self._entries = self.read()
+            entry = self._entries.get(key)
+            if entry is not None and entry['stamp'] == stamp and \
+                time.time() - entry['time'] < self.ttl:
+                return entry['value']
+        value = loader()
+        with self.lock:
+            self.write(key, {'stamp': stamp, 'time': time.time(), 'value': value})
+        return value
+
+
 class DockerMachine(object):
-    def __init__(self, name, logger):
+    def __init__(self, name, logger, cache=None):
         self.name = name
         self.logger = logger
+        self.cache = cache
+
+    def cached(self, key, loader):
+        if self.cache is None:
+            return loader()
+        return self.cache.get(self.name, key, loader)
 
     @property
     @reify
     def platform(self):
-        return self.run_cmd("uname -m", quiet=True, return_output=True)
+        return self.cached('platform', lambda: self.run_cmd(
+            "uname -m", quiet=True, return_output=True).decode('utf-8'))
 
     @property
     @reify
     def url(self):
-        proc = DockerMachineProcess(['url', self.name], stdout=PIPE)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error requesting \"docker-machine url {}\"".format(self.name), proc)
-        return proc.stdout.read().rstrip(os.linesep)
+        def loader():
+            proc = DockerMachineProcess(['url', self.name], stdout=PIPE)
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error requesting \"docker-machine url {}\"".format(self.name), proc)
+            return proc.stdout.read().decode('utf-8').rstrip(os.linesep)
+        return self.cached('url', loader)
 
     @property
     @reify
     def inspect(self):
-        proc = DockerMachineProcess(['inspect', self.name], stdout=PIPE)
-        if proc.wait() != 0:
-            raise ExternalProcessError(
-                "Error requesting \"docker-machine inspect {}\"".format(self.name), proc)
-        return json.loads(proc.stdout.read())
+        def loader():
+            proc = DockerMachineProcess(['inspect', self.name], stdout=PIPE)
+            if proc.wait() != 0:
+                raise ExternalProcessError(
+                    "Error requesting \"docker-machine inspect {}\"".format(self.name), proc)
+            return json.loads(proc.stdout.read().decode('utf-8'))
+        return self.cached('inspect', loader)
 
     @classmethod
-    def machines(cls, **filters):
+    def machines(cls, cache=None, **filters):
+        if cache is not None:
+            return cache.get(None, "machines:{}".format(json.dumps(filters, sort_keys=True)),
+                             lambda: cls.machines(**filters))
         params = ['Name', 'Active', 'ActiveHost', 'ActiveSwarm', 'DriverName', 'State', 'URL',
                   'Swarm', 'Error', 'DockerVersion', 'ResponseTime']
         args = ['ls', '--format',
@@ -89,7 +228,7 @@ class DockerMachine(object):
         params_map = dict([(x, re.sub(
             '((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))', r'_\1', x).lower()) for x in params])
         ret = []
-        for line in proc.stdout.read().splitlines():
+        for line in proc.stdout.read().decode('utf-8').splitlines():
             record = {}
             values = line.split(SEPARATOR)
             if len(values) < 2:
@@ -31,6 +31,7 @@ standard_library.install_aliases()
 
 REPO_TYPES = {
     'git': ('git', 'git'),
+    'git+file': ('git', 'file'),
     'git+http': ('git', 'http'),
     'git+https': ('git', 'https'),
 }
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+**dockeroo-parallel** runs **buildout**, installing independent parts concurrently.
+
+Parts depend on the parts they reference with **${part:option}**, directly or
+through other sections. A part starts once its dependencies are installed, with
+at most **parallel-jobs** parts running at once (**-j N** on the command line,
+defaults to the number of CPUs). Parts whose recipe is not provided by dockeroo
+run alone. Buildout itself records the parts in **.installed.cfg**, in its own
+order, so that plain **buildout** runs see the same state.
+"""
+
+import logging
+from multiprocessing import cpu_count
+import re
+import sys
+import threading
+
+from future.moves.queue import Queue
+from future.utils import raise_
+import pkg_resources
+from zc.buildout import UserError
+import zc.buildout.buildout
+from zc.buildout.buildout import Buildout, Options
+
+from dockeroo import GroupLogFilter
+
+
+REFERENCE_RE = re.compile(r'\$\{([^:}]*):[^}]*\}')
+
+LOGGERS = ('dockeroo', 'zc.buildout')
+
+
+def part_dependencies(sections, parts):
+    """
+    Maps each of **parts** to the parts its raw options reference, following
+    references through sections which are not parts.
+
+    Example:
+
+        >>> sections = {
+        ...     'builder': {'recipe': 'dockeroo:docker.pull', 'image': 'gentoo'},
+        ...     'settings': {'image': '${builder:image}'},
+        ...     'app': {'recipe': 'dockeroo:docker.run', 'image': '${settings:image}',
+        ...             'name': '${:_buildout_section_name_}'},
+        ...     'db': {'recipe': 'dockeroo:docker.run', 'image': 'postgres'},
+        ... }
+        >>> sorted(part_dependencies(sections, ['builder', 'app', 'db']).items())
+        [('app', ['builder']), ('builder', []), ('db', [])]
+    """
+    dependencies = {}
+    for part in parts:
+        found = set()
+        seen = set()
+        stack = [part]
+        while stack:
+            section = stack.pop()
+            if section in seen:
+                continue
+            seen.add(section)
+            for value in sections.get(section, {}).values():
+                for reference in REFERENCE_RE.findall(value):
+                    reference = reference or section
+                    if reference in parts:
+                        if reference != part:
+                            found.add(reference)
+                    elif reference not in seen:
+                        stack.append(reference)
+        dependencies[part] = sorted(found)
+    return dependencies
+
+
+class PartScheduler(object):
+    """
+    Installs or updates **parts** in up to **jobs** worker threads, starting each
+    part once the parts it references are installed. **buildout** requests the
+    parts one at a time, in its own order, with :py:meth:`result`, and records
+    each of them as it would have installed it.
+
+    Example:
+
+        >>> import time
+        >>> class Recipe(object):
+        ...     def __init__(self, name, delay, fail=False):
+        ...         self.name, self.delay, self.fail = name, delay, fail
+        ...     def install(self):
+        ...         time.sleep(self.delay)
+        ...         if self.fail:
+        ...             raise ValueError(self.name)
+        ...         events.append(self.name)
+        ...         return [self.name]
+        >>> class Part(object):
+        ...     def __init__(self, recipe):
+        ...         self.recipe = recipe
+        >>> class FakeBuildout(dict):
+        ...     _logger = logging.getLogger('part_scheduler')
+        ...     _raw = {'a': {}, 'b': {}, 'c': {'image': '${a:image}'}}
+        ...     def is_exclusive(self, part):
+        ...         return False
+        ...     def run_part(self, part, method):
+        ...         return method()
+        >>> class Printer(logging.Handler):
+        ...     def emit(self, record):
+        ...         print(record.getMessage())
+        >>> FakeBuildout._logger.addHandler(Printer())
+        >>> FakeBuildout._logger.propagate = False
+        >>> buildout = FakeBuildout(a=Part(Recipe('a', 0.2)), b=Part(Recipe('b', 0)),
+        ...                         c=Part(Recipe('c', 0)))
+        >>> events = []
+        >>> scheduler = PartScheduler(buildout, ['a', 'b', 'c'], [], 2)
+        >>> [scheduler.result(x) for x in ['a', 'b', 'c']]
+        [['a'], ['b'], ['c']]
+        >>> scheduler.close()
+        >>> events
+        ['b', 'a', 'c']
+
+    A failure is raised when its part is requested, once the parts running
+    have completed. The parts depending on it are not started, those installed
+    meanwhile are reported, as buildout won't record them:
+
+        >>> buildout['a'] = Part(Recipe('a', 0.2, fail=True))
+        >>> events = []
+        >>> scheduler = PartScheduler(buildout, ['a', 'b', 'c'], [], 2)
+        >>> scheduler.result('a')
+        Traceback (most recent call last):
+        ...
+        ValueError: a
+        >>> scheduler.close()
+        Part b was installed but not recorded
+        Cancelled parts: c
+        >>> events
+        ['b']
+        >>> FakeBuildout._logger.handlers = []
+    """
+
+    def __init__(self, buildout, parts, installed_parts, jobs): # pylint: disable=too-many-arguments
+        self.buildout = buildout
+        self.parts = list(parts)
+        self.installed_parts = installed_parts
+        self.jobs = jobs
+        self.dependencies = part_dependencies(buildout._raw, self.parts) # pylint: disable=protected-access
+        self.pending = list(self.parts)
+        self.running = set()
+        self.done = set()
+        self.results = {}
+        self.queue = Queue()
+        # Buildout stops at the first failed part, later ones aren't started.
+        self.cutoff = len(self.parts)
+        self.log_filter = GroupLogFilter()
+        # Logger filters miss the records propagated from child loggers, handler
+        # filters don't: cover the root handlers, buildout's and the recipes' own.
+        self.handlers = set(logging.getLogger().handlers)
+        for logger in LOGGERS:
+            self.handlers.update(logging.getLogger(logger).handlers)
+        for handler in self.handlers:
+            handler.addFilter(self.log_filter)
+
+    def worker(self, part, method):
+        self.log_filter.local.group = part
+        try:
+            self.queue.put((part, self.buildout.run_part(part, method), None))
+        except Exception: # pylint: disable=broad-except
+            self.queue.put((part, None, sys.exc_info()))
+        finally:
+            self.log_filter.local.group = None
+
+    def start(self):
+        while self.pending and len(self.running) < self.jobs:
+            exclusive = [x for x in self.running if self.buildout.is_exclusive(x)]
+            part = next((x for x in self.pending if self.parts.index(x) < self.cutoff and
+                         set(self.dependencies[x]) <= self.done and (
+                             not self.running or not (
+                                 exclusive or self.buildout.is_exclusive(x)))), None)
+            if part is None:
+                break
+            self.pending.remove(part)
+            self.running.add(part)
+            recipe = self.buildout[part].recipe
+            handler = getattr(recipe, 'log_handler', None)
+            if handler is not None and handler not in self.handlers:
+                handler.addFilter(self.log_filter)
+                self.handlers.add(handler)
+            # Buildout warns itself about recipes without update method.
+            method = recipe.install
+            if part in self.installed_parts:
+                method = getattr(recipe, 'update', recipe.install)
+            thread = threading.Thread(target=self.worker, args=(part, method))
+            thread.daemon = True
+            thread.start()
+
+    def wait(self):
+        part, installed_files, exc_info = self.queue.get()
+        self.running.remove(part)
+        self.results[part] = (installed_files, exc_info)
+        if exc_info is None:
+            self.done.add(part)
+        else:
+            self.cutoff = min(self.cutoff, self.parts.index(part))
+
+    def result(self, part):
+        """
+        Returns what installing or updating **part** returned, or raises what
+        it raised once the parts running have completed.
+        """
+        while part not in self.results:
+            self.start()
+            if not self.running:
+                raise UserError('''Circular references among parts: {}'''.format(
+                    ', '.join(self.pending)))
+            self.wait()
+        installed_files, exc_info = self.results.pop(part)
+        if exc_info is not None:
+            while self.running:
+                self.wait()
+            raise_(*exc_info)
+        return installed_files
+
+    def close(self):
+        """
+        Waits for the parts still running, then logs those buildout didn't
+        request, and therefore didn't record, and the ones never started.
+        """
+        try:
+            while self.running:
+                self.wait()
+        finally:
+            for handler in self.handlers:
+                handler.removeFilter(self.log_filter)
+        logger = self.buildout._logger # pylint: disable=protected-access
+        for part in self.parts:
+            if part not in self.results:
+                continue
+            exc_info = self.results.pop(part)[1]
+            if exc_info is None:
+                logger.warning('Part %s was installed but not recorded', part)
+            else:
+                logger.error('Error installing %s: %s', part, exc_info[1])
+        if self.pending:
+            logger.error('Cancelled parts: %s', ', '.join(self.pending))
+
+
+class PartOptions(Options):
+    """
+    :py:class:`zc.buildout.buildout.Options` whose part is installed or updated
+    by the scheduler of the :py:class:`ParallelBuildout` installing it.
+    """
+
+    def _call(self, f):
+        if not getattr(self.buildout, 'installing', False):
+            return Options._call(self, f)
+        return self.buildout.install_part(self.name)
+
+
+class ParallelBuildout(Buildout):
+    """
+    :py:class:`zc.buildout.buildout.Buildout` installing parts concurrently.
+    **buildout install** does the rest, uninstallation, develop eggs and the
+    bookkeeping of **.installed.cfg**, requesting the parts in its own order.
+    """
+
+    Options = PartOptions
+    installing = False
+    install_args = None
+    install_jobs = 1
+    scheduler = None
+
+    @property
+    def jobs(self):
+        jobs = self['buildout'].get('parallel-jobs', str(cpu_count()))
+        try:
+            return max(1, int(jobs))
+        except ValueError:
+            raise UserError('''Invalid parallel-jobs "{}"'''.format(jobs))
+
+    def is_exclusive(self, part):
+        recipe = zc.buildout.buildout._recipe(self[part])[0] # pylint: disable=protected-access
+        return pkg_resources.Requirement.parse(recipe).project_name.lower() != 'dockeroo'
+
+    def install(self, install_args):
+        self.installing = True
+        self.install_args = install_args
+        # Read before buildout checks for unused options.
+        self.install_jobs = self.jobs
+        try:
+            Buildout.install(self, install_args)
+        finally:
+            self.installing = False
+            if self.scheduler is not None:
+                self.scheduler.close()
+                self.scheduler = None
+
+    def install_part(self, part):
+        """
+        Returns what installing or updating **part** returned. Every part is
+        scheduled when buildout requests the first one, once it has uninstalled
+        the obsolete ones.
+        """
+        if self.scheduler is None:
+            installed_parts = self._read_installed_part_options()[0]['buildout']['parts'] # pylint: disable=protected-access
+            self.scheduler = PartScheduler(
+                self, self.install_args or self._parts, # pylint: disable=protected-access
+                installed_parts.split(), self.install_jobs)
+        return self.scheduler.result(part)
+
+    def run_part(self, part, method):
+        return Options._call(self[part], method)
+
+
+def main(args=None):
+    """
+    Entry point of **dockeroo-parallel**. Accepts **buildout** arguments, plus
+    **-j N** or **--jobs=N** to set the number of parts installed concurrently.
+    """
+    if args is None:
+        args = sys.argv[1:]
+    args = list(args)
+    jobs = []
+    buildout_args = []
+    while args:
+        arg = args.pop(0)
+        if arg in ('-j', '--jobs'):
+            if not args:
+                zc.buildout.buildout._error('No number specified for option', arg) # pylint: disable=protected-access
+            jobs = [args.pop(0)]
+        elif arg.startswith('--jobs='):
+            jobs = [arg.split('=', 1)[1]]
+        elif arg.startswith('-j') and arg[2:].isdigit():
+            jobs = [arg[2:]]
+        else:
+            buildout_args.append(arg)
+    # Assignments must precede the buildout command.
+    zc.buildout.buildout.Buildout = ParallelBuildout
+    try:
+        zc.buildout.buildout.main(
+            ['buildout:parallel-jobs={}'.format(x) for x in jobs] + buildout_args)
+    finally:
+        zc.buildout.buildout.Buildout = Buildout
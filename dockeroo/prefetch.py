@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Buildout extension fetching the urls, git repositories, archives and images
+needed by dockeroo parts concurrently, before any part is installed.
+
+Enable it with **extensions = dockeroo** in the **[buildout]** section.
+**prefetch-jobs** sets how many fetches run at once and defaults to 4.
+Parts then reuse what was fetched: with a **download-cache**, downloads and
+repositories are kept for later runs as well. Failed fetches are only logged,
+the part reports the error when it runs. Nothing is fetched in offline mode.
+"""
+
+import logging
+import sys
+import threading
+
+from future.moves.queue import Queue, Empty
+from zc.buildout import UserError
+
+from dockeroo import BaseRecipe
+from dockeroo.utils import string_as_bool
+
+
+DEFAULT_JOBS = 4
+
+logger = logging.getLogger(__name__) # pylint: disable=invalid-name
+
+
+def collect(buildout, parts):
+    """
+    Returns the prefetch callables of the dockeroo **parts**, grouped by key
+    in part order.
+    """
+    keys = []
+    jobs = {}
+    for part in parts:
+        recipe = getattr(buildout[part], 'recipe', None)
+        if not isinstance(recipe, BaseRecipe):
+            continue
+        for key, job in recipe.prefetch():
+            if key not in jobs:
+                keys.append(key)
+                jobs[key] = []
+            jobs[key].append((part, job))
+    return [(x, jobs[x]) for x in keys]
+
+
+def prefetch(buildout, parts):
+    """
+    Runs the prefetch callables of **parts** in up to **prefetch-jobs** threads.
+    Returns the number of failed callables.
+
+    Example:
+
+        >>> calls = []
+        >>> class Recipe(BaseRecipe):
+        ...     def __init__(self, jobs):
+        ...         self.jobs = jobs
+        ...     def prefetch(self):
+        ...         return self.jobs
+        >>> class Options(dict):
+        ...     recipe = None
+        >>> buildout = {'buildout': {'prefetch-jobs': '2'}, 'a': Options(), 'b': Options()}
+        >>> buildout['a'].recipe = Recipe([('x', lambda: calls.append('a:x')),
+        ...                                 ('y', lambda: calls.append('a:y'))])
+        >>> buildout['b'].recipe = Recipe([('x', lambda: calls.append('b:x')),
+        ...                                 ('z', lambda: 1 // 0)])
+        >>> prefetch(buildout, ['a', 'b'])
+        1
+        >>> sorted(calls)
+        ['a:x', 'a:y', 'b:x']
+        >>> calls.index('a:x') < calls.index('b:x')
+        True
+    """
+    jobs = buildout['buildout'].get('prefetch-jobs', str(DEFAULT_JOBS))
+    try:
+        jobs = max(1, int(jobs))
+    except ValueError:
+        raise UserError('''Invalid prefetch-jobs "{}"'''.format(jobs))
+    groups = collect(buildout, parts)
+    if not groups:
+        return 0
+    logger.info('Prefetching %d item(s) for %d part(s)', len(groups),
+                len(set([part for _, group in groups for part, _ in group])))
+    queue = Queue()
+    for group in groups:
+        queue.put(group)
+    failures = []
+
+    def worker():
+        while True:
+            try:
+                key, group = queue.get_nowait()
+            except Empty:
+                return
+            for part, job in group:
+                try:
+                    job()
+                except Exception: # pylint: disable=broad-except
+                    failures.append(key)
+                    logger.warning('Prefetching %s for part %s failed: %s',
+                                   ' '.join([str(x) for x in key]), part, sys.exc_info()[1])
+
+    threads = [threading.Thread(target=worker) for _ in range(min(jobs, len(groups)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(failures)
+
+
+def extension(buildout):
+    """
+    **zc.buildout.extension** entry point.
+
+    Example:
+
+        >>> import os, subprocess
+        >>> repository = tmpdir('repository')
+        >>> subprocess.check_call(
+        ...     'git init -q && git symbolic-ref HEAD refs/heads/master && '
+        ...     'echo dockeroo >README && git add README && '
+        ...     'git -c user.name=dockeroo -c user.email=dockeroo commit -q -m README',
+        ...     shell=True, cwd=repository)
+        0
+        >>> with buildout_test(
+        ... '''
+        ... [buildout]
+        ... extensions = dockeroo
+        ... parts = archive repository
+        ... download-cache = ${buildout:directory}/downloads
+        ... prefetch-jobs = 1
+        ...
+        ... [archive]
+        ... recipe = dockeroo:setup.download
+        ... url = %(server)sdata/package-0.0.0.tar.gz
+        ...
+        ... [repository]
+        ... recipe = dockeroo:setup.download
+        ... url = git+file://%(repository)s
+        ... ''' % dict(server=server_url, repository=repository)) as b:
+        ...    os.makedirs(os.path.join(sample_buildout, 'downloads'))
+        ...    print_(b.run(), end='')
+        dockeroo.prefetch: Prefetching 2 item(s) for 2 part(s)
+        dockeroo: Downloading <URL>
+        dockeroo: Downloading <URL>
+        dockeroo: Running command: git clone -q --bare "<URL>" "<PATH>"
+        Installing archive.
+        Installing repository.
+        dockeroo: Running command: git read-tree "master"
+        dockeroo: Running command: git checkout-index -q -a -f --prefix="<PATH>"
+    """
+    if string_as_bool(buildout['buildout'].get('offline', False)):
+        return
+    compute_part_signatures = buildout._compute_part_signatures # pylint: disable=protected-access
+
+    # Recipes are initialized only after develop eggs are built, right before
+    # part signatures are computed: prefetch at that point, ahead of any
+    # uninstallation or installation.
+    def prefetching_compute_part_signatures(parts):
+        prefetch(buildout, parts)
+        return compute_part_signatures(parts)
+    buildout._compute_part_signatures = prefetching_compute_part_signatures # pylint: disable=protected-access
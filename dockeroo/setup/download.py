@@ -16,10 +16,11 @@
 # limitations under the License.
 
 
+from functools import partial
 import os
 
 from future import standard_library
-from future.moves.urllib.parse import urljoin
+from future.moves.urllib.parse import urljoin, urlparse
 from future.moves.urllib.request import pathname2url
 from zc.buildout import UserError
 
@@ -41,6 +42,12 @@ class BaseDownloadSubRecipe(BaseSourceSubRecipe):
         })
         return ret
 
+    def prefetch(self):
+        return [(('download', source['url']),
+                 partial(self.recipe.download, source['url'], params=dict(source)))
+                for source in self.sources
+                if 'url' in source and urlparse(source['url']).scheme != 'file']
+
     def populate_source(self, source, load_options=True):
         super(BaseDownloadSubRecipe, self).populate_source(source,
                                                            load_options=load_options)
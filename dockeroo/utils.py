@@ -16,21 +16,44 @@
 # limitations under the License.
 
 
+from array import array
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, tzinfo
+from distutils.spawn import find_executable
 import errno
 from functools import wraps
+import gzip
+import hashlib
+import io
+import mmap
 import os
 import random
 import re
+import shlex
+import stat
 import string
+import tarfile
+import struct
+from subprocess import Popen, PIPE
+import threading
 
 from builtins import range # pylint: disable=redefined-builtin
 from builtins import object # pylint: disable=redefined-builtin
+from future.moves.queue import Queue
 from past.builtins import basestring # pylint: disable=redefined-builtin
 from zc.buildout import UserError
 
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None # pylint: disable=invalid-name
+
+
 TRUE_SET = {'true', 'on', 'yes', '1'}
 FALSE_SET = {'false', 'off', 'no', '0'}
 
@@ -39,7 +62,10 @@ class ExternalProcessError(RuntimeError):
 
     def __init__(self, msg, process):
         full_msg = "{} ({})".format(msg, process.returncode)
-        err = ' '.join(process.stderr.read().splitlines())
+        err = process.stderr.read()
+        if not isinstance(err, str):
+            err = err.decode('utf-8', 'replace')
+        err = ' '.join(err.splitlines())
         if err:
             full_msg = "{}: {}".format(full_msg, err)
         super(ExternalProcessError, self).__init__(full_msg)
@@ -134,6 +160,7 @@ GLOBAL_OPTIONS = {
     '__buildout_signature__',
     'install-target',
     'keep-on-error',
+    'parallel',
     'recipe',
     'specs',
     'target',
@@ -207,6 +234,81 @@ class OptionRepository(object):
         else:
             return self[None].delete(key)
 
+def _digest_typecode():
+    for typecode in ('Q', 'L'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return 'd'
+
+class DigestSet(object):
+    """
+    Set of strings kept as 64-bit digests in an open addressing table backed by
+    an array. The table is never more than half full, so it takes between 16
+    and 32 bytes per string, 48 while it grows, against more than 100 for a
+    set of str. Two distinct strings share a digest with a probability of about
+    n²/2⁶⁵, which for a million strings is less than one in 30 million.
+
+    Example:
+
+        >>> paths = DigestSet()
+        >>> paths.add('/usr'), paths.add('/usr/lib'), paths.add('/usr')
+        (True, True, False)
+        >>> '/usr/lib' in paths, '/usr/bin' in paths, len(paths)
+        (True, False, 2)
+    """
+    typecode = _digest_typecode()
+
+    def __init__(self, capacity=1024):
+        size = 8
+        while size < capacity * 2:
+            size <<= 1
+        self.table = array(self.typecode, [0]) * size
+        self.mask = size - 1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, value):
+        return self.table[self._slot(self._digest(value))] != 0
+
+    def _digest(self, value):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        digest = struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+        if self.typecode == 'd':
+            # Without a 64-bit integer array, 53 bits are stored exactly as doubles.
+            return float(digest >> 11) or 1.0
+        return digest or 1
+
+    def _slot(self, digest):
+        slot = hash(digest) & self.mask
+        while self.table[slot] != 0 and self.table[slot] != digest:
+            slot = (slot + 1) & self.mask
+        return slot
+
+    def add(self, value):
+        """
+        Adds **value**, returning False if it was already in the set.
+        """
+        digest = self._digest(value)
+        slot = self._slot(digest)
+        if self.table[slot] != 0:
+            return False
+        self.table[slot] = digest
+        self.count += 1
+        if self.count * 2 > len(self.table):
+            table = self.table
+            self.table = array(self.typecode, [0]) * (len(table) * 2)
+            self.mask = len(self.table) - 1
+            for digest in table:
+                if digest != 0:
+                    self.table[self._slot(digest)] = digest
+        return True
+
 def merge(lst1, lst2):
     def _merge(lst1, lst2):
         for i in range(max(len(lst1), len(lst2))):
@@ -288,3 +390,539 @@ def mkdir(*paths):
                 pass
             else:
                 raise
+
+RELAY_CHUNK_SIZE = 1 << 20
+
+def _pipe_fileno(fileobj):
+    try:
+        fileno = fileobj.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+    return fileno if stat.S_ISFIFO(os.fstat(fileno).st_mode) else None
+
+def stream_members(tar):
+    """
+    Yields the members of **tar**, opened in stream mode, one at a time without
+    collecting them in its **members** list.
+    """
+    while True:
+        tarinfo = tar.next()
+        if tarinfo is None:
+            return
+        tar.members = []
+        yield tarinfo
+
+def relay(src, dst, chunk_size=RELAY_CHUNK_SIZE):
+    """
+    Copies the whole of **src** into **dst** and returns the number of bytes
+    copied. Between two pipes with nothing buffered yet, data is moved by the
+    kernel with **os.splice()** where available (Linux, Python 3.10+).
+
+    Example:
+
+        >>> from io import BytesIO
+        >>> dst = BytesIO()
+        >>> relay(BytesIO(b'x' * 100), dst, chunk_size=64), len(dst.getvalue())
+        (100, 100)
+    """
+    total = 0
+    splice = getattr(os, 'splice', None)
+    fd_in = _pipe_fileno(src) if splice is not None else None
+    fd_out = _pipe_fileno(dst) if fd_in is not None else None
+    if fd_out is not None:
+        dst.flush()
+        while True:
+            count = splice(fd_in, fd_out, chunk_size)
+            if not count:
+                return total
+            total += count
+    while True:
+        data = src.read(chunk_size)
+        if not data:
+            return total
+        dst.write(data)
+        total += len(data)
+
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', 'gz'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+)
+
+PARALLEL_DECOMPRESSORS = {
+    'bz2': (['pbzip2', '-d', '-c'], ['lbzip2', '-d', '-c']),
+    'gz': (['pigz', '-d', '-c'],),
+    'xz': (['pixz', '-d'], ['xz', '-d', '-c', '-T0']),
+    'zst': (['zstd', '-d', '-c', '-T0'],),
+}
+
+def compression_of(head):
+    """
+    Returns the compression (gz, bz2, xz or zst) of data starting with **head**,
+    or None.
+
+    Example:
+
+        >>> compression_of(b'BZh91AY&SY'), compression_of(b'etc/')
+        ('bz2', None)
+    """
+    return next((name for magic, name in COMPRESSION_MAGIC if head.startswith(magic)), None)
+
+def decompressor_command(compression, decompressor='auto'):
+    """
+    Returns the command decompressing data compressed with **compression**
+    (gz, bz2, xz or zst) from stdin to stdout, or None if Python should
+    decompress it. **decompressor** is "auto" for the first parallel
+    decompressor found on PATH, "python" or a command line.
+
+    Example:
+
+        >>> decompressor_command('gz', 'python') is None
+        True
+        >>> decompressor_command('xz', 'xz -d -c -T4')
+        ['xz', '-d', '-c', '-T4']
+        >>> decompressor_command(None, 'xz -d -c -T4') is None
+        True
+    """
+    if compression is None or decompressor == 'python':
+        return None
+    if decompressor != 'auto':
+        return shlex.split(decompressor)
+    for command in PARALLEL_DECOMPRESSORS.get(compression, ()):
+        if find_executable(command[0]):
+            return command
+    return None
+
+class _PrependedReader(object): # pylint: disable=too-few-public-methods
+
+    def __init__(self, head, fileobj):
+        self.head = head
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.fileobj.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.fileobj.read(), b''
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+            if len(data) < size:
+                data += self.fileobj.read(size - len(data))
+        return data
+
+@contextmanager
+def decompressing(fileobj, decompressor='auto', logger=None):
+    """
+    Yields a file object reading **fileobj** decompressed by the command chosen
+    by :py:func:`decompressor_command` through a pipe, or reading **fileobj** as
+    is, for **tarfile** to decompress it, if there is none.
+
+    Example:
+
+        >>> import gzip
+        >>> from io import BytesIO
+        >>> data = BytesIO()
+        >>> with gzip.GzipFile(fileobj=data, mode='wb') as fileobj:
+        ...     _ = fileobj.write(b'dockeroo')
+        >>> with decompressing(BytesIO(data.getvalue()), 'python') as fileobj:
+        ...     fileobj.read() == data.getvalue()
+        True
+        >>> with decompressing(BytesIO(data.getvalue()), 'gzip -d -c') as fileobj:
+        ...     fileobj.read() == b'dockeroo'
+        True
+    """
+    head = fileobj.read(8)
+    compression = compression_of(head)
+    command = decompressor_command(compression, decompressor)
+    if command is None and compression is not None and \
+            compression not in tarfile.TarFile.OPEN_METH:
+        raise UserError('''No decompressor available for {} archives'''.format(compression))
+    try:
+        fileno = fileobj.fileno()
+        position = fileobj.tell() - len(head)
+        fileobj.seek(position)
+    except (AttributeError, EnvironmentError, ValueError):
+        fileno = None
+    if command is None:
+        yield fileobj if fileno is not None else _PrependedReader(head, fileobj)
+        return
+    if logger is not None:
+        logger.debug("Decompressing %s archive with: %s", compression, ' '.join(command))
+    if fileno is not None:
+        # Buffered readers don't move the descriptor back on seek().
+        os.lseek(fileno, position, os.SEEK_SET)
+        proc = Popen(command, stdin=fileno, stdout=PIPE, stderr=PIPE, close_fds=True)
+        feeder = None
+    else:
+        proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
+
+        def feed():
+            try:
+                proc.stdin.write(head)
+                relay(fileobj, proc.stdin)
+            except EnvironmentError:
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except EnvironmentError:
+                    pass
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+    try:
+        yield proc.stdout
+        # Trailing padding, left unread past the end of the tar archive.
+        while proc.stdout.read(RELAY_CHUNK_SIZE):
+            pass
+    except Exception: # pylint: disable=broad-except
+        # A truncated stream is reported as the decompressor's failure.
+        if proc.stdout.read(1) or proc.wait() == 0:
+            if proc.poll() is None:
+                proc.kill()
+            raise
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        if feeder is not None:
+            feeder.join()
+    if proc.returncode != 0:
+        raise ExternalProcessError("Error decompressing archive with \"{}\"".format(
+            ' '.join(command)), proc)
+
+SPARSE_BLOCK_SIZE = 1 << 16
+
+def copy_sparse(src, dst, size, block_size=SPARSE_BLOCK_SIZE, offset=0):
+    r"""
+    Copies **size** bytes from **src** into the seekable **dst** at **offset**,
+    seeking over blocks of zeros instead of writing them, so that **dst** is
+    sparse where its filesystem allows. Returns the number of bytes written.
+
+    Example:
+
+        >>> from io import BytesIO
+        >>> data = b'\0' * 100 + b'dockeroo' + b'\0' * 100
+        >>> dst = BytesIO()
+        >>> copy_sparse(BytesIO(data), dst, len(data), block_size=16)
+        16
+        >>> dst.getvalue() == data
+        True
+        >>> dst = BytesIO()
+        >>> copy_sparse(BytesIO(b'\0' * 100), dst, 100, block_size=16)
+        0
+        >>> dst.getvalue() == b'\0' * 100
+        True
+        >>> dst = BytesIO(b'-' * 32)
+        >>> copy_sparse(BytesIO(b'dockeroo'), dst, 8, block_size=4, offset=8)
+        8
+        >>> dst.getvalue() == b'-' * 8 + b'dockeroo' + b'-' * 16
+        True
+    """
+    zeros = b'\0' * block_size
+    written = 0
+    end = 0
+    position = 0
+    while position < size:
+        data = src.read(min(block_size, size - position))
+        if not data:
+            raise IOError("Unexpected end of data at offset {}".format(position))
+        if data != zeros[:len(data)]:
+            dst.seek(offset + position)
+            dst.write(data)
+            written += len(data)
+            end = position + len(data)
+        position += len(data)
+    if end < size:
+        # Extends dst over the trailing hole.
+        dst.seek(offset + size - 1)
+        dst.write(b'\0')
+    return written
+
+LAYOUT_HASH_CHUNK_SIZE = 1 << 20
+
+LAYOUT_SCAN_JOBS = 8
+
+def _file_digest(path, size):
+    digest = hashlib.md5()
+    with open(path, 'rb') as fileobj:
+        if size >= LAYOUT_HASH_CHUNK_SIZE:
+            # Hashing a mapping avoids copying large files through Python buffers.
+            mapping = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                digest.update(mapping)
+            finally:
+                mapping.close()
+        else:
+            for chunk in iter(lambda: fileobj.read(LAYOUT_HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _scan_directory(dirname):
+    # Yields (name, lstat result) pairs, with os.scandir() where available.
+    if scandir is not None:
+        for entry in scandir(dirname):
+            yield entry.name, entry.stat(follow_symlinks=False)
+    else:
+        for name in os.listdir(dirname):
+            yield name, os.lstat(os.path.join(dirname, name))
+
+def _layout_entry(full_path, st, previous):
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    entry = [None, stat.S_IMODE(st.st_mode), 0, mtime_ns, st.st_ino, None]
+    if stat.S_ISDIR(st.st_mode):
+        entry[0] = 'd'
+    elif stat.S_ISLNK(st.st_mode):
+        entry[0] = 'l'
+        entry[1] = 0
+        entry[5] = os.readlink(full_path)
+    elif stat.S_ISREG(st.st_mode):
+        entry[0] = 'f'
+        entry[2] = st.st_size
+        if previous is not None and previous[0] == 'f' and previous[2:5] == entry[2:5]:
+            entry[5] = previous[5]
+        else:
+            entry[5] = _file_digest(full_path, st.st_size)
+    else:
+        entry[0] = 'o'
+    return entry
+
+def scan_layout(path, previous=None, jobs=LAYOUT_SCAN_JOBS):
+    """
+    Returns a dictionary mapping the path of each file under the **path**
+    directory, relative to it, to a [kind, mode, size, mtime_ns, inode,
+    digest] list: kind is "f" for regular files, "d" for directories, "l"
+    for symbolic links and "o" for anything else, digest is the md5 of
+    regular files and the target of symbolic links. Regular files whose
+    size, mtime and inode match their entry in **previous** keep its digest
+    instead of being read again. Directories are listed and files hashed by
+    up to **jobs** threads.
+
+    Example:
+
+        >>> import shutil, tempfile
+        >>> root = tempfile.mkdtemp()
+        >>> os.mkdir(os.path.join(root, 'etc'))
+        >>> with open(os.path.join(root, 'etc', 'hosts'), 'w') as fileobj:
+        ...     _ = fileobj.write('127.0.0.1 localhost')
+        >>> layout = scan_layout(root)
+        >>> sorted(layout)
+        ['etc', 'etc/hosts']
+        >>> layout['etc/hosts'][0], layout['etc/hosts'][2], layout['etc/hosts'][5]
+        ('f', 19, '4acc4b7d8613b7474f1ce85cf64cd04e')
+        >>> layout['etc/hosts'][5] = 'kept'
+        >>> scan_layout(root, layout)['etc/hosts'][5]
+        'kept'
+        >>> shutil.rmtree(root)
+    """
+    layout = {}
+    previous = previous or {}
+    directories = Queue()
+    errors = []
+
+    def worker():
+        while True:
+            relpath = directories.get()
+            if relpath is None:
+                return
+            try:
+                dirname = os.path.join(path, relpath)
+                for name, st in _scan_directory(dirname):
+                    child = '/'.join([relpath, name]) if relpath else name
+                    layout[child] = _layout_entry(
+                        os.path.join(dirname, name), st, previous.get(child))
+                    if layout[child][0] == 'd':
+                        directories.put(child)
+            except Exception as exc: # pylint: disable=broad-except
+                errors.append(exc)
+            finally:
+                directories.task_done()
+
+    directories.put('')
+    threads = [threading.Thread(target=worker) for _ in range(max(1, jobs))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    directories.join()
+    for thread in threads:
+        directories.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return layout
+
+def diff_layout(previous, current):
+    """
+    Compares two **scan_layout()** results, returning the sorted paths of
+    **current** to send and the paths of **previous** to remove first, without
+    those below another removed path. Directories are sent again only when
+    their mode changed, any other file whenever its kind, mode, size or
+    digest changed.
+
+    Example:
+
+        >>> previous = {'etc': ['d', 0o755, 0, 1, 2, None],
+        ...             'etc/hosts': ['f', 0o644, 19, 1, 3, 'a'],
+        ...             'etc/motd': ['f', 0o644, 5, 1, 4, 'b'],
+        ...             'var': ['d', 0o755, 0, 1, 5, None],
+        ...             'var/cache': ['d', 0o755, 0, 1, 6, None],
+        ...             'var/cache/x': ['f', 0o644, 5, 1, 7, 'c'],
+        ...             'etc/touched': ['f', 0o644, 5, 1, 10, 'e']}
+        >>> current = {'etc': ['d', 0o755, 0, 2, 2, None],
+        ...            'etc/hosts': ['f', 0o644, 20, 2, 3, 'd'],
+        ...            'etc/motd': ['l', 0, 0, 2, 8, 'issue'],
+        ...            'etc/issue': ['f', 0o644, 5, 1, 9, 'b'],
+        ...            'etc/touched': ['f', 0o644, 5, 2, 10, 'e']}
+        >>> diff_layout(previous, current)
+        (['etc/hosts', 'etc/issue', 'etc/motd'], ['etc/motd', 'var'])
+    """
+    send = []
+    remove = []
+    for relpath, entry in current.items():
+        known = previous.get(relpath)
+        if known is None:
+            send.append(relpath)
+        elif known[0] != entry[0]:
+            remove.append(relpath)
+            send.append(relpath)
+        elif entry[0] == 'd':
+            if known[1] != entry[1]:
+                send.append(relpath)
+        elif known[1:3] + known[5:] != entry[1:3] + entry[5:]:
+            send.append(relpath)
+    remove.extend([x for x in previous if x not in current])
+    removed = []
+    for relpath in sorted(remove):
+        if not removed or not relpath.startswith(removed[-1] + '/'):
+            removed.append(relpath)
+    return sorted(send), removed
+
+TRANSFER_CODECS = {
+    'gzip': 6,
+    'zstd': 3,
+}
+
+COMPRESSED_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+class _CountingWriter(object): # pylint: disable=too-few-public-methods
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+class TeeWriter(object):
+    """
+    Writable file object writing data both into **fileobj** and into **copy**.
+
+    Example:
+
+        >>> from io import BytesIO
+        >>> dst, copy = BytesIO(), BytesIO()
+        >>> relay(BytesIO(b'dockeroo'), TeeWriter(dst, copy))
+        8
+        >>> dst.getvalue() == copy.getvalue() == b'dockeroo'
+        True
+    """
+
+    def __init__(self, fileobj, copy):
+        self.fileobj = fileobj
+        self.copy = copy
+
+    def write(self, data):
+        self.copy.write(data)
+        self.fileobj.write(data)
+
+    def flush(self):
+        self.copy.flush()
+        self.fileobj.flush()
+
+class CompressingWriter(object):
+    """
+    Writable file object compressing data with **codec** (gzip or zstd) at
+    **level** into **fileobj**, counting bytes written to it in **raw_bytes**
+    and bytes written to **fileobj** in **compressed_bytes**. zstd runs as an
+    external **zstd** process. Closing it closes **fileobj** and calls
+    **on_close** with the writer. Other attributes are those of **fileobj**.
+
+    Example:
+
+        >>> from io import BytesIO
+        >>> class Output(BytesIO):
+        ...     def close(self):
+        ...         self.data = self.getvalue()
+        >>> output = Output()
+        >>> writer = CompressingWriter(output, 'gzip', 9)
+        >>> writer.write(b'dockeroo' * 1000)
+        >>> writer.close()
+        >>> gzip.GzipFile(fileobj=BytesIO(output.data)).read() == b'dockeroo' * 1000
+        True
+        >>> writer.raw_bytes, writer.compressed_bytes == len(output.data) < 100
+        (8000, True)
+    """
+
+    def __init__(self, fileobj, codec, level=None, on_close=None):
+        if codec not in TRANSFER_CODECS:
+            raise ValueError('''Invalid codec "{}"'''.format(codec))
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = TRANSFER_CODECS[codec] if level is None else level
+        self.on_close = on_close
+        self.raw_bytes = 0
+        self.counter = _CountingWriter(fileobj)
+        self.proc = None
+        self.pump = None
+        if codec == 'gzip':
+            self.compressor = gzip.GzipFile(fileobj=self.counter, mode='wb',
+                                            compresslevel=self.level)
+        else:
+            self.proc = Popen(['zstd', '-q', '-c', '-T0', '-{}'.format(self.level)],
+                              stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
+            self.compressor = self.proc.stdin
+            self.pump = threading.Thread(target=relay, args=(self.proc.stdout, self.counter))
+            self.pump.daemon = True
+            self.pump.start()
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+    @property
+    def compressed_bytes(self):
+        return self.counter.count
+
+    def fileno(self):
+        # Data must go through the compressor, never straight to the descriptor.
+        raise io.UnsupportedOperation('fileno')
+
+    def write(self, data):
+        self.raw_bytes += len(data)
+        self.compressor.write(data)
+
+    def flush(self):
+        self.compressor.flush()
+
+    def close(self):
+        self.compressor.close()
+        if self.proc is not None:
+            self.pump.join()
+            self.proc.stdout.close()
+            if self.proc.wait() != 0:
+                raise ExternalProcessError("Error compressing stream with zstd", self.proc)
+        self.fileobj.close()
+        if self.on_close is not None:
+            self.on_close(self)
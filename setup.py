@@ -68,6 +68,12 @@ setup(name='dockeroo',
     tests_require=requires,
     test_suite="tests.tests",
     entry_points = {
+        'console_scripts': [
+            'dockeroo-parallel = dockeroo.parallel:main',
+        ],
+        'zc.buildout.extension': [
+            'prefetch = dockeroo.prefetch:extension',
+        ],
         'zc.buildout': [
             'docker.build = dockeroo.docker.build:DockerBuildRecipe',
             'docker.copy = dockeroo.docker.copy:DockerCopyRecipe',
@@ -37,6 +37,7 @@ from importlib import import_module
 import os
 import re
 import shutil
+import sys
 from unittest import TestSuite
 
 from zc.buildout.testing import buildoutSetUp, buildoutTearDown, install_develop
@@ -125,7 +126,15 @@ PATTERNS = (
 
 MODULES = [
     'dockeroo',
+    'dockeroo.diskimage',
     'dockeroo.docker',
+    'dockeroo.docker.api',
+    'dockeroo.docker.cache',
+    'dockeroo.docker.listing',
+    'dockeroo.docker.portage',
+    'dockeroo.docker_machine',
+    'dockeroo.parallel',
+    'dockeroo.prefetch',
 #    'dockeroo.docker.build',
 #    'dockeroo.docker.copy',
 #    'dockeroo.docker.gentoo_bootstrap',
@@ -143,9 +152,12 @@ MODULES = [
     'dockeroo.setup.egg',
     'dockeroo.setup.shell_script',
     'dockeroo.setup.template',
-#    'dockeroo.utils',
+    'dockeroo.utils',
 ]
 
+if sys.version_info >= (3, 5):
+    MODULES.insert(2, 'dockeroo.docker.aio')
+
 tests = TestSuite(
     map(lambda module: DocTestSuite(import_module(module),
         setUp=setUp,
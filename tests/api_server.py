@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from future import standard_library
+standard_library.install_aliases()
+
+from http.server import BaseHTTPRequestHandler # pylint: disable=wrong-import-position,wrong-import-order
+from socketserver import ThreadingMixIn, UnixStreamServer # pylint: disable=wrong-import-position,wrong-import-order
+from urllib.parse import urlparse # pylint: disable=wrong-import-position,wrong-import-order
+
+
+class StandInDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def address_string(self):
+        return 'unix'
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def respond(self):
+        url = urlparse(self.path)
+        path = url.path.split('/', 2)[-1] if url.path.startswith('/v') else url.path[1:]
+        path = '/' + path
+        body = self.read_body()
+        self.server.requests.append((self.command, path, url.query, body))
+        status, payload = self.server.routes.get((self.command, path), (404, {
+            'message': 'No such route: {} {}'.format(self.command, path)}))
+        if callable(payload):
+            payload = payload(url.query, body)
+        if payload is None:
+            data = b''
+        elif isinstance(payload, bytes):
+            data = payload
+        else:
+            data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = respond
+
+
+class StandInDockerServer(ThreadingMixIn, UnixStreamServer):
+    """
+    Stand-in Docker Engine API serving canned responses on a unix socket.
+    **routes** maps (method, path) to (status, payload); payload may be a
+    callable receiving the query string and the request body.
+    """
+    daemon_threads = True
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'docker.sock')
+        UnixStreamServer.__init__(self, self.socket_path, StandInDockerHandler)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'unix://{}'.format(self.socket_path)
+
+    def shutdown(self):
+        UnixStreamServer.shutdown(self)
+        self.server_close()
+        shutil.rmtree(self.directory)
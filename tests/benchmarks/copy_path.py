@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput of DockerEngine.copy_path on a synthetic rootfs archive, re-encoding
+members with tarfile versus forwarding the archive verbatim. **cat** processes
+stand in for the **docker cp** reader and writer.
+
+Usage: python tests/benchmarks/copy_path.py [MEGABYTES]
+"""
+
+from io import BytesIO
+import logging
+import os
+from subprocess import Popen, PIPE
+import sys
+import tarfile
+import tempfile
+import time
+
+from dockeroo.docker import DockerEngine
+
+
+FILE_SIZES = [512, 4096, 65536, 1 << 20, 8 << 20]
+
+
+class PipeEngine(DockerEngine):
+
+    def __init__(self, archive): # pylint: disable=super-init-not-called
+        self.archive = archive
+        self.logger = logging.getLogger(__name__)
+        self.transfer_compression = None
+
+    def archive_reader(self, container, path):
+        return Popen(['cat', self.archive], stdout=PIPE, stderr=PIPE)
+
+    def archive_writer(self, container, path):
+        return Popen(['sh', '-c', 'cat >/dev/null'], stdin=PIPE, stderr=PIPE)
+
+
+def synthetic_rootfs(path, megabytes):
+    block = os.urandom(1 << 20)
+    total = 0
+    num = 0
+    with tarfile.open(path, 'w') as tar:
+        root = tarfile.TarInfo('dockeroo-root')
+        root.type = tarfile.DIRTYPE
+        tar.addfile(root)
+        while total < megabytes << 20:
+            size = FILE_SIZES[num % len(FILE_SIZES)]
+            info = tarfile.TarInfo('dockeroo-root/usr/lib/{:06d}'.format(num))
+            info.size = size
+            tar.addfile(info, BytesIO((block * (size // len(block) + 1))[:size]))
+            total += size
+            num += 1
+    return num
+
+
+def measure(engine, **kwargs):
+    start = time.time()
+    engine.copy_path('src', 'dst', '/usr/x86_64-dockeroo-linux-gnu/dockeroo-root/',
+                     dst='/', **kwargs)
+    return os.path.getsize(engine.archive) / (time.time() - start) / (1 << 20)
+
+
+def main(megabytes=2048):
+    fd, path = tempfile.mkstemp(suffix='.tar')
+    os.close(fd)
+    try:
+        members = synthetic_rootfs(path, megabytes)
+        engine = PipeEngine(path)
+        print("{} MiB archive, {} members".format(os.path.getsize(path) >> 20, members))
+        print("tarfile re-encoding: {:>8.0f} MiB/s".format(
+            measure(engine, processor=lambda x: x)))
+        print("verbatim forwarding: {:>8.0f} MiB/s".format(measure(engine)))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
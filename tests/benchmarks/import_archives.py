@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Peak memory and time of DockerEngine.import_archives on a synthetic archive,
+importing it twice under two prefixes. Each run happens in its own process,
+the imported stream is discarded by **cat**.
+
+Usage: python tests/benchmarks/import_archives.py [MEMBERS]
+"""
+
+import logging
+import os
+import resource
+from subprocess import Popen, PIPE, check_output
+import sys
+import tarfile
+import tempfile
+import time
+
+from dockeroo.docker import Archive, DockerEngine
+
+
+class PipeEngine(DockerEngine):
+
+    def __init__(self): # pylint: disable=super-init-not-called
+        self.logger = logging.getLogger(__name__)
+        self.cache = None
+        self.transfer_compression = None
+
+    def import_writer(self, image):
+        return Popen(['sh', '-c', 'cat >/dev/null'], stdin=PIPE, stderr=PIPE)
+
+
+def legacy_import(image, *archives):
+    # Member loop and dedup as they were before streaming.
+    paths = set()
+    proc = PipeEngine().import_writer(image)
+    tar_out = tarfile.open(fileobj=proc.stdin, mode='w|')
+    for archive in archives:
+        tar_in = tarfile.open(name=archive.path, mode='r')
+        for tarinfo in list(tar_in):
+            tarinfo.name = os.path.join(archive.prefix, tarinfo.name)
+            if tarinfo.name in paths:
+                continue
+            paths.add(tarinfo.name)
+            if tarinfo.isreg():
+                tar_out.addfile(tarinfo, fileobj=tar_in.extractfile(tarinfo))
+            else:
+                tar_out.addfile(tarinfo)
+    tar_out.close()
+    proc.stdin.close()
+    proc.wait()
+
+
+def synthetic_archive(path, members):
+    with tarfile.open(path, 'w') as tar:
+        for num in range(members):
+            info = tarfile.TarInfo('usr/share/{:04d}/{:06d}'.format(num // 1000, num))
+            if num % 1000 == 0:
+                info.name = os.path.dirname(info.name)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+            tar.addfile(info)
+
+
+def peak_rss():
+    # ru_maxrss carries the parent's peak over fork, VmHWM is reset on exec.
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # Kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(mode, path):
+    archives = [Archive(path=path, prefix='/a'), Archive(path=path, prefix='/b')]
+    start = time.time()
+    if mode == 'legacy':
+        legacy_import('image', *archives)
+    else:
+        PipeEngine().import_archives('image', *archives)
+    print("{} {}".format(time.time() - start, peak_rss()))
+
+
+def main(members=500000):
+    fd, path = tempfile.mkstemp(suffix='.tar')
+    os.close(fd)
+    try:
+        synthetic_archive(path, members)
+        print("{} members, {} MiB archive, imported twice".format(
+            members, os.path.getsize(path) >> 20))
+        for mode, label in (('legacy', 'materialized members'), ('stream', 'streamed members')):
+            elapsed, maxrss = check_output(
+                [sys.executable, __file__, '--run', mode, path]).split()
+            print("{:<21} {:>7.1f} s {:>7.0f} MiB peak RSS".format(
+                label + ':', float(elapsed), int(maxrss) / 1024.))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(*sys.argv[2:4])
+    else:
+        main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016, Giacomo Cariello. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Rows/second of the container listing parser on a synthetic listing.
+
+Usage: python tests/benchmarks/listing.py [ROWS]
+"""
+
+import json
+import re
+import sys
+import time
+
+import tzlocal
+
+from dockeroo.docker.listing import parse_container
+from dockeroo.utils import parse_datetime
+
+
+SEPARATOR = '|'
+
+PARAMS = ['ID', 'Image', 'Command', 'CreatedAt', 'RunningFor',
+          'Ports', 'Status', 'Size', 'Names', 'Labels', 'Mounts']
+
+
+def synthetic_rows(count):
+    for num in range(count):
+        yield {
+            'ID': '{:012x}'.format(num),
+            'Image': 'registry.example.com/app:{}'.format(num % 50),
+            'Command': '"/bin/sh -c \'exec app --id {}\'"'.format(num),
+            'CreatedAt': '2016-11-{:02d} {:02d}:{:02d}:00 +0100 CET'.format(
+                num % 28 + 1, num % 24, num % 60),
+            'RunningFor': '{} hours ago'.format(num % 100),
+            'Ports': '0.0.0.0:{}->80/tcp'.format(10000 + num % 50000),
+            'Status': 'Up 2 hours' if num % 3 else 'Exited (0) 3 hours ago',
+            'Size': '0 B',
+            'Names': 'app_{}'.format(num),
+            'Labels': 'com.example.role=web,com.example.index={}'.format(num),
+            'Mounts': 'data_{}'.format(num % 10),
+        }
+
+
+def legacy_parse(line):
+    # Row parser as it was before JSON listings.
+    params_map = dict([(x, re.sub(
+        '((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))', r'_\1', x).lower()) for x in PARAMS])
+    container = {}
+    values = line.split(SEPARATOR)
+    for num, param in enumerate(PARAMS):
+        if param in ['Labels', 'Mounts', 'Names', 'Ports']:
+            container[params_map[param]] = values[num].split(',') if values[num] else []
+            if param == 'Labels':
+                container[params_map[param]] = [tuple(
+                    x.split('=')) for x in container[params_map[param]]]
+            elif param == 'Ports':
+                container[params_map[param]] = [tuple(
+                    x.split('->')) for x in container[params_map[param]]]
+        elif param == 'Status':
+            container[params_map[param]] = {
+                'created': 'created',
+                'exited': 'exited',
+                'up': 'running',
+            }[values[num].split(' ')[0].lower()]
+        elif param == 'CreatedAt':
+            container[params_map[param]] = parse_datetime(values[num]).astimezone(
+                tzlocal.get_localzone()).replace(tzinfo=None)
+        else:
+            container[params_map[param]] = values[num] if values[num] else None
+    return container
+
+
+def measure(parser, lines):
+    start = time.time()
+    for line in lines:
+        parser(line)
+    return len(lines) / (time.time() - start)
+
+
+def main(count=10000):
+    rows = list(synthetic_rows(count))
+    legacy = [SEPARATOR.join([x[k] for k in PARAMS]) for x in rows]
+    current = [json.dumps(x) for x in rows]
+    print("{} rows".format(count))
+    print("legacy pipe-separated parser: {:>10.0f} rows/s".format(measure(legacy_parse, legacy)))
+    print("JSON record parser:           {:>10.0f} rows/s".format(
+        measure(parse_container, current)))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])